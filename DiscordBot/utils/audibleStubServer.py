@@ -0,0 +1,154 @@
+"""Local stand-in for the Audible catalog API, used to measure the crawler offline.
+
+Serves /1.0/catalog/products (paged listing, or a batch when `asins` is given)
+and /1.0/catalog/products/<asin> with generated products. Like the real API,
+cover images and subject keywords are only included when the "media" response
+group is requested. It adds an optional per-request latency and an optional rate of
+429 responses, and counts every request it answers. Tests can queue exact
+error responses with StubCatalog.fail_next.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+def make_product(i):
+    end_date = (datetime.utcnow() + timedelta(days=30 + i % 300)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    return {
+        "asin": f"B{i:09d}",
+        "title": f"Stub Book {i}",
+        "authors": [{"name": f"Stub Author {i % 97}"}],
+        "runtime_length_min": 300 + i % 600,
+        "release_date": "2020-01-01",
+        "language": "english",
+        "content_delivery_type": "SinglePartBook",
+        "product_images": {"500": f"https://example.invalid/{i}.jpg"},
+        "plans": [{"plan_name": "US Minerva", "end_date": end_date}],
+        "thesaurus_subject_keywords": ["stub_genre", f"genre_{i % 13}"],
+    }
+
+class StubCatalog:
+    def __init__(self, product_count=1000, latency=0.05, error_rate=0.0):
+        self.products = [make_product(i) for i in range(product_count)]
+        self.by_asin = {product["asin"]: product for product in self.products}
+        self.latency = latency
+        self.error_rate = error_rate
+        self.lock = threading.Lock()
+        self.counts = {"listing": 0, "batch": 0, "detail": 0, "throttled": 0, "failed": 0}
+        self.request_times = []  # time.monotonic() of every request received
+        self.failures = []  # (status, Retry-After or None, listing page or None) served before anything else
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def fail_next(self, status, count=1, retry_after=None, page=None):
+        """Answers the next count requests (or only those for listing page) with status instead of serving them."""
+        with self.lock:
+            self.failures += [(status, retry_after, page)] * count
+
+    def next_failure(self, page=None):
+        """Returns (status, Retry-After) for a queued failure matching this request, or None."""
+        with self.lock:
+            self.request_times.append(time.monotonic())
+            for i, (status, retry_after, failure_page) in enumerate(self.failures):
+                if failure_page is None or failure_page == page:
+                    del self.failures[i]
+                    return status, retry_after
+            return None
+
+MEDIA_FIELDS = ("product_images", "thesaurus_subject_keywords")
+
+def with_response_groups(product, response_groups):
+    """Drops the fields whose response group was not requested."""
+    if "media" in response_groups.split(","):
+        return product
+    return {key: value for key, value in product.items() if key not in MEDIA_FIELDS}
+
+class StubHandler(BaseHTTPRequestHandler):
+    catalog = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, retry_after="0"):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 429 and retry_after is not None:
+            self.send_header("Retry-After", retry_after)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        catalog = self.catalog
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        page = None
+        if url.path.rstrip("/") == "/1.0/catalog/products" and "asins" not in query:
+            page = int(query.get("page", ["1"])[0])
+        failure = catalog.next_failure(page)
+        time.sleep(catalog.latency)
+        if failure is not None:
+            catalog.count("failed")
+            status, retry_after = failure
+            self.send_json(status, {"message": "Injected failure"}, None if retry_after is None else str(retry_after))
+            return
+        if random.random() < catalog.error_rate:
+            catalog.count("throttled")
+            self.send_json(429, {"message": "Too many requests"})
+            return
+
+        parts = url.path.rstrip("/").split("/")
+        response_groups = query.get("response_groups", [""])[0]
+        if url.path.rstrip("/") == "/1.0/catalog/products" and "asins" in query:
+            catalog.count("batch")
+            asins = query["asins"][0].split(",")
+            products = [catalog.by_asin[asin] for asin in asins if asin in catalog.by_asin]
+            self.send_json(200, {"products": [with_response_groups(p, response_groups) for p in products]})
+        elif url.path.rstrip("/") == "/1.0/catalog/products":
+            catalog.count("listing")
+            page = int(query.get("page", ["1"])[0])
+            num_results = int(query.get("num_results", ["50"])[0])
+            start = (page - 1) * num_results
+            products = catalog.products[start:start + num_results]
+            self.send_json(200, {"products": [with_response_groups(p, response_groups) for p in products]})
+        elif len(parts) == 5 and parts[:4] == ["", "1.0", "catalog", "products"]:
+            catalog.count("detail")
+            product = catalog.by_asin.get(parts[4])
+            if product is None:
+                self.send_json(404, {"message": "Not found"})
+            else:
+                self.send_json(200, {"product": with_response_groups(product, response_groups)})
+        else:
+            self.send_json(404, {"message": "Not found"})
+
+def start_server(product_count=1000, latency=0.05, error_rate=0.0, port=0):
+    """Starts the stub on a background thread. Returns (server, catalog, base_url)."""
+    catalog = StubCatalog(product_count, latency, error_rate)
+    handler = type("BoundStubHandler", (StubHandler,), {"catalog": catalog})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, catalog, f"http://127.0.0.1:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a local stub of the Audible catalog API.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = parser.parse_args()
+
+    server, catalog, base_url = start_server(args.products, args.latency, args.error_rate, args.port)
+    print(f"Stub catalog API listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        print(json.dumps(catalog.counts))
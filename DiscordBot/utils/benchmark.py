@@ -0,0 +1,551 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+import mp3Converter
+
+def escape_ffmetadata(value):
+    """Escapes the characters that have a meaning in an FFMETADATA file."""
+    for char in ("\\", "=", ";", "#", "\n"):
+        value = value.replace(char, "\\" + char)
+    return value
+
+def make_fixture(path, chapter_count=10, chapter_seconds=60, source="sine", tags=None, cover=False):
+    """Generates a synthetic M4B with evenly spaced chapters.
+
+    source is "sine" for a 440 Hz tone or "anullsrc" for digital silence, tags
+    the format tags to write (a Benchmark Book by default) and cover adds a
+    PNG as attached picture, the way Audible downloads carry their art.
+    """
+    if tags is None:
+        tags = {"title": "Benchmark Book", "artist": "Benchmark Author"}
+    metadata_path = path + ".ffmeta"
+    with open(metadata_path, "w", encoding="utf-8") as f:
+        f.write(";FFMETADATA1\n")
+        for key, value in tags.items():
+            f.write(f"{key}={escape_ffmetadata(value)}\n")
+        for i in range(chapter_count):
+            f.write("[CHAPTER]\nTIMEBASE=1/1000\n")
+            f.write(f"START={i * chapter_seconds * 1000}\nEND={(i + 1) * chapter_seconds * 1000}\n")
+            f.write(f"title=Chapter {i + 1}\n")
+
+    duration = chapter_count * chapter_seconds
+    audio = "sine=frequency=440:sample_rate=44100" if source == "sine" else "anullsrc=r=44100:cl=stereo"
+    cmd = ["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-t", str(duration), "-i", audio, "-i", metadata_path]
+    if cover:
+        cover_path = path + ".png"
+        subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=300x300:duration=1",
+                        "-frames:v", "1", cover_path], check=True)
+        cmd += ["-i", cover_path, "-map", "2:v", "-c:v", "copy", "-disposition:v", "attached_pic"]
+    cmd += ["-map", "0:a", "-map_metadata", "1", "-map_chapters", "1", "-c:a", "aac", "-b:a", "64k", "-f", "mp4", path]
+    subprocess.run(cmd, check=True)
+    os.remove(metadata_path)
+    if cover:
+        os.remove(cover_path)
+
+    return [
+        {"title": f"Chapter {i + 1}", "start": float(i * chapter_seconds), "end": float((i + 1) * chapter_seconds)}
+        for i in range(chapter_count)
+    ]
+
+def time_call(func, *args):
+    """Returns the wall time in seconds for one call."""
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+def bench_chapter_split(work_dir, chapter_count, chapter_seconds):
+    """Compares the per-chapter ffmpeg loop against the single-pass segment mode."""
+    m4b_path = os.path.join(work_dir, "bench.m4b")
+    chapters = make_fixture(m4b_path, chapter_count, chapter_seconds)
+    pending = list(range(1, len(chapters) + 1))
+    results = {}
+
+    for name, func in (("per_chapter", mp3Converter.convert_chapters_per_chapter),
+                       ("single_pass", mp3Converter.convert_chapters_single_pass)):
+        output_dir = os.path.join(work_dir, name)
+        os.makedirs(output_dir)
+        elapsed = time_call(func, m4b_path, chapters, output_dir, pending)
+        expected = [mp3Converter.chapter_filename(n, chapters[n - 1]) for n in pending]
+        missing = [f for f in expected if not os.path.exists(os.path.join(output_dir, f))]
+        results[name] = {"seconds": elapsed, "missing": len(missing)}
+
+    return results
+
+def bench_catalog(product_count, latency, error_rate, concurrencies, batch_sizes=(1, 50)):
+    """Crawls a local stub of the catalog API at each concurrency level and detail batch size."""
+    import asyncio
+    import audibleStubServer
+    import getAudiblePlusLibrary
+
+    results = {}
+    for concurrency in concurrencies:
+        for batch_size in batch_sizes:
+            server, catalog, base_url = audibleStubServer.start_server(product_count, latency, error_rate)
+            try:
+                start = time.perf_counter()
+                books, requests_sent = asyncio.run(getAudiblePlusLibrary.crawl(base_url, concurrency, 1000, None, batch_size))
+                elapsed = time.perf_counter() - start
+            finally:
+                server.shutdown()
+                server.server_close()
+            results[f"concurrency_{concurrency}_batch_{batch_size}"] = {
+                "seconds": elapsed,
+                "books": len(books),
+                "requests": requests_sent,
+                "requests_per_second": requests_sent / elapsed if elapsed else 0.0,
+                "server_counts": dict(catalog.counts),
+            }
+    return results
+
+def bench_library(book_count, queries=("tolkien", "harr", "hobit tolkein", "the", "seven year")):
+    """Times searches against a library index filled with synthetic records."""
+    import random
+    import libraryIndex
+
+    words = ["shadow", "river", "empire", "silent", "garden", "winter", "crown", "stone", "harbor", "the", "of",
+             "night", "fire", "hobbit", "seven", "year", "midnight", "glass", "iron", "storm"]
+    authors = [f"{first} {last}" for first in ("John", "Mary", "J.R.R.", "Ursula", "Terry", "Ann", "Neil")
+               for last in ("Tolkien", "Pratchett", "Gaiman", "Le Guin", "Smith", "Harrison", "Leckie")]
+    genres = ["Fantasy", "Science Fiction", "Mystery", "History", "Biography", "Thriller", "Romance"]
+    rng = random.Random(1)
+
+    work_dir = tempfile.mkdtemp(prefix="audiobook_bench_")
+    try:
+        index = libraryIndex.LibraryIndex(os.path.join(work_dir, "library.db"), os.path.join(work_dir, "covers"))
+        for i in range(book_count):
+            title = " ".join(rng.choice(words).capitalize() for _ in range(rng.randint(2, 5))) + f" {i}"
+            record = {"title": title, "author": rng.choice(authors), "genre": rng.choice(genres),
+                      "duration": rng.uniform(3600, 72000), "cover_path": None}
+            index.upsert(os.path.join(work_dir, f"book_{i}.m4b"), 0, 0, record, commit=False)
+        index.commit()
+        build_seconds = time_call(index.build)
+        load_seconds = time_call(index.load)
+
+        results = {"build": build_seconds, "load": load_seconds}
+        for query in queries:
+            runs = 50
+            elapsed = time_call(lambda: [index.search(query) for _ in range(runs)]) / runs
+            results[query] = {"ms": elapsed * 1000, "hits": len(index.search(query, limit=book_count))}
+        results["facets_ms"] = time_call(index.facets) * 1000
+        index.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def make_library(library_dir, book_count, book_seconds):
+    """Generates book_count tagged M4B files with cover art by remuxing one encoded book."""
+    os.makedirs(library_dir)
+    source = os.path.join(library_dir, ".source.m4b")
+    cover = os.path.join(library_dir, ".cover.png")
+    subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=300x300:duration=1",
+                    "-frames:v", "1", cover], check=True)
+    subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"sine=frequency=440:duration={book_seconds}",
+                    "-c:a", "aac", "-b:a", "32k", "-f", "mp4", source], check=True)
+    for i in range(book_count):
+        subprocess.run([
+            "ffmpeg", "-y", "-v", "error", "-i", source, "-i", cover, "-map", "0:a", "-map", "1:v",
+            "-c", "copy", "-disposition:v", "attached_pic",
+            "-metadata", f"title=Synthetic Book {i}", "-metadata", f"artist=Author {i % 50}",
+            "-metadata", f"genre=Genre {i % 7}", "-f", "mp4", os.path.join(library_dir, f"book_{i:05d}.m4b")
+        ], check=True)
+    os.remove(source)
+    os.remove(cover)
+
+def bench_scan(work_dir, book_count, book_seconds, workers, library_dir=None):
+    """Compares serial mutagen reads with the parallel header-only scanner.
+
+    Runs on a generated library unless library_dir points at an existing one,
+    such as the mounted share, where per-read latency is what the thread pool hides.
+    """
+    import io
+    import libraryIndex
+    from mutagen.mp4 import MP4
+
+    if library_dir is None:
+        library_dir = os.path.join(work_dir, "library")
+        make_library(library_dir, book_count, book_seconds)
+    files = [file for file in os.listdir(library_dir) if file.endswith(".m4b")]
+
+    class CountingFileIO(io.FileIO):
+        bytes_read = 0
+
+        def read(self, size=-1):
+            data = super().read(size)
+            CountingFileIO.bytes_read += len(data)
+            return data
+
+        def readinto(self, buffer):
+            count = super().readinto(buffer)
+            CountingFileIO.bytes_read += count or 0
+            return count
+
+    def mutagen_serial():
+        for file in files:
+            with CountingFileIO(os.path.join(library_dir, file)) as f:
+                try:
+                    MP4(f)
+                except Exception:
+                    pass  # The scanner skips unreadable books too
+
+    results = {}
+    elapsed = time_call(mutagen_serial)
+    results["mutagen_serial"] = {"seconds": elapsed, "files_per_second": len(files) / elapsed,
+                                 "bytes_read": CountingFileIO.bytes_read}
+    for count in workers:
+        index = libraryIndex.LibraryIndex(os.path.join(work_dir, f"index_{count}.db"), os.path.join(work_dir, "covers"))
+        index.rescan(library_dir, count)
+        results[f"header_workers_{count}"] = index.last_scan
+        index.close()
+    return results
+
+# Synthetic books for the media suite. Each one stresses something different:
+# many short chapters, long chapters, silence (which encodes differently from
+# a tone), awkward tag text and missing tags.
+MEDIA_FIXTURES = [
+    {"name": "short_tagged", "chapters": 3, "chapter_seconds": 20, "source": "sine", "cover": True,
+     "tags": {"title": "Short Book", "artist": "Benchmark Author", "genre": "Fantasy"}},
+    {"name": "many_chapters", "chapters": 60, "chapter_seconds": 10, "source": "sine", "cover": False,
+     "tags": {"title": "Many Chapters", "artist": "Benchmark Author"}},
+    {"name": "long_silent", "chapters": 4, "chapter_seconds": 300, "source": "anullsrc", "cover": True,
+     "tags": {"title": "Ünïcode; Title = Long #1", "artist": "Zoë Author", "genre": "Science Fiction"}},
+    {"name": "untagged", "chapters": 1, "chapter_seconds": 120, "source": "anullsrc", "cover": False, "tags": {}},
+]
+STREAM_SECONDS = 60  # Length of the time-range reads in the streaming benchmarks
+
+def fixture_path(fixture_dir, fixture):
+    """Names a fixture file after its spec, so a changed spec is never served from a stale file."""
+    spec = json.dumps(fixture, sort_keys=True).encode("utf-8")
+    return os.path.join(fixture_dir, f"{fixture['name']}_{hashlib.sha1(spec).hexdigest()[:8]}.m4b")
+
+def make_media_fixtures(fixture_dir, fixtures):
+    """Generates the fixtures missing from fixture_dir and returns their paths by name."""
+    os.makedirs(fixture_dir, exist_ok=True)
+    paths = {}
+    for fixture in fixtures:
+        path = fixture_path(fixture_dir, fixture)
+        if not os.path.exists(path):
+            temp_path = path + ".tmp.m4b"
+            make_fixture(temp_path, fixture["chapters"], fixture["chapter_seconds"], fixture["source"],
+                         fixture["tags"], fixture["cover"])
+            os.replace(temp_path, path)
+        paths[fixture["name"]] = path
+    return paths
+
+def measure(func, repeat, number=1, reset=None):
+    """Runs func number times per round for repeat rounds and returns per-call timings.
+
+    reset, if given, runs untimed before every round (e.g. to empty an output
+    folder). The median is the figure compared between runs; min and the raw
+    rounds are kept to show the noise.
+    """
+    rounds = []
+    for _ in range(repeat):
+        if reset:
+            reset()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    return {"seconds": statistics.median(rounds), "min": min(rounds), "rounds": rounds}
+
+def drain(blocks):
+    """Consumes an iterator of byte blocks and returns the total size."""
+    return sum(len(block) for block in blocks)
+
+def reset_dir(path):
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+
+def bench_media_book(work_dir, path, repeat):
+    """Times chapter extraction, conversion, corruption checks, tag reads and streaming reads for one book."""
+    import chapterIndex
+    import libraryIndex
+    import mp4Tags
+    import smb_access
+
+    results = {}
+    results["extract_chapters_cold"] = measure(lambda: chapterIndex.probe_book(path), repeat)
+    index = chapterIndex.get_index(os.path.dirname(path))
+    book = index.get(path)
+    results["extract_chapters_warm"] = measure(lambda: index.lookup(path), repeat, number=100)
+    chapters, duration = book["chapters"], book["duration"]
+    pending = list(range(1, len(chapters) + 1))
+
+    output_dirs = {}
+    for name, convert in (("single_pass", lambda output_dir: mp3Converter.convert_chapters_single_pass(
+                              path, chapters, output_dir, pending)),
+                          ("per_chapter", lambda output_dir: mp3Converter.convert_chapters_per_chapter(
+                              path, chapters, output_dir, pending))):
+        output_dir = output_dirs[name] = os.path.join(work_dir, name)
+        result = measure(lambda: convert(output_dir), repeat, reset=lambda: reset_dir(output_dir))
+        result["files"] = len(os.listdir(output_dir))
+        result["realtime_factor"] = duration / result["seconds"] if result["seconds"] else 0.0
+        results[f"convert_{name}"] = result
+
+    # The outputs of the last single-pass round are what the corruption checks read
+    mp3s = [os.path.join(output_dirs["single_pass"], name) for name in sorted(os.listdir(output_dirs["single_pass"]))]
+    expected = mp3Converter.expected_durations(chapters)
+    for name, tier in (("corruption_check", "full"), ("corruption_check_quick", "quick")):
+        def check(tier=tier):
+            return [mp3Converter.is_file_corrupt(mp3, *expected[os.path.basename(mp3)], tier=tier) for mp3 in mp3s]
+        result = measure(check, repeat)
+        result["files"] = len(mp3s)
+        result["corrupt"] = sum(check())
+        results[name] = result
+    for output_dir in output_dirs.values():
+        shutil.rmtree(output_dir, ignore_errors=True)
+
+    covers_dir = os.path.join(work_dir, "covers")
+    results["read_header"] = measure(lambda: mp4Tags.read_header(path), repeat, number=20)
+    tags, bytes_read = mp4Tags.read_header(path)
+    results["read_header"].update({"bytes_read": bytes_read, "found": sorted(key for key in tags if key != "cover_format")})
+    results["read_tags"] = measure(lambda: libraryIndex.read_tags(path, covers_dir), repeat, number=20)
+
+    start_time = max(0.0, duration / 2 - STREAM_SECONDS / 2)
+    for name, read in (("read_bytes", lambda: drain(smb_access.iter_byte_range(path))),
+                       ("read_time_range", lambda: drain(smb_access.iter_time_range(path, start_time, STREAM_SECONDS))),
+                       ("stream_mp3", lambda: drain(smb_access.iter_mp3_stream(path, start_time, STREAM_SECONDS)))):
+        result = measure(read, repeat)
+        result["bytes"] = read()
+        result["bytes_per_second"] = result["bytes"] / result["seconds"] if result["seconds"] else 0.0
+        results[name] = result
+    return results
+
+def bench_media(work_dir, fixture_dir, fixtures, repeat, workers=8):
+    """Runs the media benchmarks on every fixture and a tag scan over all of them.
+
+    Returns {"<fixture>.<operation>": timings}, flat so that two runs can be
+    compared key by key.
+    """
+    import libraryIndex
+
+    paths = make_media_fixtures(fixture_dir, fixtures)
+    results = {}
+    for name, path in paths.items():
+        print(f"Benchmarking {name}...", file=sys.stderr)
+        book_dir = os.path.join(work_dir, name)
+        os.makedirs(book_dir)
+        for operation, result in bench_media_book(book_dir, path, repeat).items():
+            results[f"{name}.{operation}"] = result
+
+    db_path = os.path.join(work_dir, "scan.db")
+
+    def scan():
+        index = libraryIndex.LibraryIndex(db_path, os.path.join(work_dir, "scan_covers"))
+        index.rescan(fixture_dir, workers)
+        index.close()
+
+    def reset():
+        if os.path.exists(db_path):
+            os.remove(db_path)
+
+    # A fresh index each round, so every book is read again
+    results["library.rescan"] = measure(scan, repeat, reset=reset)
+    return results
+
+def environment_info():
+    """Describes the machine and tool versions a result file was recorded with."""
+    try:
+        ffmpeg_version = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout.splitlines()[0]
+    except (OSError, IndexError):
+        ffmpeg_version = None
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "ffmpeg": ffmpeg_version,
+        "commit": commit,
+    }
+
+def compare_results(baseline, current, threshold=0.10, min_seconds=0.002):
+    """Compares the median timings of two media runs.
+
+    A benchmark regressed if its median got more than threshold (a fraction)
+    slower, by at least min_seconds, and even its fastest round was slower
+    than the baseline median. The last two conditions keep microsecond noise
+    and one unlucky round from being reported. Returns
+    [(name, baseline seconds, current seconds, status)].
+    """
+    rows = []
+    for name in sorted(set(baseline) | set(current)):
+        if name not in current:
+            rows.append((name, baseline[name]["seconds"], None, "missing"))
+            continue
+        if name not in baseline:
+            rows.append((name, None, current[name]["seconds"], "new"))
+            continue
+        old, new = baseline[name]["seconds"], current[name]["seconds"]
+        status = "ok"
+        if abs(new - old) >= min_seconds and old > 0:
+            if new > old * (1 + threshold) and current[name]["min"] > old:
+                status = "regression"
+            elif new < old * (1 - threshold):
+                status = "improvement"
+        rows.append((name, old, new, status))
+    return rows
+
+def run_chapters(args):
+    if not shutil.which("ffmpeg"):
+        print("ffmpeg is required to run the chapter benchmarks", file=sys.stderr)
+        sys.exit(1)
+
+    work_dir = tempfile.mkdtemp(prefix="audiobook_bench_")
+    try:
+        results = bench_chapter_split(work_dir, args.chapters, args.chapter_seconds)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name, result in results.items():
+        print(f"{name:>12}: {result['seconds']:.2f}s ({result['missing']} missing files)")
+    if results["single_pass"]["seconds"] > 0:
+        print(f"     speedup: {results['per_chapter']['seconds'] / results['single_pass']['seconds']:.2f}x")
+
+def run_catalog(args):
+    results = bench_catalog(args.products, args.latency, args.error_rate, args.concurrency, args.batch_size)
+    for name, result in results.items():
+        print(f"{name:>26}: {result['seconds']:.2f}s, {result['books']} books, "
+              f"{result['requests']} requests ({result['requests_per_second']:.1f}/s), server saw {result['server_counts']}")
+
+def run_library(args):
+    results = bench_library(args.books)
+    print(f"  index build: {results.pop('build') * 1000:.1f}ms, load from disk: {results.pop('load') * 1000:.1f}ms")
+    print(f"       facets: {results.pop('facets_ms'):.3f}ms")
+    for query, result in results.items():
+        print(f"{query!r:>15}: {result['ms']:.2f}ms per search, {result['hits']} hits")
+
+def run_scan(args):
+    if args.library is None and not shutil.which("ffmpeg"):
+        print("ffmpeg is required to build the synthetic library", file=sys.stderr)
+        sys.exit(1)
+
+    work_dir = tempfile.mkdtemp(prefix="audiobook_bench_")
+    try:
+        results = bench_scan(work_dir, args.books, args.chapter_seconds, args.workers, args.library)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name, result in results.items():
+        print(f"{name:>18}: {result['seconds']:.2f}s, {result['files_per_second']:.1f} files/s, "
+              f"{result['bytes_read'] / 1024:.0f} KiB read")
+
+def run_media(args):
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        print("ffmpeg and ffprobe are required to run the media benchmarks", file=sys.stderr)
+        sys.exit(1)
+
+    fixtures = [fixture for fixture in MEDIA_FIXTURES if not args.fixture or fixture["name"] in args.fixture]
+    work_dir = tempfile.mkdtemp(prefix="audiobook_bench_")
+    try:
+        # Keeping fixtures in --fixture-dir lets runs on different commits read the same files
+        fixture_dir = args.fixture_dir or os.path.join(work_dir, "fixtures")
+        results = bench_media(work_dir, fixture_dir, fixtures, args.repeat, max(args.workers))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    for name, result in results.items():
+        extra = ""
+        if "realtime_factor" in result:
+            extra = f", {result['realtime_factor']:.0f}x realtime"
+        elif "bytes_per_second" in result:
+            extra = f", {result['bytes_per_second'] / 1e6:.1f} MB/s"
+        print(f"{name:>40}: {result['seconds'] * 1000:10.2f}ms median, {result['min'] * 1000:10.2f}ms min{extra}")
+
+    if args.output:
+        report = {
+            "suite": "media",
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "environment": environment_info(),
+            "repeat": args.repeat,
+            "fixtures": fixtures,
+            "results": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"Results saved to {args.output}")
+
+def run_compare(args):
+    if len(args.results) != 2:
+        print("Usage: benchmark.py compare <baseline.json> <current.json>", file=sys.stderr)
+        sys.exit(2)
+    reports = []
+    for path in args.results:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                reports.append(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error reading {path}: {e}", file=sys.stderr)
+            sys.exit(2)
+    baseline, current = reports
+
+    for key in ("cpus", "ffmpeg", "platform"):
+        if baseline["environment"].get(key) != current["environment"].get(key):
+            print(f"Warning: {key} differs between runs ({baseline['environment'].get(key)} vs "
+                  f"{current['environment'].get(key)}), timings may not be comparable", file=sys.stderr)
+    if baseline.get("fixtures") != current.get("fixtures"):
+        print("Warning: the runs used different fixtures", file=sys.stderr)
+
+    rows = compare_results(baseline["results"], current["results"], args.threshold)
+    for name, old, new, status in rows:
+        old_text = f"{old * 1000:.2f}ms" if old is not None else "-"
+        new_text = f"{new * 1000:.2f}ms" if new is not None else "-"
+        change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else ""
+        marker = "REGRESSION" if status == "regression" else status
+        print(f"{name:>40}: {old_text:>12} -> {new_text:>12} {change:>8}  {marker}")
+
+    regressions = [row for row in rows if row[3] == "regression"]
+    print(f"{len(regressions)} regression(s) above {args.threshold:.0%} between "
+          f"{baseline['environment'].get('commit')} and {current['environment'].get('commit')}")
+    if regressions:
+        sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the media utilities.")
+    parser.add_argument("suite", nargs="?", default="chapters", choices=["chapters", "catalog", "library", "scan", "media", "compare"],
+                        help="Benchmark to run, or compare to diff two saved media runs")
+    parser.add_argument("results", nargs="*", help="For compare: the baseline and current result files")
+    parser.add_argument("--chapters", type=int, default=20, help="Number of chapters in the synthetic book")
+    parser.add_argument("--chapter-seconds", type=int, default=60, help="Length of each synthetic chapter")
+    parser.add_argument("--products", type=int, default=500, help="Products served by the stub catalog")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub catalog response latency in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Fraction of stub responses that are 429s")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Crawler concurrency levels to compare")
+    parser.add_argument("--books", type=int, default=10000, help="Records in the synthetic library index, or files for the scan suite")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 8], help="Scanner thread counts to compare")
+    parser.add_argument("--library", help="Scan this existing folder of .m4b files instead of a generated one")
+    parser.add_argument("--batch-size", type=int, nargs="+", default=[1, 50], help="Detail batch sizes to compare (1 = per-ASIN requests)")
+    parser.add_argument("--repeat", type=int, default=5, help="Rounds per media benchmark; the median is reported")
+    parser.add_argument("--fixture", nargs="+", help="Only run these media fixtures (by name)")
+    parser.add_argument("--fixture-dir", help="Generate media fixtures here and reuse them on later runs")
+    parser.add_argument("--output", help="Save the media results to this JSON file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Slowdown (fraction) that compare flags as a regression")
+    args = parser.parse_args()
+
+    if args.suite == "chapters":
+        run_chapters(args)
+    elif args.suite == "catalog":
+        run_catalog(args)
+    elif args.suite == "library":
+        run_library(args)
+    elif args.suite == "media":
+        run_media(args)
+    elif args.suite == "compare":
+        run_compare(args)
+    else:
+        run_scan(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import json
+import time
+import sqlite3
+import threading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    asin TEXT PRIMARY KEY,
+    product TEXT NOT NULL,
+    plans_key TEXT NOT NULL,
+    details_plans_key TEXT,
+    seen_sync INTEGER NOT NULL,
+    skipped_sync INTEGER,
+    list_rank INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+def plans_key(product):
+    """Serializes the plans of a product so a changed plan or end_date is easy to spot."""
+    return json.dumps(product.get("plans") or [], sort_keys=True)
+
+class CatalogStore:
+    """Persistent copy of the Plus catalog with a resumable crawl checkpoint, backed by SQLite.
+
+    Every sync gets an id. Listing pages record the products they return under
+    that id and move the checkpoint forward, so an interrupted sync picks up at
+    the next page. A product's details are refetched only when it is new or its
+    plans have changed since the details were stored. A product whose details
+    the API refuses is skipped for the rest of that sync.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        """Closes the underlying database connection."""
+        with self.lock:
+            self.conn.close()
+
+    def get_state(self, key, default=0):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def set_state(self, **values):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                values.items(),
+            )
+            self.conn.commit()
+
+    def begin_sync(self):
+        """Returns (sync id, next listing page), resuming the last sync if it did not finish."""
+        sync_id = self.get_state("current_sync")
+        if sync_id and sync_id != self.get_state("completed_sync"):
+            return sync_id, self.get_state("next_page", 1)
+        sync_id += 1
+        self.set_state(current_sync=sync_id, next_page=1, listing_done=0)
+        return sync_id, 1
+
+    def listing_done(self):
+        return bool(self.get_state("listing_done"))
+
+    def seen_asins(self, sync_id):
+        """Returns the ASINs already listed during this sync."""
+        with self.lock:
+            rows = self.conn.execute("SELECT asin FROM products WHERE seen_sync = ?", (sync_id,)).fetchall()
+        return {row[0] for row in rows}
+
+    def save_listing(self, products, sync_id, next_page, finished=False):
+        """Stores listed products and moves the checkpoint to next_page in one transaction.
+
+        Stored detail fields are kept, so a product whose plans are unchanged
+        does not need its details fetched again.
+        """
+        now = time.time()
+        with self.lock:
+            rank = self.conn.execute("SELECT COUNT(*) FROM products WHERE seen_sync = ?", (sync_id,)).fetchone()[0]
+            for product in products:
+                row = self.conn.execute("SELECT product FROM products WHERE asin = ?", (product["asin"],)).fetchone()
+                merged = {**json.loads(row[0]), **product} if row else product
+                self.conn.execute(
+                    "INSERT INTO products (asin, product, plans_key, seen_sync, list_rank, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT(asin) DO UPDATE SET product = excluded.product, plans_key = excluded.plans_key, "
+                    "seen_sync = excluded.seen_sync, list_rank = excluded.list_rank, updated_at = excluded.updated_at",
+                    (product["asin"], json.dumps(merged), plans_key(product), sync_id, rank, now),
+                )
+                rank += 1
+            self.conn.executemany(
+                "INSERT INTO sync_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (("next_page", next_page), ("listing_done", int(finished))),
+            )
+            self.conn.commit()
+
+    def products_needing_details(self, sync_id, full=False):
+        """Returns {asin: product} for listed products that are new or whose plans changed.
+
+        Products skipped during this sync are left out.
+        """
+        query = "SELECT asin, product FROM products WHERE seen_sync = ? AND skipped_sync IS NOT ?"
+        if not full:
+            query += " AND (details_plans_key IS NULL OR details_plans_key != plans_key)"
+        with self.lock:
+            rows = self.conn.execute(query, (sync_id, sync_id)).fetchall()
+        return {asin: json.loads(product) for asin, product in rows}
+
+    def save_details(self, products):
+        """Stores products merged with their detail fields."""
+        now = time.time()
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE products SET product = ?, details_plans_key = ?, updated_at = ? WHERE asin = ?",
+                [(json.dumps(product), plans_key(product), now, product["asin"]) for product in products],
+            )
+            self.conn.commit()
+
+    def skip_products(self, asins, sync_id):
+        """Marks products whose details cannot be fetched so they do not hold up this sync."""
+        with self.lock:
+            self.conn.executemany(
+                "UPDATE products SET skipped_sync = ? WHERE asin = ?", [(sync_id, asin) for asin in asins]
+            )
+            self.conn.commit()
+
+    def finish_sync(self, sync_id):
+        self.set_state(completed_sync=sync_id)
+
+    def products(self):
+        """Returns the products to export, in listing order.
+
+        These are the products of the last completed sync, plus the products an
+        unfinished sync has listed again, so a stuck or interrupted sync never
+        empties the export. Products whose details were never fetched are left
+        out, as the API refused them.
+        """
+        completed_sync = self.get_state("completed_sync")
+        current_sync = self.get_state("current_sync")
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT product FROM products WHERE seen_sync IN (?, ?) "
+                "AND details_plans_key IS NOT NULL ORDER BY list_rank",
+                (completed_sync, current_sync)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
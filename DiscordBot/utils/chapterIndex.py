@@ -0,0 +1,179 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+import subprocess
+
+# The index lives next to the books and is keyed by file name, so the Windows
+# host and the Linux mount of the same share read the same entries.
+INDEX_FILENAME = ".chapter_index.json"
+
+def file_identity(path):
+    """Returns the (size, mtime in ms) pair used to decide if an entry is stale."""
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns // 1_000_000
+
+def probe_book(path):
+    """Reads chapters, duration and tags for a book with ffprobe."""
+    cmd = [
+        "ffprobe", "-v", "error", "-i", path, "-print_format", "json", "-show_chapters", "-show_format"
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
+    if result.returncode != 0 or not result.stdout.strip():
+        raise RuntimeError(f"ffprobe failed for {path}: {result.stderr}")
+
+    data = json.loads(result.stdout)
+    fmt = data.get("format", {})
+    return {
+        "duration": float(fmt.get("duration", 0) or 0),
+        "tags": fmt.get("tags", {}),
+        "chapters": [
+            {
+                "title": chap.get("tags", {}).get("title", f"Chapter_{i+1}"),
+                "start": float(chap["start_time"]),
+                "end": float(chap["end_time"])
+            }
+            for i, chap in enumerate(data.get("chapters", []))
+        ]
+    }
+
+class ChapterIndex:
+    """On-disk cache of chapter/duration/tag data for the books in one folder."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, INDEX_FILENAME)
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.pending = {}  # Entries probed since the last save
+        self.removed = set()
+        self.loaded_mtime = None
+        self.load()
+
+    def load(self):
+        """Reloads the index from disk if another process has rewritten it."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self.loaded_mtime:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"Error reading chapter index {self.path}: {e}", file=sys.stderr)
+            return
+        with self.lock:
+            entries.update(self.pending)
+            for name in self.removed:
+                entries.pop(name, None)
+            self.entries = entries
+            self.loaded_mtime = mtime
+
+    def save(self):
+        """Merges with the copy on disk and atomically replaces it."""
+        self.load()
+        with self.lock:
+            temp_path = None
+            try:
+                fd, temp_path = tempfile.mkstemp(prefix=".chapter_index_", dir=self.folder)
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(self.entries, f, indent=1)
+                os.replace(temp_path, self.path)
+                self.loaded_mtime = os.stat(self.path).st_mtime_ns
+                self.pending.clear()
+                self.removed.clear()
+            except OSError as e:
+                # A read-only share still works, it just re-probes next time
+                print(f"Error writing chapter index {self.path}: {e}", file=sys.stderr)
+                if temp_path and os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def lookup(self, path):
+        """Returns the entry for a book if it is still current, without probing."""
+        self.load()
+        name = os.path.basename(path)
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry is None:
+            return None
+        try:
+            size, mtime_ms = file_identity(path)
+        except OSError:
+            return None
+        if entry["size"] != size or entry["mtime_ms"] != mtime_ms:
+            return None
+        return entry
+
+    def refresh(self, path, save=True):
+        """Probes a book and stores its entry."""
+        size, mtime_ms = file_identity(path)
+        entry = probe_book(path)
+        entry.update({"size": size, "mtime_ms": mtime_ms})
+        with self.lock:
+            self.entries[os.path.basename(path)] = entry
+            self.pending[os.path.basename(path)] = entry
+        if save:
+            self.save()
+        return entry
+
+    def get(self, path):
+        """Returns the current entry for a book, probing it only if it is new or changed."""
+        return self.lookup(path) or self.refresh(path)
+
+    def build(self):
+        """Refreshes every stale entry in the folder and drops entries for removed books."""
+        names = [name for name in os.listdir(self.folder) if name.lower().endswith(".m4b")]
+        refreshed = 0
+        for name in names:
+            path = os.path.join(self.folder, name)
+            if self.lookup(path) is not None:
+                continue
+            try:
+                self.refresh(path, save=False)
+                refreshed += 1
+            except (OSError, RuntimeError, json.JSONDecodeError) as e:
+                print(f"Error indexing {path}: {e}", file=sys.stderr)
+        with self.lock:
+            for name in set(self.entries) - set(names):
+                del self.entries[name]
+                self.removed.add(name)
+        self.save()
+        return refreshed
+
+indexes = {}
+indexes_lock = threading.Lock()
+
+def get_index(folder):
+    """Returns the shared ChapterIndex for a folder."""
+    folder = os.path.abspath(folder)
+    with indexes_lock:
+        if folder not in indexes:
+            indexes[folder] = ChapterIndex(folder)
+        return indexes[folder]
+
+def get_book(path):
+    """Returns the indexed chapter/duration/tag entry for a book."""
+    return get_index(os.path.dirname(os.path.abspath(path))).get(path)
+
+def get_chapters(path):
+    """Returns the indexed chapter list for a book."""
+    return get_book(path)["chapters"]
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] not in ("build", "lookup"):
+        print("Usage: chapterIndex.py <build <folder>|lookup <file>>", file=sys.stderr)
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == "build":
+        refreshed = get_index(sys.argv[2]).build()
+        print(f"Indexed {refreshed} new or changed books in {sys.argv[2]}")
+    elif command == "lookup":
+        try:
+            print(json.dumps(get_book(sys.argv[2]), indent=2))
+        except (OSError, RuntimeError, json.JSONDecodeError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
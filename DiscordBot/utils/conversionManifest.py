@@ -0,0 +1,179 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+SAMPLE_SIZE = 64 * 1024  # Bytes hashed from each end of a source file
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    fingerprint TEXT NOT NULL,
+    status TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    verified_at REAL NOT NULL,
+    full_verified_at REAL
+);
+"""
+
+def file_sha256(path):
+    """Hashes the full content of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_fingerprint(path, size):
+    """Hashes the size plus the first and last SAMPLE_SIZE bytes of a source file."""
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(SAMPLE_SIZE))
+        if size > SAMPLE_SIZE:
+            f.seek(max(SAMPLE_SIZE, size - SAMPLE_SIZE))
+            digest.update(f.read(SAMPLE_SIZE))
+    return digest.hexdigest()
+
+class ConversionManifest:
+    """Persistent record of source books and verified output files, backed by SQLite."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def close(self):
+        """Closes the underlying database connection."""
+        with self.lock:
+            self.conn.close()
+
+    def is_verified(self, path, tier="full", max_age=None):
+        """Returns True if the file is unchanged since it last passed a check of the given tier.
+
+        A full decode also counts as a quick check. With max_age (seconds) an
+        older full decode no longer counts for the full tier.
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, sha256, ok, full_verified_at FROM outputs WHERE path = ?", (path,)
+            ).fetchone()
+        if not row or not row[3] or row[0] != stat.st_size:
+            return False
+        if tier == "full" and (row[4] is None or (max_age is not None and time.time() - row[4] > max_age)):
+            return False
+        if row[1] == stat.st_mtime_ns:
+            return True
+
+        # Same size but touched since: only trust it if the content is identical
+        if file_sha256(path) != row[2]:
+            return False
+        with self.lock:
+            self.conn.execute("UPDATE outputs SET mtime_ns = ? WHERE path = ?", (stat.st_mtime_ns, path))
+            self.conn.commit()
+        return True
+
+    def record_output(self, path, ok, tier="full"):
+        """Stores the result of a quick or full check for an output file.
+
+        A passing quick check keeps the time of the last full decode as long as
+        the content has not changed since. The file is only hashed again if its
+        size or mtime differ from the stored record.
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, sha256, full_verified_at FROM outputs WHERE path = ?", (path,)
+            ).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            sha256 = row[2]
+        else:
+            try:
+                sha256 = file_sha256(path)
+            except OSError:
+                return
+        now = time.time()
+        with self.lock:
+            full_verified_at = now if ok and tier == "full" else None
+            if ok and tier == "quick" and row and row[2] == sha256:
+                full_verified_at = row[3]
+            self.conn.execute(
+                "INSERT OR REPLACE INTO outputs (path, size, mtime_ns, sha256, ok, verified_at, full_verified_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, sha256, int(ok), now, full_verified_at)
+            )
+            self.conn.commit()
+
+    def forget_output(self, path):
+        """Drops the record for an output file that has been removed or replaced."""
+        path = os.path.abspath(path)
+        with self.lock:
+            self.conn.execute("DELETE FROM outputs WHERE path = ?", (path,))
+            self.conn.commit()
+
+    def source_status(self, path):
+        """Returns the recorded status of a source book, or None if it is new or has changed."""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT size, mtime_ns, fingerprint, status FROM sources WHERE path = ?", (path,)
+            ).fetchone()
+        if not row or row[0] != stat.st_size:
+            return None
+        if row[1] != stat.st_mtime_ns:
+            if source_fingerprint(path, stat.st_size) != row[2]:
+                return None
+            with self.lock:
+                self.conn.execute("UPDATE sources SET mtime_ns = ? WHERE path = ?", (stat.st_mtime_ns, path))
+                self.conn.commit()
+        return row[3]
+
+    def record_source(self, path, status):
+        """Stores the identity of a source book along with its conversion status."""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        fingerprint = source_fingerprint(path, stat.st_size)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sources (path, size, mtime_ns, fingerprint, status, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, fingerprint, status, time.time())
+            )
+            self.conn.commit()
+
+    def import_processed_log(self, log_file, folder):
+        """Seeds the manifest from a legacy processed_files.log, treating its entries as converted."""
+        if not os.path.exists(log_file):
+            return 0
+        with open(log_file, "r") as f:
+            names = [line.strip() for line in f if line.strip()]
+        imported = 0
+        for name in names:
+            path = os.path.join(folder, name)
+            if os.path.exists(path) and self.source_status(path) is None:
+                self.record_source(path, "complete")
+                imported += 1
+        return imported
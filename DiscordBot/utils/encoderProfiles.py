@@ -0,0 +1,230 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import splitPlanner
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CALIBRATION_PATH = os.path.join(script_dir, 'encoder_calibration.json')
+
+# The bot starts smb_access once per request, so playback picks its profile up
+# from the environment; long-running tools also take --profile
+PLAYBACK_PROFILE_ENV = "AUDIOBOOK_PLAYBACK_PROFILE"
+CONVERSION_PROFILE_ENV = "AUDIOBOOK_CONVERSION_PROFILE"
+DEFAULT_PLAYBACK_PROFILE = "playback-mp3"
+DEFAULT_CONVERSION_PROFILE = "archive-mp3"
+
+CALIBRATION_SECONDS = 120  # Audio encoded by each calibration job
+SCALING_GAIN = 1.10  # Adding jobs must raise total throughput by this much to be worth it
+
+# max_bitrate (bits per second) sizes the parts that must fit under the upload
+# limit; None means the output is as big as the source.
+PROFILES = {
+    "archive-mp3": {
+        "description": "128 kbps CBR MP3 for the converted library; sizes follow exactly from duration",
+        "args": ["-c:a", "libmp3lame", "-b:a", "128k"],
+        "format": "mp3",
+        "extension": ".mp3",
+        "stream_args": [],
+        "max_bitrate": 128_000,
+    },
+    "playback-mp3": {
+        "description": "VBR MP3 (-q:a 2) for playback and uploads",
+        "args": ["-c:a", "libmp3lame", "-q:a", "2"],
+        "format": "mp3",
+        "extension": ".mp3",
+        "stream_args": [],
+        "max_bitrate": 320_000,  # Highest bitrate -q:a 2 can pick for a frame
+    },
+    "voice-opus-64k": {
+        "description": "64 kbps Opus at 48 kHz stereo, the format Discord voice sends, tuned for speech",
+        "args": ["-c:a", "libopus", "-b:a", "64k", "-vbr", "constrained", "-application", "voip",
+                 "-frame_duration", "20", "-ar", "48000", "-ac", "2"],
+        "format": "opus",
+        "extension": ".opus",
+        "stream_args": [],
+        "max_bitrate": 80_000,  # Constrained VBR stays near 64 kbps; the rest is Ogg overhead
+    },
+    "passthrough-aac": {
+        "description": "The book's own AAC stream copied without re-encoding",
+        "args": ["-c:a", "copy"],
+        "format": "mp4",
+        "extension": ".m4a",
+        # A fragmented MP4 can be written to a pipe because it needs no trailing moov atom
+        "stream_args": ["-movflags", "frag_keyframe+empty_moov"],
+        "max_bitrate": None,
+    },
+}
+
+def get_profile(name, threads=None, nice=None):
+    """Returns a copy of a named profile, with its ffmpeg thread count and niceness if given."""
+    if name not in PROFILES:
+        raise ValueError(f"Unknown encoder profile {name!r}, expected one of {', '.join(PROFILES)}")
+    return dict(PROFILES[name], name=name, threads=threads, nice=nice or 0)
+
+def profile_from_env(env_name, default):
+    """Returns the profile named by an environment variable, falling back to default if it is unset or unknown."""
+    name = os.environ.get(env_name) or default
+    try:
+        return get_profile(name)
+    except ValueError as e:
+        print(f"{e}; using {default}", file=sys.stderr)
+        return get_profile(default)
+
+def encode_args(profile):
+    """ffmpeg output options that encode (or copy) the audio for a profile."""
+    args = list(profile["args"])
+    if profile["threads"]:
+        args += ["-threads", str(profile["threads"])]
+    return args
+
+def output_args(profile, pipe=False):
+    """ffmpeg muxer options for a profile, with the extra ones needed to write to a pipe."""
+    return ["-f", profile["format"]] + (profile["stream_args"] if pipe else [])
+
+def nice_command(cmd, nice):
+    """Prefixes a command with nice(1) when a niceness increment is given.
+
+    Unlike a preexec_fn this is safe to launch from threads.
+    """
+    return ["nice", "-n", str(nice)] + list(cmd) if nice else list(cmd)
+
+def part_seconds(profile, max_bytes, source_bitrate=None):
+    """Returns the longest part that stays under max_bytes in this profile.
+
+    source_bitrate (bits per second) is needed for profiles that copy the
+    source instead of encoding it.
+    """
+    bitrate = profile["max_bitrate"] or source_bitrate
+    if not bitrate:
+        raise ValueError(f"Profile {profile['name']} needs the source bitrate to size parts")
+    return splitPlanner.max_segment_seconds(bitrate, max_bytes)
+
+def make_sample(path, seconds):
+    """Writes an AAC test file like an Audible download.
+
+    Pink noise is harder to encode than speech, so the calibration errs on the
+    slow side.
+    """
+    cmd = [
+        "ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-t", str(seconds), "-i", "anoisesrc=color=pink:amplitude=0.2:r=44100",
+        "-ac", "2", "-c:a", "aac", "-b:a", "64k", "-f", "mp4", path
+    ]
+    subprocess.run(cmd, check=True)
+
+def time_encodes(sample, profile, jobs, seconds):
+    """Encodes the first seconds of sample jobs times at once and returns the wall time."""
+    cmd = ["ffmpeg", "-v", "error", "-i", sample, "-t", str(seconds), "-map", "0:a:0"]
+    cmd += encode_args(profile) + output_args(profile, pipe=True) + ["pipe:1"]
+    cmd = nice_command(cmd, profile["nice"])
+    start = time.perf_counter()
+    processes = [
+        subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        for _ in range(jobs)
+    ]
+    errors = [process.communicate()[1] for process in processes]
+    elapsed = time.perf_counter() - start
+    for process, error in zip(processes, errors):
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed for profile {profile['name']}: {error.decode(errors='replace')}")
+    return elapsed
+
+def calibrate(profile, sample, seconds=CALIBRATION_SECONDS, max_jobs=None):
+    """Measures how encode throughput scales with concurrent jobs and picks a job count.
+
+    Job counts double from 1 up to max_jobs (the CPU count by default) and
+    stop once another step adds less than SCALING_GAIN. The pick is the
+    fewest jobs within SCALING_GAIN of the best total throughput, since more
+    jobs past that point only add latency to each one.
+    """
+    max_jobs = max_jobs or os.cpu_count() or 1
+    candidates = sorted({2 ** i for i in range(max_jobs.bit_length()) if 2 ** i <= max_jobs} | {max_jobs})
+    runs = []
+    for jobs in candidates:
+        elapsed = time_encodes(sample, profile, jobs, seconds)
+        runs.append({"jobs": jobs, "seconds": round(elapsed, 3), "realtime_factor": round(jobs * seconds / elapsed, 1)})
+        print(f"  {profile['name']}: {jobs} job(s) encode at {runs[-1]['realtime_factor']}x realtime in total",
+              file=sys.stderr)
+        if len(runs) > 1 and runs[-1]["realtime_factor"] < max(run["realtime_factor"] for run in runs[:-1]) * SCALING_GAIN:
+            break
+    best = max(run["realtime_factor"] for run in runs)
+    chosen = min(run["jobs"] for run in runs if run["realtime_factor"] * SCALING_GAIN >= best)
+    return {
+        "jobs": chosen,
+        "single_job_realtime_factor": runs[0]["realtime_factor"],
+        "best_realtime_factor": best,
+        "threads": profile["threads"],
+        "nice": profile["nice"],
+        "cpus": os.cpu_count(),
+        "measured_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "runs": runs,
+    }
+
+def load_calibration(path=DEFAULT_CALIBRATION_PATH):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def save_calibration(results, path=DEFAULT_CALIBRATION_PATH):
+    """Merges results ({profile: calibration}) into the calibration file."""
+    calibration = load_calibration(path)
+    calibration.update(results)
+    fd, temp_path = tempfile.mkstemp(prefix=".calibration_", dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, indent=2)
+    os.replace(temp_path, path)
+
+def calibrated_jobs(name, default=1, path=DEFAULT_CALIBRATION_PATH):
+    """Returns the job count calibrated for a profile on this host, or default if it was never calibrated."""
+    entry = load_calibration(path).get(name)
+    if not entry or entry.get("cpus") != os.cpu_count():
+        return default
+    return entry["jobs"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List encoder profiles or calibrate them on this host.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="Show the available profiles")
+    calibrate_parser = subparsers.add_parser("calibrate", help="Measure encode speed and pick concurrent job counts")
+    calibrate_parser.add_argument("--profile", nargs="+", default=list(PROFILES), choices=list(PROFILES), help="Profiles to calibrate")
+    calibrate_parser.add_argument("--sample", help="Book to encode instead of generated pink noise")
+    calibrate_parser.add_argument("--seconds", type=float, default=CALIBRATION_SECONDS, help="Seconds of audio each job encodes")
+    calibrate_parser.add_argument("--max-jobs", type=int, help="Most concurrent jobs to try (defaults to the CPU count)")
+    calibrate_parser.add_argument("--threads", type=int, help="ffmpeg threads per job")
+    calibrate_parser.add_argument("--nice", type=int, default=0, help="Niceness increment for the ffmpeg processes")
+    calibrate_parser.add_argument("--output", default=DEFAULT_CALIBRATION_PATH, help="Calibration file to update")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for name, profile in PROFILES.items():
+            print(f"{name:<16} {profile['description']}")
+        sys.exit(0)
+
+    work_dir = tempfile.mkdtemp(prefix="encoder_calibration_")
+    try:
+        sample = args.sample
+        if sample is None:
+            sample = os.path.join(work_dir, "sample.m4a")
+            make_sample(sample, args.seconds)
+        results = {}
+        for name in args.profile:
+            try:
+                results[name] = calibrate(get_profile(name, args.threads, args.nice), sample, args.seconds, args.max_jobs)
+            except RuntimeError as e:
+                # e.g. an ffmpeg build without libopus
+                print(f"Skipping {name}: {e}", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    save_calibration(results, args.output)
+    for name, result in results.items():
+        print(f"{name:<16} {result['jobs']} concurrent job(s), {result['single_job_realtime_factor']}x realtime alone, "
+              f"{result['best_realtime_factor']}x in total")
+    print(f"Saved to {args.output}")
@@ -1,8 +1,17 @@
+import os
+import sys
 import requests
 import time
+import random
+import asyncio
+import argparse
+import threading
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 import json
 
+import catalogStore
+
 session_token = "PASTE_SESSION_TOKEN"  # Replace with your session token
 
 headers = {
@@ -20,112 +29,375 @@ base_params = {
     "keywords": "included in audible plus"
 }
 
-url = "https://api.audible.com/1.0/catalog/products"
+API_BASE = "https://api.audible.com"
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "audible_catalog.db")
+DETAIL_BATCH_SIZE = 50  # ASINs per batched detail request
+# Fields parse_book_details needs that the listing's response groups do not carry
+DETAIL_FIELDS = ("product_images", "thesaurus_subject_keywords")
+DETAIL_RESPONSE_GROUPS = "media"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
 
-page = 1
-seen_products = set()
-seen_titles = set()
-results = []
-duplicate_found = False  # Flag to indicate when a duplicate is found
+class ListingIncomplete(Exception):
+    """A listing page could not be fetched, so the crawl stopped before the end of the catalog."""
+    pass
 
-while not duplicate_found:
-    params = {**base_params, "page": page}
-    response = requests.get(url, headers=headers, params=params)
+class TokenBucket:
+    """Allows `rate` requests per second on average with bursts of up to `capacity`."""
 
-    if response.status_code != 200:
-        break
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
 
-    data = response.json()
-    products = data.get("products", [])
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
 
-    if not products:
-        break
+class CatalogClient:
+    """Pooled HTTP client with a concurrency cap, rate limit and retry with backoff.
 
-    for product in products:
-        asin = product.get("asin")
-        title = product.get("title") or product.get("publication_name", "Unknown Title")
-        if asin in seen_products:
-            duplicate_found = True
-            break
-        if title in seen_titles:
+    Requests run on asyncio.to_thread workers. requests.Session makes no
+    thread-safety promise, so each worker thread gets its own session with
+    its own connection pool.
+    """
+
+    def __init__(self, api_base=API_BASE, concurrency=8, rate=10, max_retries=5, backoff_base=0.5, backoff_cap=30):
+        self.api_base = api_base
+        self.concurrency = concurrency
+        self.local = threading.local()
+        self.sessions = []
+        self.sessions_lock = threading.Lock()
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.bucket = TokenBucket(rate)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.requests_sent = 0
+        self.rejected = {}  # Path -> status of requests refused with a 4xx that retrying will not fix
+
+    def session(self):
+        """Returns the calling thread's session, creating it on first use."""
+        session = getattr(self.local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(headers)
+            self.local.session = session
+            with self.sessions_lock:
+                self.sessions.append(session)
+        return session
+
+    def get(self, url, params):
+        return self.session().get(url, params=params, timeout=30)
+
+    def backoff_delay(self, attempt, response=None):
+        """Seconds to wait before retry number attempt + 1.
+
+        Exponential with jitter and capped at backoff_cap, but never shorter
+        than a numeric Retry-After the server sent.
+        """
+        delay = min(self.backoff_cap, self.backoff_base * 2 ** attempt * (0.5 + random.random()))
+        if response is not None:
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, int(retry_after))
+        return delay
+
+    async def get_json(self, path, params):
+        """GETs a JSON document, retrying 429/5xx responses and connection errors with backoff."""
+        for attempt in range(self.max_retries + 1):
+            await self.bucket.acquire()
+            async with self.semaphore:
+                self.requests_sent += 1
+                try:
+                    response = await asyncio.to_thread(self.get, self.api_base + path, params)
+                except requests.RequestException as e:
+                    response = None
+                    error = str(e)
+            if response is not None and response.status_code == 200:
+                return response.json()
+            if response is not None and response.status_code not in RETRY_STATUSES:
+                print(f"Request for {path} failed: {response.status_code}", file=sys.stderr)
+                if 400 <= response.status_code < 500:
+                    self.rejected[path] = response.status_code
+                return None
+            if attempt == self.max_retries:
+                break
+
+            delay = self.backoff_delay(attempt, response)
+            if response is not None:
+                error = response.status_code
+            print(f"Retrying {path} in {delay:.1f}s ({error})", file=sys.stderr)
+            await asyncio.sleep(delay)
+
+        print(f"Giving up on {path} after {self.max_retries + 1} attempts", file=sys.stderr)
+        return None
+
+    def close(self):
+        with self.sessions_lock:
+            for session in self.sessions:
+                session.close()
+            self.sessions = []
+
+async def crawl_listing(client, max_pages=None, start_page=1, seen=None, on_batch=None):
+    """Fetches listing pages in concurrent batches until the catalog runs out or starts repeating.
+
+    seen holds ASINs already listed by an interrupted sync. on_batch, if given, is
+    called with the new products of each batch, the next page to fetch and
+    whether the listing is finished, so callers can checkpoint as they go.
+
+    A page that fails (retries exhausted or a 4xx) is not the end of the
+    catalog: the crawl stops there without finishing, and the next page
+    reported is the failed one so a resumed crawl fetches it again. Returns
+    ({asin: product}, whether the listing reached its end).
+    """
+    seen_products = {}
+    seen = set(seen or ())
+    page = start_page
+    batch_size = client.concurrency
+    while max_pages is None or page <= max_pages:
+        pages = range(page, page + batch_size if max_pages is None else min(page + batch_size, max_pages + 1))
+        responses = await asyncio.gather(*(
+            client.get_json("/1.0/catalog/products", {**base_params, "page": p}) for p in pages
+        ))
+
+        finished = False
+        failed_page = None
+        batch_products = []
+        for p, data in zip(pages, responses):
+            if data is None:
+                failed_page = p
+                break
+            products = data.get("products", [])
+            if not products:
+                finished = True
+                break
+            new_products = [product for product in products if product.get("asin") not in seen]
+            if not new_products:
+                # The API wraps around to earlier results once it runs out
+                finished = True
+                break
+            for product in new_products:
+                seen.add(product.get("asin"))
+                seen_products[product.get("asin")] = product
+            batch_products.extend(new_products)
+        if failed_page is not None:
+            print(f"Listing page {failed_page} could not be fetched; stopping the crawl there", file=sys.stderr)
+            if on_batch:
+                on_batch(batch_products, failed_page, False)
+            return seen_products, False
+        page += len(pages)
+        if on_batch:
+            on_batch(batch_products, page, finished or (max_pages is not None and page > max_pages))
+        if finished:
             break
+    return seen_products, True
 
-        seen_products.add(asin)
-        seen_titles.add(title)
-
-        plans = product.get("plans", [])
-        title = product.get("title") or product.get("publication_name", "Unknown Title")
-        authors = [author.get("name", "Unknown Author") for author in product.get("authors", [])]  # Extract author names
-        runtime = product.get("runtime_length_min", "Unknown Runtime")
-        release_date = product.get("release_date", "Unknown Release Date")
-        language = product.get("language", "Unknown Language")
-        delivery = product.get("content_delivery_type", "Unknown")
-        codecs = [c.get("name", "Unknown Codec") for c in product.get("available_codecs", [])]
-        cover_image = (product.get("images", {}) or product.get("product_images", {})).get("primary", {}).get("url", "No Image Available")
-        genres = product.get("genres", ["Unknown Genre"])  # Extract genres
-
-        minerva_plan = next((plan for plan in plans if plan.get("plan_name") == "US Minerva"), None)
-        if minerva_plan:
-            end_date = minerva_plan.get("end_date")
-            if end_date:
-                end_date_obj = datetime.strptime(end_date, "%Y-%m-%dT%H:%M:%S.%fZ")
-                days_left = (end_date_obj - datetime.utcnow()).days
-
-                results.append({
-                    "title": title,
-                    "authors": authors,
-                    "runtime": runtime,
-                    "release_date": release_date,
-                    "language": language,
-                    "delivery": delivery,
-                    "codecs": codecs,
-                    "cover_image": cover_image,
-                    "genres": genres,
-                    "end_date": end_date_obj.strftime("%Y-%m-%d"),
-                    "days_left": days_left
-                })
-                
-        if not duplicate_found:
-            page += 1
-            time.sleep(0.5)
-
-def fetch_book_details(asin):
-    """Fetch detailed information for a specific book using its ASIN."""
-    url = f"https://api.audible.com/1.0/catalog/products/{asin}"
+def parse_book_details(product):
+    """Builds the output record for a product, or None if it is not in the Plus catalog."""
+    plans = product.get("plans", [])
+    minerva_plan = next((plan for plan in plans if plan.get("plan_name") == "US Minerva"), None)
+    if minerva_plan:
+        end_date = minerva_plan.get("end_date")
+        if end_date:
+            end_date_obj = datetime.strptime(end_date, "%Y-%m-%dT%H:%M:%S.%fZ")
+            days_left = (end_date_obj - datetime.utcnow()).days
+
+            return {
+                "title": product.get("title", "Unknown Title"),
+                "authors": (product.get("authors") or [{}])[0].get("name", "Unknown Author"),
+                "cover_image": product.get("product_images", {}).get("500", "No Image Available"),
+                "runtime": product.get("runtime_length_min", "Unknown Runtime"),
+                "release_date": product.get("release_date", "Unknown Release Date"),
+                "genres": product.get("thesaurus_subject_keywords", ["Unknown Genre"]),
+                "days_left": days_left,
+            }
+    return None
+
+def product_path(asin):
+    return f"/1.0/catalog/products/{asin}"
+
+async def fetch_product(client, asin):
+    """Fetches the full product record for a single ASIN."""
     params = {
         "response_groups": "product_desc,product_attrs,product_plans,media",
     }
-    response = requests.get(url, headers=headers, params=params)
-
-    if response.status_code == 200:
-        product = response.json().get("product", {})
-        plans = product.get("plans", [])
-        minerva_plan = next((plan for plan in plans if plan.get("plan_name") == "US Minerva"), None)
-        if minerva_plan:
-            end_date = minerva_plan.get("end_date")
-            if end_date:
-                end_date_obj = datetime.strptime(end_date, "%Y-%m-%dT%H:%M:%S.%fZ")
-                days_left = (end_date_obj - datetime.utcnow()).days
-
-                return {
-                    "title": product.get("title", "Unknown Title"),
-                    "authors": product.get("authors")[0].get("name", "Unknown Author"),
-                    "cover_image": product.get("product_images", {}).get("500", "No Image Available"),
-                    "runtime": product.get("runtime_length_min", "Unknown Runtime"),
-                    "release_date": product.get("release_date", "Unknown Release Date"),
-                    "genres": product.get("thesaurus_subject_keywords", ["Unknown Genre"]),
-                    "days_left": days_left,
-                }
-    else:
-        print(f"Failed to fetch details for ASIN {asin}: {response.status_code}")
+    data = await client.get_json(product_path(asin), params)
+    if data is None:
+        print(f"Failed to fetch details for ASIN {asin}", file=sys.stderr)
         return None
+    return data.get("product", {})
+
+async def fetch_book_details(client, asin):
+    """Fetch detailed information for a specific book using its ASIN."""
+    product = await fetch_product(client, asin)
+    return parse_book_details(product) if product is not None else None
+
+def has_details(product):
+    return all(field in product for field in DETAIL_FIELDS)
+
+async def fetch_details_batch(client, products):
+    """Fills in the detail fields for a batch of listing products with one request.
+
+    Only the response groups the listing did not include are requested; anything
+    the batch response leaves out falls back to a per-ASIN request. Returns the
+    merged products, with None for any that could not be fetched.
+    """
+    asins = [product["asin"] for product in products]
+    data = await client.get_json("/1.0/catalog/products", {
+        "asins": ",".join(asins),
+        "response_groups": DETAIL_RESPONSE_GROUPS,
+        "num_results": len(asins),
+    })
+    fetched = {item.get("asin"): item for item in (data or {}).get("products", [])}
+
+    details = []
+    for product in products:
+        extra = fetched.get(product["asin"])
+        if extra is None:
+            full_product = await fetch_product(client, product["asin"])
+            details.append({**product, **full_product} if full_product is not None else None)
+            continue
+        details.append({**product, **{field: extra[field] for field in DETAIL_FIELDS if field in extra}})
+    return details
+
+async def fetch_all_details(client, seen_products, batch_size=DETAIL_BATCH_SIZE, on_batch=None):
+    """Returns every listed product merged with its detail fields, batching the ASINs that need them.
+
+    on_batch, if given, is called with the merged products of each finished request.
+    """
+    async def fetch_one(asin):
+        product = await fetch_product(client, asin)
+        merged = [{**seen_products[asin], **product}] if product is not None else [None]
+        if on_batch:
+            on_batch([p for p in merged if p])
+        return merged
+
+    async def fetch_batch(batch):
+        merged = await fetch_details_batch(client, batch)
+        if on_batch:
+            on_batch([p for p in merged if p])
+        return merged
+
+    complete = [product for product in seen_products.values() if has_details(product)]
+    missing = [product for product in seen_products.values() if not has_details(product)]
+    if complete and on_batch:
+        on_batch(complete)
+    if batch_size <= 1:
+        results = await asyncio.gather(*(fetch_one(product["asin"]) for product in missing))
+    else:
+        batches = [missing[i:i + batch_size] for i in range(0, len(missing), batch_size)]
+        results = await asyncio.gather(*(fetch_batch(batch) for batch in batches))
+    return complete + [product for batch in results for product in batch]
+
+def is_excluded(book_details):
+    return any(('bdsm' in genre.lower() or 'la_confidential' in genre.lower() or 'tandem' in genre.lower()) for genre in book_details['genres'])
 
-detailed_books = []
+async def crawl(api_base=API_BASE, concurrency=8, rate=10, max_pages=None, batch_size=DETAIL_BATCH_SIZE):
+    """Crawls the Plus catalog. Returns the detailed, filtered book list and the number of HTTP requests made.
+
+    Raises ListingIncomplete if a listing page could not be fetched, rather
+    than returning part of the catalog as if it were all of it.
+    """
+    client = CatalogClient(api_base, concurrency, rate)
+    try:
+        seen_products, complete = await crawl_listing(client, max_pages)
+        if not complete:
+            raise ListingIncomplete(f"Listing stopped after {len(seen_products)} products")
+        products = await fetch_all_details(client, seen_products, batch_size)
+    finally:
+        client.close()
+    details = [parse_book_details(product) for product in products if product]
+    return [book for book in details if book and not is_excluded(book)], client.requests_sent
+
+async def sync(store, api_base=API_BASE, concurrency=8, rate=10, max_pages=None,
+               batch_size=DETAIL_BATCH_SIZE, full=False):
+    """Brings the catalog store up to date, resuming an interrupted sync. Returns the number of HTTP requests made.
+
+    Unless full is set, details are only fetched for products that are new or
+    whose plans changed since their details were stored.
+    """
+    sync_id, start_page = store.begin_sync()
+    if start_page > 1:
+        print(f"Resuming sync {sync_id} at listing page {start_page}", file=sys.stderr)
+
+    client = CatalogClient(api_base, concurrency, rate)
+    try:
+        if not store.listing_done():
+            def checkpoint(products, next_page, finished):
+                store.save_listing(products, sync_id, next_page, finished)
+            await crawl_listing(client, max_pages, start_page, store.seen_asins(sync_id), checkpoint)
+
+        stale = store.products_needing_details(sync_id, full)
+        # Stored detail fields are out of date for these, so ask for them again
+        stale = {asin: {k: v for k, v in product.items() if k not in DETAIL_FIELDS} for asin, product in stale.items()}
+        print(f"Fetching details for {len(stale)} new or changed products", file=sys.stderr)
+        await fetch_all_details(client, stale, batch_size, store.save_details)
+    finally:
+        client.close()
+
+    # A delisted or missing title answers 404 every time; leave it out of this
+    # sync instead of keeping the sync from ever finishing
+    rejected = [asin for asin in stale if product_path(asin) in client.rejected]
+    if rejected:
+        print(f"Skipping {len(rejected)} products the API refused: {', '.join(rejected)}", file=sys.stderr)
+        store.skip_products(rejected, sync_id)
+
+    # Only a listing that reached an empty page ends the sync; a failed page
+    # leaves the checkpoint there so the next run resumes the listing
+    if not store.listing_done():
+        print("The listing stopped at a failed page; run again to resume this sync", file=sys.stderr)
+    elif not store.products_needing_details(sync_id):
+        store.finish_sync(sync_id)
+    else:
+        print("Some details could not be fetched; run again to finish this sync", file=sys.stderr)
+    return client.requests_sent
+
+def export_books(store, output=None):
+    """Writes the detailed, filtered book list as JSON.
+
+    The list is the last completed sync plus any products of an unfinished
+    sync that already have their details (see CatalogStore.products).
+    """
+    details = [parse_book_details(product) for product in store.products()]
+    books = [book for book in details if book and not is_excluded(book)]
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(books, f, indent=2)
+    else:
+        print(json.dumps(books, indent=2))
+    return books
 
-for asin in seen_products:
-    book_details = fetch_book_details(asin)
-    if book_details and not any(('bdsm' in genre.lower() or 'la_confidential' in genre.lower() or 'tandem' in genre.lower()) for genre in book_details['genres']):
-        detailed_books.append(book_details)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync the Audible Plus catalog into a local store and export it.")
+    parser.add_argument("--api-base", default=API_BASE, help="API root, e.g. a local stub server")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum requests in flight")
+    parser.add_argument("--rate", type=float, default=10, help="Maximum requests per second")
+    parser.add_argument("--max-pages", type=int, help="Stop after this many listing pages")
+    parser.add_argument("--batch-size", type=int, default=DETAIL_BATCH_SIZE, help="ASINs per detail request (1 = one request per ASIN)")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Catalog store to sync into")
+    parser.add_argument("--full", action="store_true", help="Refetch details for every product, not just new or changed ones")
+    parser.add_argument("--export-only", action="store_true", help="Export the stored catalog without syncing")
+    parser.add_argument("--output", help="Write the exported JSON here instead of stdout")
+    args = parser.parse_args()
 
-# Print the detailed books
-print(json.dumps(detailed_books, indent=2))
\ No newline at end of file
+    store = catalogStore.CatalogStore(args.db)
+    try:
+        if not args.export_only:
+            requests_sent = asyncio.run(sync(store, args.api_base, args.concurrency, args.rate,
+                                             args.max_pages, args.batch_size, args.full))
+            print(f"Sync finished with {requests_sent} requests", file=sys.stderr)
+        export_books(store, args.output)
+    finally:
+        store.close()
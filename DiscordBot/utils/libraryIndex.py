@@ -0,0 +1,337 @@
+import os
+import re
+import sys
+import json
+import time
+import bisect
+import heapq
+import sqlite3
+import hashlib
+import argparse
+import struct
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from mutagen.mp4 import MP4
+
+import mp4Tags
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.path.join(script_dir, "library_index.db")
+DEFAULT_COVERS_DIR = os.path.join(script_dir, "library_covers")
+
+DEFAULT_SCAN_WORKERS = 8  # Concurrent tag reads during a rescan
+
+FUZZY_MIN_SIMILARITY = 0.4  # Trigram overlap needed before a misspelt word counts as a match
+FUZZY_MAX_TERMS = 5  # Closest vocabulary words tried for each misspelt query word
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS books (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    title TEXT NOT NULL,
+    author TEXT NOT NULL,
+    genre TEXT NOT NULL,
+    duration REAL NOT NULL,
+    cover_path TEXT,
+    indexed_at REAL NOT NULL
+);
+"""
+
+def tokenize(text):
+    """Splits text into lowercase words for the inverted index."""
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+def trigrams(term):
+    padded = f"  {term} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def read_tags(file_path, covers_dir=None):
+    """Reads title, author, genre, duration and cover art from an m4b file.
+
+    Only the moov header is read (see mp4Tags); files it cannot parse fall back
+    to mutagen. The cover, if any, is written to covers_dir and its path
+    returned in the record. Returns (record, bytes read from the file).
+    """
+    try:
+        tags, bytes_read = mp4Tags.read_header(file_path)
+        cover, cover_format = tags.get("cover"), tags.get("cover_format", "jpg")
+    except (ValueError, struct.error, IndexError):
+        audio = MP4(file_path)
+        mutagen_tags = audio.tags or {}
+        tags = {key: mutagen_tags[atom][0] for key, atom in
+                (("title", "\xa9nam"), ("author", "\xa9ART"), ("genre", "\xa9gen")) if atom in mutagen_tags}
+        tags["duration"] = audio.info.length
+        covers = mutagen_tags.get("covr")
+        cover = bytes(covers[0]) if covers else None
+        cover_format = "png" if covers and covers[0].imageformat == covers[0].FORMAT_PNG else "jpg"
+        bytes_read = 0  # Not measured for the mutagen fallback
+
+    record = {
+        "title": tags.get("title") or os.path.splitext(os.path.basename(file_path))[0],
+        "author": tags.get("author") or "Unknown Author",
+        "genre": tags.get("genre") or "Unknown Genre",
+        "duration": float(tags.get("duration") or 0),
+        "cover_path": None,
+    }
+    if cover and covers_dir:
+        os.makedirs(covers_dir, exist_ok=True)
+        name = hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest() + "." + cover_format
+        record["cover_path"] = os.path.join(covers_dir, name)
+        with open(record["cover_path"], "wb") as f:
+            f.write(cover)
+    return record, bytes_read
+
+class LibraryIndex:
+    """Persistent index of the audiobook library with word search and facet lists.
+
+    Book records live in SQLite so a rescan only rereads the tags of files whose
+    size or mtime changed. Search runs against an in-memory inverted index built
+    from those records: whole and prefix words are found with a binary search
+    over the sorted vocabulary, and misspelt words through a trigram index.
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH, covers_dir=DEFAULT_COVERS_DIR):
+        self.db_path = db_path
+        self.covers_dir = covers_dir
+        self.lock = threading.Lock()
+        self.index_lock = threading.RLock()  # Guards the in-memory records and search structures
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.books = {}
+        self.last_scan = None
+        self.load()
+
+    def close(self):
+        """Closes the underlying database connection."""
+        with self.lock:
+            self.conn.close()
+
+    def load(self):
+        """Reads every stored record and rebuilds the search structures."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, size, mtime_ns, title, author, genre, duration, cover_path FROM books"
+            ).fetchall()
+        with self.index_lock:
+            self.books = {
+                row[0]: {"path": row[0], "file": os.path.basename(row[0]), "size": row[1], "mtime_ns": row[2],
+                         "title": row[3], "author": row[4], "genre": row[5], "duration": row[6], "cover_path": row[7]}
+                for row in rows
+            }
+            self.build()
+
+    def build(self):
+        postings = defaultdict(set)
+        genres = defaultdict(int)
+        authors = defaultdict(int)
+        for path, book in self.books.items():
+            for term in tokenize(f"{book['title']} {book['author']}"):
+                postings[term].add(path)
+            genres[book["genre"]] += 1
+            authors[book["author"]] += 1
+
+        grams = defaultdict(set)
+        for term in postings:
+            for gram in trigrams(term):
+                grams[gram].add(term)
+
+        self.postings = dict(postings)
+        self.vocabulary = sorted(postings)
+        self.grams = dict(grams)
+        self.genre_facets = sorted(genres.items(), key=lambda item: (-item[1], item[0]))
+        self.author_facets = sorted(authors.items(), key=lambda item: (-item[1], item[0]))
+
+    def upsert(self, path, size, mtime_ns, record, commit=True):
+        """Stores the record for one book. Call build() afterwards to make it searchable."""
+        path = os.path.abspath(path)
+        book = {"path": path, "file": os.path.basename(path), "size": size, "mtime_ns": mtime_ns, **record}
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO books (path, size, mtime_ns, title, author, genre, duration, cover_path, indexed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, size, mtime_ns, book["title"], book["author"], book["genre"], book["duration"],
+                 book["cover_path"], time.time()),
+            )
+            if commit:
+                self.conn.commit()
+        self.books[path] = book
+
+    def commit(self):
+        with self.lock:
+            self.conn.commit()
+
+    def remove(self, path, commit=True):
+        with self.lock:
+            self.conn.execute("DELETE FROM books WHERE path = ?", (path,))
+            if commit:
+                self.conn.commit()
+        book = self.books.pop(path, None)
+        if book and book.get("cover_path") and os.path.exists(book["cover_path"]):
+            os.remove(book["cover_path"])
+
+    def rescan(self, folder, workers=DEFAULT_SCAN_WORKERS):
+        """Rereads tags for new or changed books in folder and drops books that are gone.
+
+        The folder is walked with os.scandir and changed books are read on a
+        thread pool, which hides the per-file round trips of a network share.
+        Tags are read without holding the index lock, so searches keep working
+        during a long rescan. Returns (changed, removed) counts; throughput is
+        left in last_scan.
+        """
+        start = time.perf_counter()
+        folder = os.path.abspath(folder)
+        present = set()
+        stale = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".m4b") or not entry.is_file():
+                    continue
+                present.add(entry.path)
+                stat = entry.stat()
+                book = self.books.get(entry.path)
+                if book and book["size"] == stat.st_size and book["mtime_ns"] == stat.st_mtime_ns:
+                    continue
+                stale.append((entry.path, stat))
+
+        def read(item):
+            path, stat = item
+            try:
+                record, bytes_read = read_tags(path, self.covers_dir)
+            except Exception as e:
+                print(f"Error reading {path}: {e}")
+                return None
+            return path, stat.st_size, stat.st_mtime_ns, record, bytes_read
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            updates = [update for update in pool.map(read, stale) if update]
+
+        with self.index_lock:
+            removed = [path for path in self.books if os.path.dirname(path) == folder and path not in present]
+            for path, size, mtime_ns, record, _ in updates:
+                self.upsert(path, size, mtime_ns, record, commit=False)
+            for path in removed:
+                self.remove(path, commit=False)
+            if updates or removed:
+                self.commit()
+                self.build()
+
+        elapsed = time.perf_counter() - start
+        self.last_scan = {
+            "files": len(present),
+            "read": len(stale),
+            "failed": len(stale) - len(updates),
+            "bytes_read": sum(update[4] for update in updates),
+            "seconds": elapsed,
+            "files_per_second": len(stale) / elapsed if elapsed else 0.0,
+        }
+        return len(updates), len(removed)
+
+    def match_term(self, word):
+        """Returns {path: score} for books containing word, a word it prefixes, or a close misspelling."""
+        scores = {}
+        position = bisect.bisect_left(self.vocabulary, word)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(word):
+            term = self.vocabulary[position]
+            position += 1
+            score = 3.0 if term == word else 2.0
+            for path in self.postings[term]:
+                scores[path] = max(scores.get(path, 0.0), score)
+        if scores:
+            return scores
+
+        word_grams = trigrams(word)
+        overlap = defaultdict(int)
+        for gram in word_grams:
+            for term in self.grams.get(gram, ()):
+                overlap[term] += 1
+        candidates = []
+        for term, shared in overlap.items():
+            similarity = shared / (len(word_grams) + len(trigrams(term)) - shared)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                candidates.append((similarity, term))
+        for similarity, term in sorted(candidates, reverse=True)[:FUZZY_MAX_TERMS]:
+            for path in self.postings[term]:
+                scores[path] = max(scores.get(path, 0.0), similarity)
+        return scores
+
+    def search(self, query, limit=25, genre=None, author=None):
+        """Returns the best matching books for a title/author query, optionally within one facet.
+
+        Books matching every query word rank first; if there are none, books
+        matching any word are returned instead.
+        """
+        words = tokenize(query)
+        if not words:
+            return []
+        with self.index_lock:
+            return self.rank(words, limit, genre, author)
+
+    def rank(self, words, limit, genre, author):
+        totals = defaultdict(float)
+        hits = defaultdict(int)
+        for word in words:
+            for path, score in self.match_term(word).items():
+                totals[path] += score
+                hits[path] += 1
+
+        paths = [path for path in totals if hits[path] == len(words)] or list(totals)
+        books = [self.books[path] for path in paths
+                 if (genre is None or self.books[path]["genre"] == genre)
+                 and (author is None or self.books[path]["author"] == author)]
+        return heapq.nsmallest(limit, books, key=lambda book: (-totals[book["path"]], book["title"]))
+
+    def facets(self):
+        """Returns the genre and author facet lists as [name, book count] pairs, most common first."""
+        with self.index_lock:
+            return {"genres": self.genre_facets, "authors": self.author_facets}
+
+    def browse(self, genre=None, author=None):
+        """Returns the books in one genre and/or by one author, sorted by title."""
+        with self.index_lock:
+            books = [book for book in self.books.values()
+                     if (genre is None or book["genre"] == genre) and (author is None or book["author"] == author)]
+        return sorted(books, key=lambda book: book["title"])
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+def get_index(db_path=DEFAULT_DB_PATH):
+    """Returns the shared LibraryIndex for db_path."""
+    with _indexes_lock:
+        if db_path not in _indexes:
+            _indexes[db_path] = LibraryIndex(db_path)
+        return _indexes[db_path]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain and query the audiobook library index.")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="Index database path")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    scan_parser = subparsers.add_parser("scan", help="Index new or changed books in a folder")
+    scan_parser.add_argument("folder")
+    scan_parser.add_argument("--workers", type=int, default=DEFAULT_SCAN_WORKERS, help="Concurrent tag reads")
+    search_parser = subparsers.add_parser("search", help="Search titles and authors")
+    search_parser.add_argument("query")
+    search_parser.add_argument("--limit", type=int, default=25)
+    search_parser.add_argument("--genre")
+    search_parser.add_argument("--author")
+    subparsers.add_parser("facets", help="List genres and authors with book counts")
+    args = parser.parse_args()
+
+    index = LibraryIndex(args.db)
+    try:
+        if args.command == "scan":
+            changed, removed = index.rescan(args.folder, args.workers)
+            scan = index.last_scan
+            print(f"Indexed {changed} changed books, removed {removed}, {len(index.books)} total "
+                  f"in {scan['seconds']:.2f}s ({scan['files_per_second']:.1f} files/s, "
+                  f"{scan['bytes_read']} bytes read)", file=sys.stderr)
+        elif args.command == "search":
+            print(json.dumps(index.search(args.query, args.limit, args.genre, args.author), indent=2))
+        else:
+            print(json.dumps(index.facets(), indent=2))
+    finally:
+        index.close()
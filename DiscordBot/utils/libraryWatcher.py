@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# inotify(7) event bits
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+# Network filesystems do not report changes made by other machines through inotify
+POLLING_FILESYSTEMS = {"cifs", "smb3", "smbfs", "nfs", "nfs4", "fuse.sshfs"}
+
+def filesystem_type(path):
+    """Returns the type of the filesystem holding path, from /proc/mounts, or None if unknown."""
+    path = os.path.realpath(path)
+    best, fs_type = "", None
+    try:
+        with open("/proc/mounts", "r") as f:
+            for line in f:
+                fields = line.split()
+                mount_point = fields[1].replace("\\040", " ")
+                inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+                if inside and len(mount_point) > len(best):
+                    best, fs_type = mount_point, fields[2]
+    except OSError:
+        return None
+    return fs_type
+
+class Inotify:
+    """Minimal inotify binding for watching a single directory."""
+
+    def __init__(self, folder):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(folder), WATCH_MASK) < 0:
+            error = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(error, f"inotify_add_watch failed for {folder}")
+
+    def read_events(self, timeout):
+        """Waits up to timeout seconds (forever if None) and returns [(mask, name)]."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        events = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class LibraryWatcher:
+    """Calls on_ready for each M4B that appears in folder once it has finished copying.
+
+    Uses inotify where the folder's filesystem reports changes, and otherwise
+    (CIFS and other network mounts) compares a directory listing every
+    poll_interval seconds. A file counts as finished once its size and mtime
+    have not moved for settle seconds. With inotify the watcher sleeps in the
+    kernel until something changes, so a quiet library costs nothing.
+
+    With existing set, the books already in the folder are handed over too,
+    each once it has settled. The listing they are taken from is the same one
+    later changes are compared against, so nothing that arrives in between is
+    missed.
+    """
+
+    def __init__(self, folder, on_ready, on_removed=None, settle=10, poll_interval=60, force_polling=False, existing=False):
+        self.folder = os.path.abspath(folder)
+        self.on_ready = on_ready
+        self.on_removed = on_removed
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.pending = {}  # name -> ((size, mtime_ns), monotonic time it last changed)
+        self.inotify = None
+        if not force_polling and filesystem_type(self.folder) not in POLLING_FILESYSTEMS:
+            try:
+                self.inotify = Inotify(self.folder)
+            except (OSError, AttributeError) as e:
+                print(f"inotify unavailable ({e}), polling {self.folder} instead", file=sys.stderr)
+        self.snapshot = self.list_books()
+        if existing:
+            # A file last written more than settle seconds ago has already settled
+            now, wall_now = time.monotonic(), time.time()
+            for name, identity in self.snapshot.items():
+                age = max(0.0, wall_now - identity[1] / 1e9)
+                self.pending[name] = (identity, now - age)
+
+    def list_books(self):
+        """Returns {name: (size, mtime_ns)} for the M4B files in the folder."""
+        books = {}
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(".m4b"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    books[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        return books
+
+    def mark_changed(self, name):
+        self.pending.setdefault(name, (None, time.monotonic()))
+
+    def removed(self, name):
+        self.pending.pop(name, None)
+        if self.on_removed:
+            self.on_removed(name)
+
+    def check_pending(self):
+        """Hands over files whose size and mtime have held still for the settle time."""
+        now = time.monotonic()
+        for name, (identity, changed_at) in list(self.pending.items()):
+            try:
+                stat = os.stat(os.path.join(self.folder, name))
+            except FileNotFoundError:
+                del self.pending[name]
+                continue
+            current = (stat.st_size, stat.st_mtime_ns)
+            if current != identity:
+                self.pending[name] = (current, now)
+            elif stat.st_size > 0 and now - changed_at >= self.settle:
+                del self.pending[name]
+                self.on_ready(name)
+
+    def wait_inotify(self, timeout):
+        for mask, name in self.inotify.read_events(timeout):
+            if mask & IN_Q_OVERFLOW:
+                # Events were dropped; fall back to comparing listings once
+                self.poll_listing()
+            elif not name.endswith(".m4b"):
+                continue
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self.removed(name)
+            else:
+                self.mark_changed(name)
+
+    def poll_listing(self):
+        current = self.list_books()
+        for name, identity in current.items():
+            if self.snapshot.get(name) != identity:
+                self.mark_changed(name)
+        for name in self.snapshot.keys() - current.keys():
+            self.removed(name)
+        self.snapshot = current
+
+    def run_once(self):
+        """Waits for the next change (or settle check) and dispatches ready books."""
+        if self.inotify:
+            # Only wake up on a timer while a copy is being waited out
+            self.wait_inotify(min(self.settle, 1.0) if self.pending else None)
+        else:
+            time.sleep(min(self.settle, self.poll_interval) if self.pending else self.poll_interval)
+            self.poll_listing()
+        self.check_pending()
+
+    def wait_pending(self):
+        """Blocks until every pending book has been handed over or has disappeared."""
+        self.check_pending()
+        while self.pending:
+            time.sleep(min(self.settle, 1.0))
+            self.check_pending()
+
+    def run(self):
+        mode = "inotify" if self.inotify else f"polling every {self.poll_interval}s"
+        print(f"Watching {self.folder} ({mode})")
+        try:
+            while True:
+                self.run_once()
+        finally:
+            if self.inotify:
+                self.inotify.close()
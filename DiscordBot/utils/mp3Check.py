@@ -0,0 +1,177 @@
+import os
+import sys
+import mmap
+import struct
+import argparse
+
+# Bitrates in kbps by [MPEG-1?][layer][index]; index 0 is "free format", 15 is invalid
+BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}  # By version bits
+LAYERS = {3: 1, 2: 2, 1: 3}  # Layer bits -> layer
+HEADER = struct.Struct(">I")
+ID3V1_SIZE = 128
+DURATION_TOLERANCE = 1.0  # Seconds; MP3 frames and encoder padding make lengths inexact
+
+_frame_cache = {}
+
+def parse_header(header):
+    """Returns (frame length, samples, sample rate, stream id) for a 32-bit frame header, or None if it is not one.
+
+    Results are cached on the bits that matter, since a file only ever uses a
+    handful of distinct headers.
+    """
+    if header >> 21 != 0x7FF:
+        return None
+    key = header >> 10  # Everything above the padding bit
+    if key in _frame_cache:
+        info = _frame_cache[key]
+    else:
+        info = None
+        version, layer_bits = (header >> 19) & 3, (header >> 17) & 3
+        bitrate_index, rate_index = (header >> 12) & 15, (header >> 10) & 3
+        if version != 1 and layer_bits != 0 and 0 < bitrate_index < 15 and rate_index != 3:
+            mpeg1 = version == 3
+            layer = LAYERS[layer_bits]
+            bitrate = BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+            sample_rate = SAMPLE_RATES[version][rate_index]
+            samples = 384 if layer == 1 else 1152 if layer == 2 or mpeg1 else 576
+            info = (bitrate, sample_rate, samples, layer, (version, layer_bits, rate_index))
+        _frame_cache[key] = info
+    if info is None:
+        return None
+    bitrate, sample_rate, samples, layer, stream = info
+    padding = (header >> 9) & 1
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        length = samples // 8 * bitrate // sample_rate + padding
+    return length, samples, sample_rate, stream
+
+def id3v2_size(data):
+    """Returns the size of an ID3v2 tag at the start of data, or 0 if there is none."""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def is_info_frame(data, offset, header):
+    """True for the Xing/Info frame LAME writes first, which holds no audio."""
+    mpeg1 = (header >> 19) & 3 == 3
+    mono = (header >> 6) & 3 == 3
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    tag = data[offset + 4 + side_info:offset + 8 + side_info]
+    return tag in (b"Xing", b"Info")
+
+class FrameScan:
+    """What a walk over an MP3's frame headers found."""
+
+    def __init__(self):
+        self.frames = 0
+        self.samples = 0
+        self.sample_rate = 0
+        self.junk_bytes = 0
+        self.error = None
+
+    @property
+    def duration(self):
+        return self.samples / self.sample_rate if self.sample_rate else 0.0
+
+def scan_frames(path):
+    """Walks the frame headers of an MP3 file without decoding any audio.
+
+    The file is memory-mapped and each header gives the offset of the next,
+    so only four bytes per frame are looked at. Bytes that are not part of a
+    frame (other than ID3 tags) are counted as junk and the walk resyncs on the
+    next pair of consecutive valid headers. A frame running past the end of
+    the file, a change of stream format or no frames at all set error.
+    """
+    scan = FrameScan()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            scan.error = "empty file"
+            return scan
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            offset = id3v2_size(data[:10])
+            end = size
+            if size - offset >= ID3V1_SIZE and data[size - ID3V1_SIZE:size - ID3V1_SIZE + 3] == b"TAG":
+                end -= ID3V1_SIZE
+            stream = None
+            while offset + 4 <= end:
+                header = HEADER.unpack_from(data, offset)[0]
+                frame = parse_header(header)
+                if frame is None or (stream is not None and frame[3] != stream):
+                    # Lost sync: look for the next header that is followed by another one
+                    resync = data.find(b"\xff", offset + 1, end)
+                    while resync != -1 and resync + 4 <= end:
+                        candidate = parse_header(HEADER.unpack_from(data, resync)[0])
+                        following = resync + candidate[0] if candidate else end
+                        if candidate and (following == end or (following + 4 <= end and parse_header(
+                                HEADER.unpack_from(data, following)[0]))):
+                            break
+                        resync = data.find(b"\xff", resync + 1, end)
+                    if resync == -1 or resync + 4 > end:
+                        scan.junk_bytes += end - offset
+                        break
+                    scan.junk_bytes += resync - offset
+                    offset = resync
+                    continue
+                length, samples, sample_rate, frame_stream = frame
+                if offset + length > end:
+                    scan.error = f"final frame truncated ({end - offset} of {length} bytes)"
+                    break
+                if stream is None:
+                    stream, scan.sample_rate = frame_stream, sample_rate
+                    if is_info_frame(data, offset, header):
+                        offset += length
+                        continue
+                scan.frames += 1
+                scan.samples += samples
+                offset += length
+    if scan.error is None and scan.frames == 0:
+        scan.error = "no MP3 frames"
+    elif scan.error is None and scan.junk_bytes:
+        scan.error = f"{scan.junk_bytes} bytes outside MP3 frames"
+    return scan
+
+def check(path, expected_seconds=None, tolerance=DURATION_TOLERANCE):
+    """Quick structural check of an MP3. Returns None if it looks sound, otherwise the problem found.
+
+    Catches truncated, empty and partially overwritten files and, given
+    expected_seconds, files that are shorter or longer than planned. Damage
+    inside frame payloads is only found by a full decode.
+    """
+    try:
+        scan = scan_frames(path)
+    except (OSError, ValueError) as e:
+        return f"unreadable: {e}"
+    if scan.error:
+        return scan.error
+    if expected_seconds is not None and abs(scan.duration - expected_seconds) > tolerance:
+        return f"{scan.duration:.2f}s of audio, expected {expected_seconds:.2f}s"
+    return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check MP3 files by walking their frame headers.")
+    parser.add_argument("files", nargs="+", help="MP3 files to check")
+    parser.add_argument("--expected", type=float, help="Expected length of each file in seconds")
+    parser.add_argument("--tolerance", type=float, default=DURATION_TOLERANCE, help="Allowed difference from --expected")
+    args = parser.parse_args()
+    failed = 0
+    for file in args.files:
+        problem = check(file, args.expected, args.tolerance)
+        if problem:
+            failed += 1
+            print(f"{file}: {problem}", file=sys.stderr)
+        else:
+            scan = scan_frames(file)
+            print(f"{file}: ok, {scan.frames} frames, {scan.duration:.2f}s")
+    sys.exit(1 if failed else 0)
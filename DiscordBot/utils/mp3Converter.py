@@ -1,46 +1,348 @@
 import os
+import math
+import random
+import hashlib
 import subprocess
 import json
 import shutil
+import tempfile
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+
+import chapterIndex
+import libraryIndex
+import libraryWatcher
+import splitPlanner
+import encoderProfiles
+import mp3Check
+import pipelineMetrics
+from conversionManifest import ConversionManifest
+
+# Caps the number of ffmpeg/ffprobe processes running at once across all workers
+ffmpeg_slots = threading.BoundedSemaphore(os.cpu_count() or 1)
+log_lock = threading.Lock()
+queue_lock = threading.Lock()
+books_queued = 0
+manifest = None  # ConversionManifest used to skip re-verifying unchanged files
+# Encoder profile for converted chapters (see encoderProfiles). The default
+# archive-mp3 is constant bitrate, so output size follows from duration.
+profile = encoderProfiles.get_profile(encoderProfiles.DEFAULT_CONVERSION_PROFILE)
+
+# Outputs are checked with the quick tier (frame headers and length) unless a
+# full ffmpeg decode is due: never done, older than full_recheck_seconds, or
+# picked by the full_sample_rate sample. verify_tier "full" decodes everything.
+VERIFY_TIERS = ("quick", "full")
+VERIFY_WORKERS = os.cpu_count() or 1  # Full decodes run at once, across all books
+verify_pool = None  # Shared by every book worker, created on first use
+verify_pool_lock = threading.Lock()
+sample_drawn = set()  # Files already given their full_sample_rate draw this run
+sample_lock = threading.Lock()
+verify_tier = "quick"
+full_sample_rate = 0.02
+full_recheck_seconds = 30 * 24 * 3600
+
+def set_ffmpeg_limit(limit):
+    """Sets the global cap on concurrent ffmpeg processes."""
+    global ffmpeg_slots
+    ffmpeg_slots = threading.BoundedSemaphore(max(1, limit))
+
+def set_profile(name, threads=None, nice=None):
+    """Switches conversion to another named encoder profile.
+
+    Only MP3 profiles are accepted: the bot lists a book's .mp3 files and the
+    quick check reads MP3 frames.
+    """
+    global profile
+    new_profile = encoderProfiles.get_profile(name, threads, nice)
+    if new_profile["format"] != "mp3":
+        raise ValueError(f"Conversion needs an MP3 profile, {name} writes {new_profile['format']}")
+    profile = new_profile
+
+def run_ffmpeg(cmd, **kwargs):
+    """Runs an ffmpeg/ffprobe command once a process slot is free."""
+    with ffmpeg_slots:
+        return subprocess.run(cmd, **kwargs)
+
+def append_line(path, line):
+    """Appends a line to a shared log file without interleaving writers."""
+    with log_lock:
+        with open(path, "a") as f:
+            f.write(line + "\n")
 
 def extract_chapters(m4b_path):
-    """Extracts chapter timestamps from an M4B file using ffmpeg."""
-    cmd = [
-        "ffprobe", "-i", m4b_path, "-print_format", "json", "-show_chapters"
-    ]
-    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
-    if result.returncode != 0 or not result.stdout.strip():
-        log_error(f"Failed to extract chapters from {m4b_path}. ffprobe error: {result.stderr}")
-        return []  # Return an empty list if ffprobe fails
-    
+    """Returns chapter timestamps for an M4B file from the shared chapter index."""
+    index = chapterIndex.get_index(os.path.dirname(os.path.abspath(m4b_path)))
     try:
-        chapters = json.loads(result.stdout).get("chapters", [])
+        entry = index.lookup(m4b_path)
+        if entry is None:
+            # Only a cache miss needs an ffprobe process slot
+            with ffmpeg_slots, pipelineMetrics.stage("ffprobe", book=os.path.basename(m4b_path)):
+                entry = index.refresh(m4b_path)
+        return entry["chapters"]
+    except (OSError, RuntimeError) as e:
+        log_error(f"Failed to extract chapters from {m4b_path}. {e}")
     except json.JSONDecodeError as e:
         log_error(f"JSON decoding error for {m4b_path}: {e}")
-        return []  # Return an empty list if JSON parsing fails
-    
-    return [
-        {
-            "title": chap["tags"].get("title", f"Chapter_{i+1}"),
-            "start": float(chap["start_time"]),
-            "end": float(chap["end_time"])
-        }
-        for i, chap in enumerate(chapters)
-    ]
+    return []  # Return an empty list if ffprobe fails
+
+def set_verification(tier="quick", sample_rate=0.02, recheck_days=30):
+    """Sets how outputs are verified; recheck_days of 0 turns off scheduled full decodes."""
+    global verify_tier, full_sample_rate, full_recheck_seconds
+    if tier not in VERIFY_TIERS:
+        raise ValueError(f"Unknown verification tier {tier!r}")
+    verify_tier = tier
+    full_sample_rate = sample_rate
+    full_recheck_seconds = recheck_days * 24 * 3600 if recheck_days else None
+
+def recheck_age(file_path):
+    """Spreads scheduled full decodes of each file between 0.5x and 1.5x the recheck interval.
+
+    Without this a library verified in one night would all fall due again on
+    the same night.
+    """
+    spread = int(hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return full_recheck_seconds * (0.5 + spread)
+
+def sampled_for_full(file_path):
+    """Draws whether a file joins the full-decode sample, once per file per run.
+
+    A book's files are checked several times in a run (before converting and
+    again to confirm it is complete), which would otherwise give each file
+    several chances at a full decode.
+    """
+    path = os.path.abspath(file_path)
+    with sample_lock:
+        if path in sample_drawn:
+            return False
+        sample_drawn.add(path)
+    return random.random() < full_sample_rate
+
+def verification_due(file_path):
+    """Returns the tier of check a file needs now, or None if its manifest record still stands."""
+    if verify_tier == "full":
+        if manifest is not None and manifest.is_verified(file_path, "full"):
+            return None
+        return "full"
+    if manifest is None:
+        return "full" if sampled_for_full(file_path) else "quick"
+    if full_recheck_seconds and not manifest.is_verified(file_path, "full", recheck_age(file_path)):
+        return "full"
+    if sampled_for_full(file_path):
+        return "full"
+    return None if manifest.is_verified(file_path, "quick") else "quick"
+
+def is_file_corrupt(file_path, expected_seconds=None, tolerance=mp3Check.DURATION_TOLERANCE, tier=None):
+    """Checks if an MP3 is corrupt, skipping files the manifest has already verified.
+
+    The quick tier walks the MP3 frame headers and compares the length with
+    expected_seconds; the full tier then also decodes the file with ffmpeg.
+    Without an explicit tier, verification_due picks one.
+    """
+    tier = tier or verification_due(file_path)
+    if tier is None:
+        return False
+    with pipelineMetrics.stage("corruption_check", book=book_label(file_path), tier=tier) as span:
+        span.bytes_in = os.path.getsize(file_path)
+        problem = mp3Check.check(file_path, expected_seconds, tolerance)
+        if problem is None and tier == "full":
+            cmd = ["ffmpeg", "-v", "error", "-i", file_path, "-f", "null", "-"]
+            result = run_ffmpeg(cmd, capture_output=True, text=True, encoding="utf-8")
+            if result.returncode != 0:
+                problem = f"ffmpeg could not decode it: {result.stderr.strip()}"
+    corrupt = problem is not None
+    if corrupt:
+        log_error(f"{file_path} failed the {tier} check: {problem}")
+    if manifest is not None:
+        manifest.record_output(file_path, not corrupt, tier)
+    return corrupt
+
+def get_verify_pool():
+    global verify_pool
+    with verify_pool_lock:
+        if verify_pool is None:
+            verify_pool = ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix="verify")
+        return verify_pool
+
+def find_corrupt(paths, expected=None):
+    """Checks files and returns the corrupt ones.
+
+    expected maps file names to (seconds, tolerance) for the length check.
+    Quick checks are a pure-Python frame walk, which threads would not speed
+    up, so they run one after another in the calling thread. Full decodes go
+    to the shared verify pool, where they overlap while ffmpeg runs, and
+    still wait for an ffmpeg slot.
+    """
+    expected = expected or {}
+
+    def check(path, tier):
+        seconds, tolerance = expected.get(os.path.basename(path), (None, mp3Check.DURATION_TOLERANCE))
+        return is_file_corrupt(path, seconds, tolerance, tier)
+
+    due = [(path, verification_due(path)) for path in paths]
+    full = {path: get_verify_pool().submit(check, path, "full") for path, tier in due if tier == "full"}
+    corrupt = {path for path, tier in due if tier == "quick" and check(path, "quick")}
+    corrupt.update(path for path, future in full.items() if future.result())
+    return [path for path in paths if path in corrupt]
 
-def is_file_corrupt(file_path):
-    """Checks if a file is corrupt using ffmpeg."""
-    cmd = ["ffmpeg", "-v", "error", "-i", file_path, "-f", "null", "-"]
-    result = subprocess.run(cmd, capture_output=True, text=True, encoding="utf-8")
-    return result.returncode != 0
+def book_label(output_path):
+    """Names the book an output file belongs to in metrics: its folder, without failure indicators."""
+    folder = os.path.basename(os.path.dirname(os.path.abspath(output_path)))
+    for indicator in (" - failed", " - corrupt", " - incomplete"):
+        folder = folder.replace(indicator, "")
+    return folder + ".m4b"
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else 0
 
 def log_error(message):
     """Logs an error message to a file."""
-    with open("conversion_errors.log", "a") as log_file:
-        log_file.write(message + "\n")
+    append_line("conversion_errors.log", message)
+
+def chapter_filename(chapter_number, chapter):
+    """Builds the output filename for a chapter."""
+    return f"Chapter_{chapter_number}_{sanitize_filename(chapter['title'].replace(' ', '_'))}.mp3"
+
+def part_filename(chapter_number, chapter, part):
+    """Builds the output filename for one part of a chapter too large for a single upload."""
+    return f"{os.path.splitext(chapter_filename(chapter_number, chapter))[0]}_part{part:03d}.mp3"
+
+def chapter_outputs(chapter_number, chapter):
+    """Returns the filenames a chapter is written to: one file, or numbered parts if it would exceed the upload limit."""
+    parts = math.ceil((chapter["end"] - chapter["start"]) / splitPlanner.max_segment_seconds(profile["max_bitrate"]))
+    if parts <= 1:
+        return [chapter_filename(chapter_number, chapter)]
+    return [part_filename(chapter_number, chapter, part) for part in range(parts)]
+
+def expected_durations(chapters):
+    """Maps each output filename to the (seconds, tolerance) its length is checked against.
+
+    Parts of a split chapter are planned at equal lengths, but each cut may
+    move up to SILENCE_WINDOW to reach a pause, so they get a wider tolerance.
+    """
+    expected = {}
+    for chapter_number, chapter in enumerate(chapters, start=1):
+        names = chapter_outputs(chapter_number, chapter)
+        seconds = (chapter["end"] - chapter["start"]) / len(names)
+        tolerance = mp3Check.DURATION_TOLERANCE
+        if len(names) > 1:
+            tolerance += 2 * splitPlanner.SILENCE_WINDOW
+        for name in names:
+            expected[name] = (seconds, tolerance)
+    return expected
+
+def plan_parts(m4b_path, chapters):
+    """Plans the parts of every chapter, cutting long chapters at pauses where possible."""
+    def silence_finder(start, end):
+        span.media_seconds += end - start
+        return splitPlanner.find_silences(m4b_path, start, end, run=run_ffmpeg)
+    with pipelineMetrics.stage("split_plan", book=os.path.basename(m4b_path)) as span:
+        return splitPlanner.plan_chapters(chapters, profile["max_bitrate"], silence_finder=silence_finder)
+
+def convert_chapter(m4b_path, chapter, chapter_number, output_dir, parts=None):
+    """Converts a single chapter to MP3 with its own ffmpeg process per planned part."""
+    parts = parts or [(chapter["start"], chapter["end"])]
+    names = chapter_outputs(chapter_number, chapter)
+    for (start_time, end_time), name in zip(parts, names):
+        chapter_path = os.path.join(output_dir, name)
+
+        # Convert the chapter to MP3
+        cmd = encoderProfiles.nice_command([
+            "ffmpeg", "-i", m4b_path, "-ss", str(start_time), "-t", str(end_time - start_time)
+        ] + encoderProfiles.encode_args(profile) + [chapter_path], profile["nice"])
+        try:
+            with pipelineMetrics.stage("transcode", book=os.path.basename(m4b_path), chapter=chapter_number) as span:
+                span.media_seconds = end_time - start_time
+                run_ffmpeg(cmd, stderr=subprocess.PIPE, text=True, encoding="utf-8", check=True)
+                span.bytes_out = file_size(chapter_path)
+        except subprocess.CalledProcessError as e:
+            error_message = f"Error processing chapter {chapter_number}: {e.stderr}"
+            print(error_message)
+            log_error(error_message)
+
+def convert_chapters_per_chapter(m4b_path, chapters, output_dir, pending, chapter_workers=1, plan=None):
+    """Converts each pending chapter with its own ffmpeg process, chapter_workers at a time."""
+    with ThreadPoolExecutor(max_workers=max(1, chapter_workers)) as pool:
+        futures = [
+            pool.submit(convert_chapter, m4b_path, chapters[n - 1], n, output_dir, plan[n - 1] if plan else None)
+            for n in pending
+        ]
+        for future in as_completed(futures):
+            future.result()
+
+def convert_chapters_single_pass(m4b_path, chapters, output_dir, pending, plan=None):
+    """Converts all chapters with one ffmpeg process using the segment muxer.
+
+    Every planned part boundary, not just chapter starts, becomes a segment
+    cut, so oversized chapters come out already split. Empty chapters are
+    skipped. Returns False without writing anything if the chapters overlap or
+    are out of order, or if ffmpeg fails, so the caller can convert the
+    chapters one at a time instead.
+    """
+    plan = plan or [[(chapter["start"], chapter["end"])] for chapter in chapters]
+    segments = []  # (chapter number, output filename) for each segment in order
+    bounds = []  # (start, end) of each segment
+    for chapter_number, (chapter, parts) in enumerate(zip(chapters, plan), start=1):
+        for (part_start, part_end), name in zip(parts, chapter_outputs(chapter_number, chapter)):
+            if part_end <= part_start:
+                log_error(f"Skipping empty chapter {chapter_number} of {m4b_path}")
+                continue
+            segments.append((chapter_number, name))
+            bounds.append((part_start, part_end))
+    if not segments:
+        return True
+    if any(following[0] < previous[1] for previous, following in zip(bounds, bounds[1:])):
+        log_error(f"Chapters of {m4b_path} overlap or are out of order; converting them one at a time")
+        return False
+    first_start = bounds[0][0]
+    last_end = bounds[-1][1]
+    # Segment boundaries are relative to the first chapter because of the input seek
+    segment_times = ",".join(f"{part_start - first_start:.6f}" for part_start, _ in bounds[1:])
+    temp_dir = tempfile.mkdtemp(prefix=".segments_", dir=output_dir)
+    segment_pattern = os.path.join(temp_dir, "segment_%04d.mp3")
+
+    cmd = [
+        "ffmpeg", "-v", "error", "-ss", str(first_start), "-i", m4b_path,
+        "-t", str(last_end - first_start), "-map", "0:a:0", "-map_metadata", "-1", "-map_chapters", "-1",
+    ] + encoderProfiles.encode_args(profile) + [
+        "-f", "segment", "-reset_timestamps", "1"
+    ]
+    if segment_times:
+        cmd += ["-segment_times", segment_times]
+    cmd.append(segment_pattern)
+    cmd = encoderProfiles.nice_command(cmd, profile["nice"])
+
+    try:
+        with pipelineMetrics.stage("transcode", book=os.path.basename(m4b_path), chapter="all") as span:
+            span.media_seconds = last_end - first_start
+            span.bytes_in = os.path.getsize(m4b_path)
+            run_ffmpeg(cmd, stderr=subprocess.PIPE, text=True, encoding="utf-8", check=True)
+            span.bytes_out = sum(entry.stat().st_size for entry in os.scandir(temp_dir))
+    except subprocess.CalledProcessError as e:
+        error_message = f"Error processing {m4b_path} in a single pass: {e.stderr}"
+        print(error_message)
+        log_error(error_message)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        return False
+
+    # Move the segments for the pending chapters into place and drop the rest
+    for index, (chapter_number, name) in enumerate(segments):
+        if chapter_number not in pending:
+            continue
+        segment_path = os.path.join(temp_dir, f"segment_{index:04d}.mp3")
+        if os.path.exists(segment_path):
+            os.replace(segment_path, os.path.join(output_dir, name))
+        else:
+            log_error(f"Missing segment {name} for chapter {chapter_number} of {m4b_path}")
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    return True
 
-def convert_and_split(m4b_path, output_dir):
-    """Converts M4B chapters to MP3, skipping valid files and overwriting corrupt ones."""
+def convert_and_split(m4b_path, output_dir, single_pass=True, chapter_workers=1):
+    """Converts M4B chapters to MP3, skipping valid files and overwriting corrupt ones.
+
+    Chapters that would exceed the Discord upload limit are split into parts
+    planned before encoding, so no audio is encoded twice.
+    """
     os.makedirs(output_dir, exist_ok=True)
     chapters = extract_chapters(m4b_path)
     
@@ -48,37 +350,32 @@ def convert_and_split(m4b_path, output_dir):
         log_error(f"No chapters found in {m4b_path}. Skipping file.")
         return  # Skip files without chapters
     
-    for i, chapter in enumerate(chapters):
-        start_time = chapter["start"]
-        end_time = chapter["end"]
-        duration = end_time - start_time
+    outputs = [[os.path.join(output_dir, name) for name in chapter_outputs(i + 1, chapter)]
+               for i, chapter in enumerate(chapters)]
+    corrupt = set(find_corrupt([path for paths in outputs for path in paths if os.path.exists(path)],
+                               expected_durations(chapters)))
+    pending = []
+    for i, chapter_paths in enumerate(outputs):
         chapter_number = i + 1
-        raw_title = f"Chapter_{chapter_number}_{chapter['title'].replace(' ', '_')}"
-        sanitized_title = sanitize_filename(raw_title)
-        chapter_filename = f"{sanitized_title}.mp3"
-        chapter_path = os.path.join(output_dir, chapter_filename)
-        
-        # Skip if the file exists and is not corrupt
-        if os.path.exists(chapter_path) and not is_file_corrupt(chapter_path):
-            print(f"Skipping valid file: {chapter_path}")
-            continue
-        
-        # Convert the chapter to MP3
-        cmd = [
-            "ffmpeg", "-i", m4b_path, "-ss", str(start_time), "-t", str(duration),
-            "-acodec", "libmp3lame", "-b:a", "128k", chapter_path
-        ]
-        try:
-            result = subprocess.run(cmd, stderr=subprocess.PIPE, text=True, encoding="utf-8", check=True)
-        except subprocess.CalledProcessError as e:
-            error_message = f"Error processing chapter {chapter_number}: {e.stderr}"
-            print(error_message)
-            log_error(error_message)
+
+        # Skip if the files exist and are not corrupt
+        if all(os.path.exists(path) and path not in corrupt for path in chapter_paths):
+            print(f"Skipping valid chapter: {chapter_paths[0]}")
             continue
-        
-        # Split large files if necessary
-        if os.path.getsize(chapter_path) > 50 * 1024 * 1024:  # Check if size > 50MB
-            split_and_save(chapter_path, output_dir)
+        pending.append(chapter_number)
+
+    if not pending:
+        return
+
+    plan = plan_parts(m4b_path, chapters)
+    if not single_pass or not convert_chapters_single_pass(m4b_path, chapters, output_dir, pending, plan):
+        convert_chapters_per_chapter(m4b_path, chapters, output_dir, pending, chapter_workers, plan)
+
+    # The plan keeps parts under the limit; anything over it is split without re-encoding
+    written = [os.path.join(output_dir, name) for n in pending for name in chapter_outputs(n, chapters[n - 1])]
+    for chapter_path in splitPlanner.oversized(written):
+        log_error(f"{chapter_path} is over the {splitPlanner.DISCORD_UPLOAD_LIMIT} byte upload limit")
+        split_and_save(chapter_path, output_dir)
 
 def restore_original_folder_name(output_dir):
     """Restores the folder name by removing any failure indicators."""
@@ -101,7 +398,10 @@ def sanitize_filename(filename):
     return sanitized
             
 def split_and_save(file_path, output_dir, max_size_mb=50):
-    """Splits an audio file into smaller parts if it exceeds max_size_mb."""
+    """Splits an audio file into smaller parts if it exceeds max_size_mb.
+
+    Only a fallback for outputs the split plan got wrong; it copies rather than re-encodes.
+    """
     chunk_length = 5 * 60  # 5 minutes in seconds
     base_filename = os.path.splitext(os.path.basename(file_path))[0]
     
@@ -109,18 +409,20 @@ def split_and_save(file_path, output_dir, max_size_mb=50):
         "ffmpeg", "-i", file_path, "-f", "segment", "-segment_time", str(chunk_length),
         "-c", "copy", os.path.join(output_dir, f"{base_filename}_part%03d.mp3")
     ]
-    subprocess.run(cmd, check=True)
+    with pipelineMetrics.stage("split", book=book_label(file_path)) as span:
+        span.bytes_in = os.path.getsize(file_path)
+        run_ffmpeg(cmd, check=True)
     os.remove(file_path)  # Remove the original large file
+    if manifest is not None:
+        manifest.forget_output(file_path)
+
+def check_for_corruption(output_dir, chapters=None):
+    """Checks the MP3 files in the output directory in parallel and returns the corrupt ones.
 
-def check_for_corruption(output_dir):
-    """Checks for corrupt MP3 files in the output directory."""
-    corrupt_files = []
-    for file in os.listdir(output_dir):
-        if file.endswith(".mp3"):
-            file_path = os.path.join(output_dir, file)
-            if is_file_corrupt(file_path):
-                corrupt_files.append(file_path)
-    return corrupt_files
+    Given the book's chapters, each file's length is checked as well.
+    """
+    paths = [os.path.join(output_dir, file) for file in os.listdir(output_dir) if file.endswith(".mp3")]
+    return find_corrupt(paths, expected_durations(chapters) if chapters else None)
 
 def rename_folder(output_dir, suffix):
     """Renames the folder by appending a suffix."""
@@ -138,77 +440,228 @@ def is_book_complete(output_dir, chapters):
         print(f"Output directory is empty: {output_dir}")
         return False
 
+    chapter_paths = []
     for i, chapter in enumerate(chapters):
         chapter_number = i + 1
-        chapter_filename = f"Chapter_{chapter_number}_{sanitize_filename(chapter['title'].replace(' ', '_'))}.mp3"
-        chapter_path = os.path.join(output_dir, chapter_filename)
+        for name in chapter_outputs(chapter_number, chapter):
+            chapter_path = os.path.join(output_dir, name)
 
-        # Check if the chapter file exists
-        if not os.path.exists(chapter_path):
-            print(f"Missing chapter file: {chapter_path}")
-            return False
+            # Check if the chapter file exists
+            if not os.path.exists(chapter_path):
+                print(f"Missing chapter file: {chapter_path}")
+                return False
 
-        # Check if the chapter file is corrupt
-        if is_file_corrupt(chapter_path):
-            print(f"Corrupt chapter file: {chapter_path}")
-            return False
+            # The bot cannot upload anything over the limit
+            if os.path.getsize(chapter_path) > splitPlanner.DISCORD_UPLOAD_LIMIT:
+                print(f"Chapter file over the upload limit: {chapter_path}")
+                return False
+            chapter_paths.append(chapter_path)
+
+    # Check if any chapter file is corrupt
+    corrupt_files = find_corrupt(chapter_paths, expected_durations(chapters))
+    if corrupt_files:
+        print(f"Corrupt chapter file: {corrupt_files[0]}")
+        return False
 
     return True
 
-def main(folder, log_file):
-    """Main function to process all M4B files in the given folder."""
-    processed_files = set()
+def process_book(folder, file, single_pass=True, chapter_workers=1):
+    """Converts one M4B and records its outcome in the manifest."""
+    global books_queued
+    recorder = pipelineMetrics.get_recorder()
+    try:
+        with recorder.stage("book", file=file):
+            convert_book(folder, file, single_pass, chapter_workers)
+    finally:
+        # A crashed book still leaves the queue
+        with queue_lock:
+            books_queued -= 1
+            recorder.set_gauge("books_queued", books_queued)
+
+def queue_books(count):
+    """Tracks the number of books submitted but not yet finished, for the metrics."""
+    global books_queued
+    with queue_lock:
+        books_queued += count
+        pipelineMetrics.get_recorder().set_gauge("books_queued", books_queued)
+
+def convert_book(folder, file, single_pass=True, chapter_workers=1):
+    m4b_path = os.path.join(folder, file)
+    output_dir = os.path.join(folder, os.path.splitext(file)[0])
     
-    # Load processed files from log
-    if os.path.exists(log_file):
-        with open(log_file, 'r') as f:
-            processed_files = set(line.strip() for line in f)
+    # Restore the original folder name if it has an indicator
+    output_dir = restore_original_folder_name(output_dir)
     
-    for file in os.listdir(folder):
-        if file.endswith(".m4b") and file not in processed_files:
-            m4b_path = os.path.join(folder, file)
-            output_dir = os.path.join(folder, os.path.splitext(file)[0])
+    try:
+        chapters = extract_chapters(m4b_path)
+        if os.path.exists(output_dir):
+            # Check if the folder is empty
+            if not os.listdir(output_dir):
+                rename_folder(output_dir, "- failed")
+                return
             
-            # Restore the original folder name if it has an indicator
-            output_dir = restore_original_folder_name(output_dir)
+            # Check for corrupt files
+            corrupt_files = check_for_corruption(output_dir, chapters)
+            if corrupt_files:
+                rename_folder(output_dir, "- corrupt")
+                return
             
+            # Check if the book is complete
+            if is_book_complete(output_dir, chapters):
+                print(f"Book already complete: {file}")
+                record_source(m4b_path, "complete")
+                return
+        
+        # Process the book
+        convert_and_split(m4b_path, output_dir, single_pass, chapter_workers)
+        
+        # Check if the book is complete after processing
+        if is_book_complete(output_dir, chapters):
+            print(f"Book successfully processed: {file}")
+            restore_original_folder_name(output_dir)  # Restore folder name
+            record_source(m4b_path, "complete")
+        else:
+            rename_folder(output_dir, "- incomplete")
+            record_source(m4b_path, "incomplete")
+    except Exception as e:
+        print(f"Error processing {file}: {e}")
+        log_error(f"Error processing {file}: {e}")
+        os.makedirs(output_dir, exist_ok=True)
+        rename_folder(output_dir, "- failed")
+
+def record_source(m4b_path, status):
+    """Records a book's outcome in the manifest, if one is open."""
+    if manifest is not None:
+        manifest.record_source(m4b_path, status)
+
+def needs_processing(folder, file):
+    """Books whose source is unchanged since they were processed are skipped."""
+    if manifest is None:
+        return True
+    return manifest.source_status(os.path.join(folder, file)) not in ("complete", "incomplete")
+
+def report_crash(future, file):
+    try:
+        future.result()
+    except Exception as e:
+        # A crashed worker only affects its own book
+        print(f"Worker for {file} crashed: {e}")
+        log_error(f"Worker for {file} crashed: {e}")
+
+def submit_book(pool, folder, file, single_pass=True, chapter_workers=1):
+    """Queues one book on the book pool, reporting a crash of its worker when it ends."""
+    queue_books(1)
+    future = pool.submit(process_book, folder, file, single_pass, chapter_workers)
+    future.add_done_callback(lambda f: report_crash(f, file))
+    return future
+
+def convert_existing(folder, pool, single_pass=True, chapter_workers=1, settle=10):
+    """Converts the books already in folder, waiting for any still being copied to settle first."""
+    futures = []
+
+    def on_ready(file):
+        if needs_processing(folder, file):
+            futures.append(submit_book(pool, folder, file, single_pass, chapter_workers))
+
+    watcher = libraryWatcher.LibraryWatcher(folder, on_ready, settle=settle, force_polling=True, existing=True)
+    watcher.wait_pending()
+    wait(futures)
+
+def watch(folder, pool, single_pass=True, chapter_workers=1, index_path=None, settle=10, poll_interval=60, force_polling=False):
+    """Queues books for conversion and indexing as they finish arriving in folder. Runs until interrupted.
+
+    The books already in folder are queued first, each once it has settled.
+    """
+    index = libraryIndex.get_index(index_path) if index_path else None
+
+    def reindex():
+        if index is not None:
             try:
-                chapters = extract_chapters(m4b_path)
-                if os.path.exists(output_dir):
-                    # Check if the folder is empty
-                    if not os.listdir(output_dir):
-                        rename_folder(output_dir, "- failed")
-                        continue
-                    
-                    # Check for corrupt files
-                    corrupt_files = check_for_corruption(output_dir)
-                    if corrupt_files:
-                        rename_folder(output_dir, "- corrupt")
-                        continue
-                    
-                    # Check if the book is complete
-                    if is_book_complete(output_dir, chapters):
-                        print(f"Book already complete: {file}")
-                        continue
-                
-                # Process the book
-                convert_and_split(m4b_path, output_dir)
-                
-                # Check if the book is complete after processing
-                if is_book_complete(output_dir, chapters):
-                    print(f"Book successfully processed: {file}")
-                    restore_original_folder_name(output_dir)  # Restore folder name
-                else:
-                    rename_folder(output_dir, "- incomplete")
-                
-                # Log the processed file
-                with open(log_file, 'a') as f:
-                    f.write(file + '\n')
+                index.rescan(folder)
             except Exception as e:
-                print(f"Error processing {file}: {e}")
-                rename_folder(output_dir, "- failed")
+                log_error(f"Error indexing {folder}: {e}")
+
+    def on_ready(file):
+        reindex()
+        if not needs_processing(folder, file):
+            return
+        print(f"Queueing book: {file}")
+        submit_book(pool, folder, file, single_pass, chapter_workers)
+
+    def on_removed(file):
+        reindex()
+
+    watcher = libraryWatcher.LibraryWatcher(folder, on_ready, on_removed, settle, poll_interval, force_polling, existing=True)
+    reindex()
+    watcher.run()
+
+def main(folder, manifest_path, book_workers=1, chapter_workers=1, single_pass=True, watch_options=None, settle=10):
+    """Main function to process all M4B files in the given folder.
+
+    With watch_options (keyword arguments for watch) it keeps running and
+    processes books as they are added. Books still being copied are only
+    converted once their size has held still for settle seconds.
+    """
+    global manifest
+    manifest = ConversionManifest(manifest_path)
+
+    # Carry over books recorded by the old flat log
+    legacy_log = os.path.join(os.path.dirname(manifest_path), 'processed_files.log')
+    imported = manifest.import_processed_log(legacy_log, folder)
+    if imported:
+        print(f"Imported {imported} books from {legacy_log}")
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, book_workers)) as pool:
+            if watch_options is not None:
+                # The watcher takes over the backlog so books that arrive meanwhile are not missed
+                watch(folder, pool, single_pass, chapter_workers, **watch_options)
+            else:
+                convert_existing(folder, pool, single_pass, chapter_workers, settle)
+                print(pipelineMetrics.get_recorder().summary())
+    finally:
+        manifest.close()
+        pipelineMetrics.get_recorder().close()
             
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    log_file = os.path.join(script_dir, 'processed_files.log')
-    main(script_dir, log_file)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Convert M4B audiobooks into per-chapter MP3s.")
+    parser.add_argument("folder", nargs="?", default=script_dir, help="Folder containing the M4B files")
+    parser.add_argument("--book-workers", type=int, help="Number of books converted at once (defaults to the calibrated job count, else 1)")
+    parser.add_argument("--chapter-workers", type=int, default=1, help="Number of chapters converted at once per book (per-chapter mode)")
+    parser.add_argument("--max-ffmpeg", type=int, default=os.cpu_count() or 1, help="Global cap on concurrent ffmpeg processes")
+    parser.add_argument("--manifest", default=os.path.join(script_dir, 'conversion_manifest.db'), help="SQLite manifest of verified outputs")
+    parser.add_argument("--profile", choices=[name for name, p in encoderProfiles.PROFILES.items() if p["format"] == "mp3"],
+                        default=os.environ.get(encoderProfiles.CONVERSION_PROFILE_ENV) or encoderProfiles.DEFAULT_CONVERSION_PROFILE,
+                        help="Encoder profile for the chapter MP3s")
+    parser.add_argument("--threads", type=int, help="ffmpeg threads per encode (defaults to ffmpeg's choice)")
+    parser.add_argument("--nice", type=int, default=0, help="Niceness increment for the encoding ffmpeg processes")
+    parser.add_argument("--per-chapter", action="store_true", help="Run one ffmpeg process per chapter instead of a single pass")
+    parser.add_argument("--watch", action="store_true", help="Keep running and process books as they are added")
+    parser.add_argument("--settle", type=float, default=10, help="Seconds a new file's size must hold still before it is processed")
+    parser.add_argument("--poll-interval", type=float, default=60, help="Seconds between listings on shares without inotify")
+    parser.add_argument("--poll", action="store_true", help="Poll even if inotify is available")
+    parser.add_argument("--index", default=libraryIndex.DEFAULT_DB_PATH, help="Library index to update in watch mode ('' to disable)")
+    parser.add_argument("--verify", choices=VERIFY_TIERS, default="quick",
+                        help="quick: check frame headers and lengths, with full decodes scheduled and sampled; full: decode every output")
+    parser.add_argument("--full-sample", type=float, default=0.02, help="Fraction of quick checks also given a full decode")
+    parser.add_argument("--full-recheck-days", type=float, default=30, help="Days before an output is fully decoded again (0 to only sample)")
+    parser.add_argument("--metrics-dir", default=os.environ.get(pipelineMetrics.METRICS_DIR_ENV),
+                        help="Write per-stage events.jsonl and conversion.prom here")
+    args = parser.parse_args()
+
+    pipelineMetrics.configure(args.metrics_dir, "conversion.prom")
+
+    set_ffmpeg_limit(args.max_ffmpeg)
+    set_profile(args.profile, args.threads, args.nice)
+    if args.book_workers is None:
+        args.book_workers = encoderProfiles.calibrated_jobs(args.profile)
+    set_verification(args.verify, args.full_sample, args.full_recheck_days)
+    watch_options = None
+    if args.watch:
+        watch_options = {"index_path": args.index or None, "settle": args.settle,
+                         "poll_interval": args.poll_interval, "force_polling": args.poll}
+    try:
+        main(args.folder, args.manifest, args.book_workers, args.chapter_workers, not args.per_chapter, watch_options, args.settle)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,113 @@
+import os
+import struct
+
+# Atoms on the path from the file root to the iTunes tag list; everything else is skipped
+CONTAINER_ATOMS = {b"moov", b"udta", b"meta", b"ilst"}
+TAG_ATOMS = {b"\xa9nam": "title", b"\xa9ART": "author", b"\xa9gen": "genre", b"covr": "cover"}
+DATA_TYPE_PNG = 14
+
+class CountingFile:
+    """Wraps an unbuffered binary file and counts the bytes actually read from it.
+
+    The file must be opened with buffering=0, so every read here is one read
+    from the disk or share and nothing is read ahead behind its back.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.bytes_read = 0
+
+    def read(self, size):
+        # A raw read may return less than asked for; only EOF stops it early
+        chunks = []
+        while size > 0:
+            data = self.f.read(size)
+            if not data:
+                break
+            self.bytes_read += len(data)
+            chunks.append(data)
+            size -= len(data)
+        return b"".join(chunks)
+
+    def seek(self, offset):
+        self.f.seek(offset)
+
+def iter_atoms(f, start, end):
+    """Yields (type, payload offset, payload end) for each atom between start and end, reading only headers."""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, atom_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            size = end - offset
+        if size < header_size:
+            return
+        yield atom_type, offset + header_size, min(offset + size, end)
+        offset += size
+
+def read_data_atom(f, start, end):
+    """Returns (data type, payload) from the 'data' atom inside an ilst item."""
+    for atom_type, payload_start, payload_end in iter_atoms(f, start, end):
+        if atom_type == b"data":
+            f.seek(payload_start)
+            data = f.read(payload_end - payload_start)
+            return struct.unpack(">I", data[:4])[0] & 0xFFFFFF, data[8:]
+    return None, None
+
+def read_mvhd_duration(f, start, end):
+    f.seek(start)
+    data = f.read(min(end - start, 32))
+    if data[0] == 1:
+        timescale, duration = struct.unpack(">IQ", data[20:32])
+    else:
+        timescale, duration = struct.unpack(">II", data[12:20])
+    return duration / timescale if timescale else 0.0
+
+def read_tags(f, start, end, tags):
+    for atom_type, payload_start, payload_end in iter_atoms(f, start, end):
+        if atom_type == b"mvhd":
+            tags["duration"] = read_mvhd_duration(f, payload_start, payload_end)
+        elif atom_type == b"meta":
+            # iTunes writes meta as a full box with 4 bytes of version and flags,
+            # QuickTime-style files do not
+            f.seek(payload_start + 4)
+            if f.read(4) != b"hdlr":
+                payload_start += 4
+            read_tags(f, payload_start, payload_end, tags)
+        elif atom_type in CONTAINER_ATOMS:
+            read_tags(f, payload_start, payload_end, tags)
+        elif atom_type in TAG_ATOMS:
+            data_type, payload = read_data_atom(f, payload_start, payload_end)
+            if payload is None:
+                continue
+            if atom_type == b"covr":
+                tags["cover"] = payload
+                tags["cover_format"] = "png" if data_type == DATA_TYPE_PNG else "jpg"
+            else:
+                tags[TAG_ATOMS[atom_type]] = payload.decode("utf-8", errors="replace")
+
+def read_header(path):
+    """Reads title, author, genre, duration and cover art from the moov atom of an MP4/M4B file.
+
+    Only atom headers, mvhd and the udta tag list are read; the audio data and
+    sample tables are skipped with seeks, so a book costs a few small reads no
+    matter how long it is. Returns (tags, bytes read). Raises ValueError if the
+    file has no moov atom.
+    """
+    # Unbuffered, so a seek and an 8-byte read do not pull in a whole block (up to 1 MiB on CIFS)
+    with open(path, "rb", buffering=0) as raw:
+        f = CountingFile(raw)
+        size = os.fstat(raw.fileno()).st_size
+        tags = {}
+        for atom_type, payload_start, payload_end in iter_atoms(f, 0, size):
+            if atom_type == b"moov":
+                read_tags(f, payload_start, payload_end, tags)
+                return tags, f.bytes_read
+    raise ValueError(f"No moov atom in {path}")
@@ -1,37 +1,39 @@
 import os
-import mutagen
-from mutagen.mp4 import MP4
+import argparse
 
-def get_m4b_metadata(file_path):
-    """Extract title and author from an m4b file."""
-    try:
-        audio = MP4(file_path)
-        title = audio.tags.get("\xa9nam", ["Unknown Title"])[0]
-        author = audio.tags.get("\xa9ART", ["Unknown Author"])[0]
-        return title, author
-    except Exception as e:
-        print(f"Error reading {file_path}: {e}")
-        return None, None
+import libraryIndex
 
-def organize_audiobooks(folder_path):
-    """Group audiobooks by author and print formatted output."""
-    audiobooks = {}
+def organize_audiobooks(folder_path, db_path=libraryIndex.DEFAULT_DB_PATH, workers=libraryIndex.DEFAULT_SCAN_WORKERS):
+    """Group audiobooks by author and print formatted output.
 
-    for file in os.listdir(folder_path):
-        if file.endswith(".m4b"):
-            file_path = os.path.join(folder_path, file)
-            title, author = get_m4b_metadata(file_path)
+    Tags come from the library index, which only rereads books that changed since the last run.
+    """
+    index = libraryIndex.get_index(db_path)
+    index.rescan(folder_path, workers)
+    scan = index.last_scan
+    print(f"Scanned {scan['files']} books, read tags from {scan['read']} "
+          f"({scan['files_per_second']:.1f} files/s, {scan['bytes_read']} bytes read)")
 
-            if author not in audiobooks:
-                audiobooks[author] = []
-            audiobooks[author].append(title)
+    # One pass over the indexed books rather than a browse per author
+    audiobooks = {}
+    folder = os.path.abspath(folder_path)
+    for book in index.browse():
+        if os.path.dirname(book["path"]) == folder:
+            audiobooks.setdefault(book["author"], []).append(book["title"])
 
     # Print the organized output
     for author, titles in sorted(audiobooks.items()):
+        if not titles:
+            continue
         print(f"\n{author}")
         for title in sorted(titles):
             print(f"  - {title}")
 
-# Set your target folder
-folder_path = "\\\\DESKTOP-JVHG3GN\\Audiobooks2"
-organize_audiobooks(folder_path)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List the audiobooks in a folder grouped by author.")
+    # Set your target folder
+    parser.add_argument("folder", nargs="?", default="\\\\DESKTOP-JVHG3GN\\Audiobooks2")
+    parser.add_argument("--db", default=libraryIndex.DEFAULT_DB_PATH, help="Library index database path")
+    parser.add_argument("--workers", type=int, default=libraryIndex.DEFAULT_SCAN_WORKERS, help="Concurrent tag reads")
+    args = parser.parse_args()
+    organize_audiobooks(args.folder, args.db, args.workers)
@@ -0,0 +1,260 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from contextlib import contextmanager
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError:
+    resource = None  # Windows: child CPU time is not available
+
+# Set to a directory to have every process that imports this module append
+# events there, e.g. the short-lived smb_access runs started by the bot
+METRICS_DIR_ENV = "AUDIOBOOK_METRICS_DIR"
+PROM_WRITE_INTERVAL = 5  # Seconds between rewrites of the Prometheus text file
+
+def children_cpu():
+    """CPU seconds used by reaped child processes so far, or 0 where that is not available."""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+class Span:
+    """Measurements for one run of a stage. Callers fill in the byte and media counts."""
+
+    def __init__(self, stage, labels):
+        self.stage = stage
+        self.labels = labels
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.media_seconds = 0.0
+        self.ok = True
+
+class MetricsRecorder:
+    """Records per-stage wall time, CPU time, bytes and realtime factor.
+
+    Every finished stage becomes a JSON-lines event (if events_path is set) and
+    is added to running totals, which are written in the Prometheus text format
+    to prom_path and summarised per run and per book by summary().
+
+    CPU time is this thread's CPU plus the CPU of child processes (ffmpeg)
+    reaped while the stage ran. With several stages running at once, child CPU
+    can be attributed to whichever stage was running when the child exited.
+    Without the resource module (Windows) only the thread's CPU is counted.
+    """
+
+    def __init__(self, events_path=None, prom_path=None, run_id=None):
+        self.events_path = events_path
+        self.prom_path = prom_path
+        self.run_id = run_id or time.strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+        self.lock = threading.Lock()
+        self.totals = defaultdict(lambda: defaultdict(float))  # stage -> counter -> value
+        self.books = defaultdict(lambda: defaultdict(float))  # book -> stage -> wall seconds
+        self.in_flight = defaultdict(int)
+        self.gauges = {}
+        self.last_prom_write = 0.0
+        self.started = time.time()
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """Times the body as one run of stage name. Yields the Span to fill in."""
+        span = Span(name, labels)
+        with self.lock:
+            self.in_flight[name] += 1
+            queue_depth = self.in_flight[name]
+        children = children_cpu()
+        thread_cpu = time.thread_time()
+        wall = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            span.ok = False
+            raise
+        finally:
+            wall = time.perf_counter() - wall
+            cpu = time.thread_time() - thread_cpu + children_cpu() - children
+            with self.lock:
+                self.in_flight[name] -= 1
+            self.record(span, wall, cpu, queue_depth)
+
+    def set_gauge(self, name, value):
+        """Sets a point-in-time value such as the number of books waiting."""
+        with self.lock:
+            self.gauges[name] = value
+
+    def record(self, span, wall, cpu, queue_depth):
+        event = {
+            "ts": time.time(),
+            "run": self.run_id,
+            "stage": span.stage,
+            **span.labels,
+            "ok": span.ok,
+            "wall_s": round(wall, 6),
+            "cpu_s": round(cpu, 6),
+            "bytes_in": span.bytes_in,
+            "bytes_out": span.bytes_out,
+            "media_s": round(span.media_seconds, 3),
+            "realtime_factor": round(span.media_seconds / wall, 2) if span.media_seconds and wall else None,
+            "queue_depth": queue_depth,
+        }
+        with self.lock:
+            totals = self.totals[span.stage]
+            totals["runs"] += 1
+            totals["failures"] += 0 if span.ok else 1
+            totals["wall_seconds"] += wall
+            totals["cpu_seconds"] += cpu
+            totals["bytes_in"] += span.bytes_in
+            totals["bytes_out"] += span.bytes_out
+            totals["media_seconds"] += span.media_seconds
+            totals["max_queue_depth"] = max(totals["max_queue_depth"], queue_depth)
+            if "book" in span.labels:
+                self.books[span.labels["book"]][span.stage] += wall
+            if self.events_path:
+                with open(self.events_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(event) + "\n")
+            write_prom = self.prom_path and time.monotonic() - self.last_prom_write >= PROM_WRITE_INTERVAL
+        if write_prom:
+            self.write_prom()
+
+    def prom_text(self):
+        """Renders the running totals in the Prometheus text exposition format."""
+        counters = [
+            ("runs", "audiobook_stage_runs_total", "Stage runs"),
+            ("failures", "audiobook_stage_failures_total", "Stage runs that raised"),
+            ("wall_seconds", "audiobook_stage_wall_seconds_total", "Wall time spent in the stage"),
+            ("cpu_seconds", "audiobook_stage_cpu_seconds_total", "CPU time spent in the stage, including ffmpeg"),
+            ("bytes_in", "audiobook_stage_bytes_in_total", "Bytes read by the stage"),
+            ("bytes_out", "audiobook_stage_bytes_out_total", "Bytes written by the stage"),
+            ("media_seconds", "audiobook_stage_media_seconds_total", "Seconds of audio processed by the stage"),
+        ]
+        lines = []
+        with self.lock:
+            for key, metric, help_text in counters:
+                lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+                for stage, totals in sorted(self.totals.items()):
+                    lines.append(f'{metric}{{stage="{stage}"}} {totals[key]:.6g}')
+            lines += ["# HELP audiobook_stage_in_flight Stage runs in progress", "# TYPE audiobook_stage_in_flight gauge"]
+            for stage, count in sorted(self.in_flight.items()):
+                lines.append(f'audiobook_stage_in_flight{{stage="{stage}"}} {count}')
+            for name, value in sorted(self.gauges.items()):
+                lines += [f"# TYPE audiobook_{name} gauge", f"audiobook_{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+    def write_prom(self):
+        """Atomically rewrites the Prometheus text file, e.g. for node_exporter's textfile collector."""
+        directory = os.path.dirname(os.path.abspath(self.prom_path))
+        fd, temp_path = tempfile.mkstemp(prefix=".metrics_", dir=directory)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(self.prom_text())
+        os.replace(temp_path, self.prom_path)
+        self.last_prom_write = time.monotonic()
+
+    def summary(self, top_books=5):
+        """Returns a text report of where this run's time went, by stage and for the slowest books."""
+        with self.lock:
+            totals = {stage: dict(values) for stage, values in self.totals.items()}
+            books = {book: dict(stages) for book, stages in self.books.items()}
+        return format_summary(self.run_id, time.time() - self.started, totals, books, top_books)
+
+    def close(self):
+        if self.prom_path:
+            self.write_prom()
+
+def format_summary(run_id, elapsed, totals, books, top_books=5):
+    lines = [f"Run {run_id}: {elapsed:.1f}s",
+             f"{'stage':<18}{'runs':>6}{'wall s':>10}{'cpu s':>10}{'MB in':>9}{'MB out':>9}{'x realtime':>12}{'max q':>7}"]
+    for stage, values in sorted(totals.items(), key=lambda item: -item[1]["wall_seconds"]):
+        speed = values["media_seconds"] / values["wall_seconds"] if values["media_seconds"] and values["wall_seconds"] else 0
+        lines.append(
+            f"{stage:<18}{int(values['runs']):>6}{values['wall_seconds']:>10.2f}{values['cpu_seconds']:>10.2f}"
+            f"{values['bytes_in'] / 1e6:>9.1f}{values['bytes_out'] / 1e6:>9.1f}"
+            f"{(f'{speed:.1f}' if speed else '-'):>12}{int(values['max_queue_depth']):>7}"
+        )
+    slowest = sorted(books.items(), key=lambda item: -sum(item[1].values()))[:top_books]
+    if slowest:
+        lines.append("Slowest books:")
+        for book, stages in slowest:
+            breakdown = ", ".join(f"{stage} {seconds:.1f}s" for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]))
+            lines.append(f"  {book}: {sum(stages.values()):.1f}s ({breakdown})")
+    return "\n".join(lines)
+
+def summarize_events(events_path, run_id=None):
+    """Rebuilds the summary of one run (the latest by default) from an events file."""
+    events = []
+    with open(events_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                events.append(json.loads(line))
+    if not events:
+        return "No events recorded"
+    run_id = run_id or events[-1]["run"]
+    events = [event for event in events if event["run"] == run_id]
+
+    totals = defaultdict(lambda: defaultdict(float))
+    books = defaultdict(lambda: defaultdict(float))
+    for event in events:
+        values = totals[event["stage"]]
+        values["runs"] += 1
+        values["wall_seconds"] += event["wall_s"]
+        values["cpu_seconds"] += event["cpu_s"]
+        values["bytes_in"] += event["bytes_in"]
+        values["bytes_out"] += event["bytes_out"]
+        values["media_seconds"] += event["media_s"]
+        values["max_queue_depth"] = max(values["max_queue_depth"], event["queue_depth"])
+        if "book" in event:
+            books[event["book"]][event["stage"]] += event["wall_s"]
+    elapsed = max(event["ts"] for event in events) - min(event["ts"] - event["wall_s"] for event in events)
+    return format_summary(run_id, elapsed, totals, books)
+
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def make_recorder(metrics_dir=None, prom_name=None, run_id=None):
+    events_path = prom_path = None
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        events_path = os.path.join(metrics_dir, "events.jsonl")
+        if prom_name:
+            prom_path = os.path.join(metrics_dir, prom_name)
+    return MetricsRecorder(events_path, prom_path, run_id)
+
+def configure(metrics_dir=None, prom_name=None, run_id=None):
+    """Starts a new recorder appending events to metrics_dir/events.jsonl.
+
+    Long-running processes pass prom_name to also keep a Prometheus text file;
+    each process needs its own name because the file holds that process's totals.
+    """
+    global _recorder
+    recorder = make_recorder(metrics_dir, prom_name, run_id)
+    with _recorder_lock:
+        _recorder = recorder
+    return recorder
+
+def get_recorder():
+    """Returns the process-wide recorder, writing events to AUDIOBOOK_METRICS_DIR if nothing was configured."""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = make_recorder(os.environ.get(METRICS_DIR_ENV))
+        return _recorder
+
+def stage(name, **labels):
+    """Shorthand for get_recorder().stage(name, **labels)."""
+    return get_recorder().stage(name, **labels)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarise recorded pipeline metrics.")
+    parser.add_argument("events", help="events.jsonl written by a metrics directory")
+    parser.add_argument("--run", help="Run id to summarise (defaults to the latest)")
+    args = parser.parse_args()
+    try:
+        print(summarize_events(args.events, args.run))
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Error reading {args.events}: {e}", file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import chapterIndex
+import smb_access
+import encoderProfiles
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_POSITIONS_PATH = os.path.join(script_dir, 'userPosition.json')
+
+def normalize_title(title):
+    """Normalizes a title the same way the bot does before using it as a position key."""
+    return title.replace(' (Unabridged)', '').split(':')[0].strip().lower()
+
+def position_key(position):
+    """Orders positions within a book by (chapter, part); a missing position comes first."""
+    if not position:
+        return (-1, -1)
+    return (int(position.get('chapter') or 0), int(position.get('part') or 0))
+
+class PrefetchScheduler:
+    """Transcodes the chapters after each active listener's position into the transcode cache.
+
+    userPosition.json is polled for changes. Positions carry no timestamp, so
+    the user's active book is the one whose position changed since the last
+    poll. If several changed, the one that moved forward wins; if that is
+    still ambiguous, nothing is prefetched for the user until the next poll.
+    The positions found on the first poll are only remembered, since every
+    book would look changed. Switching to another book cancels that user's
+    queued and running prefetch jobs. Jobs belong to one user, so another
+    listener of the same book keeps theirs; the transcode cache makes the
+    second job for a chapter a cheap hit.
+    """
+
+    def __init__(self, positions_path=DEFAULT_POSITIONS_PATH, chapters_ahead=2, max_jobs=1):
+        self.positions_path = positions_path
+        self.chapters_ahead = chapters_ahead
+        self.pool = ThreadPoolExecutor(max_workers=max(1, max_jobs))
+        self.lock = threading.Lock()
+        self.positions_mtime = None
+        self.last_positions = None  # Positions seen by the last poll, None before the first
+        self.active = {}  # userId -> (book file, cancel event)
+        self.scheduled = set()  # (userId, book file, chapter number) queued or running
+
+    def load_positions(self):
+        """Returns the parsed positions file, or None if it has not changed since the last poll."""
+        try:
+            mtime = os.stat(self.positions_path).st_mtime_ns
+        except OSError:
+            return None
+        if mtime == self.positions_mtime:
+            return None
+        try:
+            with open(self.positions_path, 'r', encoding='utf-8') as f:
+                data = f.read()
+            positions = json.loads(data) if data.strip() else {}
+        except (OSError, json.JSONDecodeError) as e:
+            # The bot may be halfway through rewriting the file; try again next poll
+            print(f"Error reading user positions: {e}", file=sys.stderr)
+            return None
+        self.positions_mtime = mtime
+        return positions
+
+    def find_book(self, title, mount_point):
+        """Maps a position key to the .m4b file on the share."""
+        wanted = normalize_title(title)
+        index = chapterIndex.get_index(mount_point)
+        for file in os.listdir(mount_point):
+            if not file.endswith('.m4b'):
+                continue
+            if normalize_title(os.path.splitext(file)[0]) == wanted:
+                return file
+            entry = index.lookup(os.path.join(mount_point, file))
+            if entry and normalize_title(entry.get('tags', {}).get('title', '')) == wanted:
+                return file
+        return None
+
+    def changed_books(self, positions):
+        """Returns {userId: title} for the users whose active book can be told from the last poll."""
+        last_positions, self.last_positions = self.last_positions, positions
+        if last_positions is None:
+            return {}
+        changed = {}
+        for user_id, books in positions.items():
+            previous = last_positions.get(user_id, {})
+            moved = [title for title, position in books.items() if previous.get(title) != position]
+            if len(moved) > 1:
+                moved = [title for title in moved if position_key(books[title]) > position_key(previous.get(title))]
+            if len(moved) == 1:
+                changed[user_id] = moved[0]
+        return changed
+
+    def poll(self):
+        """Reads the positions file once and schedules prefetch jobs for changed positions."""
+        positions = self.load_positions()
+        if positions is None:
+            return
+
+        with smb_access.mount_manager.use() as mount_point:
+            for user_id, title in self.changed_books(positions).items():
+                book = self.find_book(title, mount_point)
+                if book is None:
+                    print(f"Prefetch: no book found for '{title}'", file=sys.stderr)
+                    continue
+                chapter = int(positions[user_id][title].get('chapter') or 1)
+                self.activate(user_id, book)
+                self.schedule(user_id, book, chapter, mount_point)
+
+    def activate(self, user_id, book):
+        """Makes book the user's active book, cancelling work for the previous one."""
+        with self.lock:
+            current = self.active.get(user_id)
+            if current and current[0] == book:
+                return
+            if current:
+                print(f"Prefetch: user {user_id} switched from {current[0]} to {book}, cancelling")
+                current[1].set()
+                self.scheduled = {job for job in self.scheduled if job[0] != user_id}
+            self.active[user_id] = (book, threading.Event())
+
+    def schedule(self, user_id, book, chapter, mount_point):
+        """Queues the chapters after the current one (chapter numbers are 1-based)."""
+        file_path = os.path.join(mount_point, book)
+        with self.lock:
+            cancel = self.active[user_id][1]
+        for next_chapter in range(chapter + 1, chapter + 1 + self.chapters_ahead):
+            start, end = smb_access.get_chapter_times(file_path, next_chapter - 1)
+            if start is None:
+                break
+            job = (user_id, book, next_chapter)
+            with self.lock:
+                if job in self.scheduled:
+                    continue
+                self.scheduled.add(job)
+            self.pool.submit(self.prefetch, job, start, end - start, cancel)
+
+    def prefetch(self, job, start, duration, cancel):
+        _, book, chapter = job
+        try:
+            if cancel.is_set():
+                return
+            smb_access.transcode_to_mp3(book, None, start, duration, cancel=cancel)
+            if not cancel.is_set():
+                print(f"Prefetched chapter {chapter} of {book}")
+        except Exception as e:
+            print(f"Error prefetching chapter {chapter} of {book}: {e}", file=sys.stderr)
+        finally:
+            # Finished jobs are forgotten, so a chapter evicted from the cache since can be prefetched again
+            with self.lock:
+                self.scheduled.discard(job)
+
+    def run(self, interval):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Prefetch poll failed: {e}", file=sys.stderr)
+            time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-transcode upcoming chapters for active listeners.")
+    parser.add_argument("--positions", default=DEFAULT_POSITIONS_PATH, help="Path to userPosition.json")
+    parser.add_argument("--ahead", type=int, default=2, help="Number of chapters to prefetch after the current one")
+    parser.add_argument("--jobs", type=int, help="Maximum concurrent prefetch transcodes (defaults to the calibrated job count, else 1)")
+    parser.add_argument("--profile", choices=list(encoderProfiles.PROFILES), default=smb_access.playback_profile["name"],
+                        help="Encoder profile; must match playback for prefetched parts to be cache hits")
+    parser.add_argument("--threads", type=int, help="ffmpeg threads per encode (defaults to ffmpeg's choice)")
+    parser.add_argument("--interval", type=float, default=15, help="Seconds between position polls")
+    parser.add_argument("--nice", type=int, default=19, help="Niceness increment so playback transcodes win")
+    args = parser.parse_args()
+
+    # ffmpeg children inherit the lowered priority
+    os.nice(args.nice)
+    smb_access.set_playback_profile(args.profile, args.threads)
+    if args.jobs is None:
+        args.jobs = encoderProfiles.calibrated_jobs(args.profile)
+    PrefetchScheduler(args.positions, args.ahead, args.jobs).run(args.interval)
@@ -0,0 +1,264 @@
+"""Resident JSON-lines service for smb_access.
+
+Each request is one JSON object per line, for example
+
+    {"id": 1, "cmd": "list"}
+    {"id": 2, "cmd": "convert", "file": "Book.m4b", "start": 0, "duration": 600}
+    {"id": 3, "cmd": "chapter-times", "file": "Book.m4b", "chapter": 4}
+    {"id": 4, "cmd": "get", "file": "Book.m4b", "range": [0, 1048575]}
+    {"id": 5, "cmd": "get", "file": "Book.m4b", "start_time": 1800, "duration": 300}
+    {"id": 6, "cmd": "stream", "file": "Book.m4b", "chapter": 4, "start_time": 30}
+    {"id": 7, "cmd": "search", "query": "hobit tolkien", "limit": 10}
+    {"id": 8, "cmd": "facets"}
+    {"id": 9, "cmd": "browse", "genre": "Fantasy"}
+    {"id": 10, "cmd": "stream", "file": "Book.m4b", "chapter": 4, "profile": "voice-opus-64k"}
+
+and every reply line carries the same id with an "event" of "progress",
+"chunk" (base64 data for get and stream), "result" or "error". Requests are served
+concurrently, so replies for different ids may interleave. convert and stream
+use the service's playback profile unless the request names another.
+"""
+import os
+import sys
+import json
+import base64
+import asyncio
+import argparse
+import threading
+
+import smb_access
+import libraryIndex
+import encoderProfiles
+import pipelineMetrics
+
+CHUNK_SIZE = 256 * 1024  # Bytes of file data per "chunk" event
+
+class Session:
+    """Dispatches requests from one client and writes replies back to it."""
+
+    def __init__(self, write_line, drain_writer=None):
+        self.write_line = write_line
+        self.drain_writer = drain_writer
+        self.loop = asyncio.get_running_loop()
+        self.tasks = set()
+
+    def send(self, request_id, event, **fields):
+        self.write_line(json.dumps({"id": request_id, "event": event, **fields}))
+
+    def send_threadsafe(self, request_id, event, **fields):
+        """Sends an event from a worker thread."""
+        self.loop.call_soon_threadsafe(lambda: self.send(request_id, event, **fields))
+
+    def send_blocking(self, request_id, event, **fields):
+        """Sends an event from a worker thread and waits until the client has taken it.
+
+        Used for file data so a slow client holds back the reader instead of
+        letting unsent chunks pile up in memory.
+        """
+        async def send_and_drain():
+            self.send(request_id, event, **fields)
+            if self.drain_writer is not None:
+                await self.drain_writer()
+
+        asyncio.run_coroutine_threadsafe(send_and_drain(), self.loop).result()
+
+    def submit(self, line):
+        """Starts handling one request line without waiting for it to finish."""
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            self.send(None, "error", error=f"Invalid JSON: {e}")
+            return
+        task = asyncio.create_task(self.handle(request))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handle(self, request):
+        request_id = request.get("id")
+        handler = HANDLERS.get(request.get("cmd"))
+        if handler is None:
+            self.send(request_id, "error", error=f"Unknown command: {request.get('cmd')}")
+            return
+        try:
+            result = await handler(self, request_id, request)
+            self.send(request_id, "result", result=result)
+        except Exception as e:
+            self.send(request_id, "error", error=str(e))
+
+    async def drain(self):
+        """Waits for in-flight requests once the client has stopped sending."""
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+async def handle_list(session, request_id, request):
+    return await asyncio.to_thread(smb_access.find_audiobooks)
+
+async def handle_chapter_times(session, request_id, request):
+    def lookup():
+        with smb_access.mount_manager.use() as mount_point:
+            return smb_access.get_chapter_times(os.path.join(mount_point, request["file"]), int(request["chapter"]))
+
+    start, end = await asyncio.to_thread(lookup)
+    if start is None:
+        raise ValueError(f"Chapter {request['chapter']} not found in {request['file']}")
+    return {"start": start, "end": end}
+
+def request_profile(request):
+    """The encoder profile a request asks for, with the service's threads and niceness."""
+    if "profile" not in request:
+        return None
+    playback = smb_access.playback_profile
+    return encoderProfiles.get_profile(request["profile"], playback["threads"], playback["nice"])
+
+async def handle_convert(session, request_id, request):
+    def progress(part, seconds):
+        session.send_threadsafe(request_id, "progress", part=part, seconds=seconds)
+
+    paths = await asyncio.to_thread(
+        smb_access.transcode_to_mp3,
+        request["file"],
+        request.get("output_dir", "/tmp/mp3s"),
+        float(request.get("start", 0)),
+        request.get("duration"),
+        progress,
+        profile=request_profile(request)
+    )
+    if not paths:
+        raise RuntimeError(f"Conversion of {request['file']} produced no output")
+    return paths
+
+async def handle_stream(session, request_id, request):
+    profile = request_profile(request)
+
+    def stream():
+        with smb_access.mount_manager.use() as mount_point:
+            file_path = os.path.join(mount_point, request["file"])
+            start_time = float(request.get("start_time", 0))
+            duration = request.get("duration")
+            if "chapter" in request:
+                chapter_start, chapter_end = smb_access.get_chapter_times(file_path, int(request["chapter"]))
+                if chapter_start is None:
+                    raise ValueError(f"Chapter {request['chapter']} not found in {request['file']}")
+                start_time += chapter_start
+                if duration is None:
+                    duration = chapter_end - start_time
+            sent = 0
+            for block in smb_access.iter_mp3_stream(file_path, start_time, duration, profile=profile):
+                session.send_blocking(request_id, "chunk", offset=sent, data=base64.b64encode(block).decode("ascii"))
+                sent += len(block)
+            return {"bytes": sent}
+
+    return await asyncio.to_thread(stream)
+
+async def handle_get(session, request_id, request):
+    def stream():
+        with smb_access.mount_manager.use() as mount_point:
+            file_path = os.path.join(mount_point, request["file"])
+            if "start_time" in request:
+                blocks = smb_access.iter_time_range(file_path, float(request["start_time"]), request.get("duration"), CHUNK_SIZE)
+            else:
+                start_byte, end_byte = request.get("range", [0, None])
+                session.send_threadsafe(request_id, "progress", size=os.path.getsize(file_path))
+                blocks = smb_access.iter_byte_range(file_path, start_byte, end_byte, CHUNK_SIZE)
+            sent = 0
+            for block in blocks:
+                session.send_blocking(request_id, "chunk", offset=sent, data=base64.b64encode(block).decode("ascii"))
+                sent += len(block)
+            return {"bytes": sent}
+
+    return await asyncio.to_thread(stream)
+
+async def handle_rescan(session, request_id, request):
+    def rescan():
+        with smb_access.mount_manager.use() as mount_point:
+            changed, removed = libraryIndex.get_index().rescan(mount_point)
+        return {"changed": changed, "removed": removed}
+
+    return await asyncio.to_thread(rescan)
+
+async def handle_search(session, request_id, request):
+    return libraryIndex.get_index().search(
+        request["query"], int(request.get("limit", 25)), request.get("genre"), request.get("author")
+    )
+
+async def handle_facets(session, request_id, request):
+    return libraryIndex.get_index().facets()
+
+async def handle_browse(session, request_id, request):
+    return libraryIndex.get_index().browse(request.get("genre"), request.get("author"))
+
+HANDLERS = {
+    "list": handle_list,
+    "get": handle_get,
+    "convert": handle_convert,
+    "stream": handle_stream,
+    "chapter-times": handle_chapter_times,
+    "rescan": handle_rescan,
+    "search": handle_search,
+    "facets": handle_facets,
+    "browse": handle_browse,
+}
+
+async def serve_stdio():
+    """Serves requests from stdin and writes replies to stdout."""
+    write_lock = threading.Lock()
+
+    def write_line(line):
+        with write_lock:
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+
+    session = Session(write_line)
+    while True:
+        line = await asyncio.to_thread(sys.stdin.readline)
+        if not line:
+            break
+        if line.strip():
+            session.submit(line)
+    await session.drain()
+
+async def serve_socket(socket_path):
+    """Serves requests from clients connecting to a Unix socket."""
+    async def handle_client(reader, writer):
+        def write_line(line):
+            if not writer.is_closing():
+                writer.write(line.encode("utf-8") + b"\n")
+
+        session = Session(write_line, writer.drain)
+        while line := await reader.readline():
+            if line.strip():
+                session.submit(line.decode("utf-8"))
+        await session.drain()
+        await writer.drain()
+        writer.close()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    server = await asyncio.start_unix_server(handle_client, path=socket_path, limit=1024 * 1024)
+    print(f"smb_access service listening on {socket_path}", file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="smb_access.py serve", description="Run smb_access as a resident JSON-lines service.")
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of stdin/stdout")
+    parser.add_argument("--metrics-dir", default=os.environ.get(pipelineMetrics.METRICS_DIR_ENV),
+                        help="Write per-stage events.jsonl and smb_access.prom here")
+    parser.add_argument("--profile", choices=list(encoderProfiles.PROFILES), default=smb_access.playback_profile["name"],
+                        help="Default encoder profile for convert and stream")
+    parser.add_argument("--threads", type=int, help="ffmpeg threads per encode (defaults to ffmpeg's choice)")
+    parser.add_argument("--nice", type=int, default=0, help="Niceness increment for the encoding ffmpeg processes")
+    args = parser.parse_args(argv)
+
+    pipelineMetrics.configure(args.metrics_dir, "smb_access.prom")
+    smb_access.set_playback_profile(args.profile, args.threads, args.nice)
+
+    try:
+        if args.socket:
+            asyncio.run(serve_socket(args.socket))
+        else:
+            asyncio.run(serve_stdio())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipelineMetrics.get_recorder().close()
@@ -0,0 +1,121 @@
+import os
+import fcntl
+import tempfile
+import threading
+import subprocess
+from contextlib import contextmanager
+
+import pipelineMetrics
+
+HEALTH_CHECK_TIMEOUT = 5  # Seconds before a hung CIFS mount is treated as stale
+
+class MountError(Exception):
+    pass
+
+class MountManager:
+    """Keeps an SMB share mounted across operations and processes.
+
+    Users hold a shared flock on a lock file while they work on the mount, so
+    the share is only unmounted when no thread or process is using it. Mounting
+    and remounting are serialised by a second, exclusive lock.
+    """
+
+    def __init__(self, share, mount_point, options, lock_dir=None):
+        self.share = share
+        self.mount_point = mount_point
+        self.options = options
+        lock_dir = lock_dir or tempfile.gettempdir()
+        name = mount_point.strip("/").replace("/", "_") or "root"
+        self.mount_lock_path = os.path.join(lock_dir, f"smb_mount_{name}.lock")
+        self.users_lock_path = os.path.join(lock_dir, f"smb_users_{name}.lock")
+        self.lock = threading.Lock()
+        self.users = 0
+        self.users_fd = None
+
+    def is_healthy(self):
+        """Returns True if the share is mounted and answers a directory listing in time."""
+        if not os.path.ismount(self.mount_point):
+            return False
+        result = {}
+
+        def probe():
+            try:
+                os.listdir(self.mount_point)
+                result["ok"] = True
+            except OSError:
+                result["ok"] = False
+
+        thread = threading.Thread(target=probe, daemon=True)
+        thread.start()
+        thread.join(HEALTH_CHECK_TIMEOUT)
+        return result.get("ok", False)
+
+    @contextmanager
+    def exclusive(self):
+        """Serialises mount and unmount calls across processes."""
+        with open(self.mount_lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def mount(self):
+        """Mounts the share, dropping a stale mount first."""
+        os.makedirs(self.mount_point, exist_ok=True)
+        with pipelineMetrics.stage("mount"):
+            if os.path.ismount(self.mount_point):
+                subprocess.run(['sudo', 'umount', '-l', self.mount_point], check=False, capture_output=True, text=True)
+            result = subprocess.run(
+                ['sudo', 'mount', '-t', 'cifs', self.share, self.mount_point, '-o', self.options],
+                capture_output=True, text=True
+            )
+        if result.returncode != 0:
+            raise MountError(f"Error mounting SMB share: {result.stderr.strip()}")
+
+    def ensure_mounted(self):
+        """Mounts the share if it is missing or unhealthy, otherwise does nothing."""
+        if self.is_healthy():
+            return
+        with self.exclusive():
+            # Another process may have remounted while we waited for the lock
+            if not self.is_healthy():
+                self.mount()
+
+    @contextmanager
+    def use(self):
+        """Yields the mount point, keeping the share mounted for the duration."""
+        with self.lock:
+            if self.users == 0:
+                self.users_fd = open(self.users_lock_path, "a")
+                fcntl.flock(self.users_fd, fcntl.LOCK_SH)
+            self.users += 1
+        try:
+            self.ensure_mounted()
+            yield self.mount_point
+        finally:
+            with self.lock:
+                self.users -= 1
+                if self.users == 0:
+                    fcntl.flock(self.users_fd, fcntl.LOCK_UN)
+                    self.users_fd.close()
+                    self.users_fd = None
+
+    def unmount(self):
+        """Unmounts the share if no thread or process is using it. Returns True if it was unmounted."""
+        with self.lock:
+            if self.users:
+                return False
+            with open(self.users_lock_path, "a") as users_file:
+                try:
+                    fcntl.flock(users_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+                try:
+                    with self.exclusive():
+                        if os.path.ismount(self.mount_point):
+                            with pipelineMetrics.stage("unmount"):
+                                subprocess.run(['sudo', 'umount', self.mount_point], check=True, capture_output=True, text=True)
+                finally:
+                    fcntl.flock(users_file, fcntl.LOCK_UN)
+        return True
@@ -122,6 +122,51 @@ function normalizePath(filePath) {
   return normalizedPath;
 }
 
+const chapterIndexPath = path.join(audiobooksDir, '.chapter_index.json'); // Written by utils/chapterIndex.py
+const chapterIndexScript = path.join(__dirname, 'chapterIndex.py');
+let chapterIndexCache = {};
+let lastChapterIndexModTime = 0;
+
+/**
+ * Load the shared chapter index, but only if the file has changed since the last read.
+ */
+function loadChapterIndexIfNeeded() {
+  try {
+    if (!fs.existsSync(chapterIndexPath)) {
+      return;
+    }
+    const fileModTime = fs.statSync(chapterIndexPath).mtimeMs;
+    if (fileModTime !== lastChapterIndexModTime) {
+      chapterIndexCache = JSON.parse(fs.readFileSync(chapterIndexPath, 'utf-8'));
+      lastChapterIndexModTime = fileModTime;
+    }
+  } catch (error) {
+    console.error('loadChapterIndexIfNeeded: Error loading chapter index:', error);
+  }
+}
+
+/**
+ * Get the indexed chapters, duration and tags for a book.
+ * @param {*} fullPath 
+ * @returns {Object|null} The index entry, or null if it is missing or the file has changed since it was indexed.
+ */
+function getIndexedBook(fullPath) {
+  loadChapterIndexIfNeeded();
+  const entry = chapterIndexCache[path.basename(fullPath)];
+  if (!entry) {
+    return null;
+  }
+  try {
+    const stat = fs.statSync(fullPath, { bigint: true });
+    if (entry.size !== Number(stat.size) || entry.mtime_ms !== Number(stat.mtimeNs / 1000000n)) {
+      return null;
+    }
+  } catch (error) {
+    return null;
+  }
+  return entry;
+}
+
 // Middleware to parse JSON requests
 app.use(express.json());
 
@@ -131,6 +176,17 @@ app.get('/audiobooks', async (req, res) => {
       const files = fs.readdirSync(audiobooksDir).filter(file => path.extname(file).toLowerCase() === '.m4b');
       const audiobooks = await Promise.all(files.map(async (file) => {
           const fullPath = path.join(audiobooksDir, file);
+          const indexed = getIndexedBook(fullPath);
+          if (indexed) {
+              const tags = indexed.tags || {};
+              return {
+                  title: tags.title || path.basename(file, path.extname(file)),
+                  author: tags.artist || 'Unknown Author',
+                  genre: tags.genre || 'Unknown Genre',
+                  playtime: indexed.duration || 'Unknown Duration',
+                  file: `${path.basename(file)}`
+              };
+          }
           return new Promise((resolve) => {
               execFile('ffprobe', [
                   '-v', 'error',
@@ -179,6 +235,15 @@ app.post('/metadata', (req, res) => {
   const normalizedPath = normalizePath(path.basename(path.normalize(filePath)));
   const fullPath = path.join(audiobooksDir, normalizedPath);
 
+  const indexed = getIndexedBook(fullPath);
+  if (indexed) {
+    const tags = indexed.tags || {};
+    return res.json({
+      author: tags.artist || 'Unknown Author',
+      title: tags.title || 'Unknown Title',
+    });
+  }
+
   execFile('ffprobe', ['-v', 'error', '-show_entries', 'format_tags=artist,title', '-of', 'json', fullPath], (err, stdout) => {
     if (err) {
       console.error('Error retrieving metadata:', err);
@@ -194,6 +259,36 @@ app.post('/metadata', (req, res) => {
   });
 });
 
+// Endpoint to retrieve chapter times, read from the shared chapter index
+app.post('/chapters', (req, res) => {
+  const { filePath } = req.body;
+
+  const normalizedPath = normalizePath(path.basename(path.normalize(filePath)));
+  const fullPath = path.join(audiobooksDir, normalizedPath);
+
+  const indexed = getIndexedBook(fullPath);
+  if (indexed) {
+    return res.json({ duration: indexed.duration, chapters: indexed.chapters });
+  }
+
+  // Index miss: let chapterIndex.py probe the book and store the entry
+  execFile('python', [chapterIndexScript, 'lookup', fullPath], (err, stdout) => {
+    if (err) {
+      console.error('Error retrieving chapters:', err);
+      return res.status(500).json({ error: 'Failed to retrieve chapters' });
+    }
+
+    let entry;
+    try {
+      entry = JSON.parse(stdout);
+    } catch (parseError) {
+      console.error('Error parsing chapter index output:', parseError);
+      return res.status(500).json({ error: 'Failed to retrieve chapters' });
+    }
+    res.json({ duration: entry.duration, chapters: entry.chapters });
+  });
+});
+
 // Endpoint to generate a cover image
 app.post('/cover', (req, res) => {
   const { filePath } = req.body;
@@ -1,162 +1,347 @@
 import os
 import sys
+import json
 import subprocess
+import threading
+
+import chapterIndex
+import splitPlanner
+import encoderProfiles
+import pipelineMetrics
+from smbMount import MountManager
+from transcodeCache import TranscodeCache
 
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
+CHUNK_SIZE = 1024 * 1024  # Bytes copied per read when sendfile is unavailable
+STREAM_CHUNK_SIZE = 16 * 1024  # Small reads keep playback latency low
 
-def list_audiobooks():
-    try:
-        mount_point = '/mnt/windows_share'
-        smb_share = '//10.0.0.55/Audiobooks'
-        username = 'sean'
-        password = ''
+MOUNT_POINT = '/mnt/windows_share'
+SMB_SHARE = '//10.0.0.55/Audiobooks'
+USERNAME = 'sean'
+PASSWORD = ''
 
-        # Ensure the mount point directory exists
-        if not os.path.exists(mount_point):
-            os.makedirs(mount_point)
+TRANSCODE_CACHE_DIR = '/tmp/mp3s/cache'
+TRANSCODE_CACHE_BYTES = 2 * 1024 * 1024 * 1024  # 2 GB
 
-        # Unmount if already mounted
-        subprocess.run(['sudo', 'umount', mount_point], check=False)
+# The share stays mounted between calls; use `smb_access.py unmount` to release it
+mount_manager = MountManager(SMB_SHARE, MOUNT_POINT, f'username={USERNAME},password={PASSWORD},rw,vers=3.0')
+transcode_cache = None
+# Encoder profile for streamed and converted playback audio (see encoderProfiles)
+playback_profile = encoderProfiles.profile_from_env(encoderProfiles.PLAYBACK_PROFILE_ENV, encoderProfiles.DEFAULT_PLAYBACK_PROFILE)
 
-        # Mount the SMB share
-        subprocess.run(['sudo', 'mount', '-t', 'cifs', smb_share, mount_point, '-o', f'username={username},password={password},vers=3.0'], check=True, capture_output=True, text=True)
+def set_playback_profile(name, threads=None, nice=None):
+    """Switches playback to another named encoder profile."""
+    global playback_profile
+    playback_profile = encoderProfiles.get_profile(name, threads, nice)
 
+def get_transcode_cache():
+    """Returns the shared playback segment cache, creating its directory on first use."""
+    global transcode_cache
+    if transcode_cache is None:
+        transcode_cache = TranscodeCache(TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_BYTES)
+    return transcode_cache
+
+def find_audiobooks():
+    """Returns the names of the audiobooks on the share."""
+    with mount_manager.use() as mount_point:
         # List files in the mounted directory
         files = os.listdir(mount_point)
-        audiobooks = [file for file in files if file.endswith('.m4b')]
+        return [file for file in files if file.endswith('.m4b')]
+
+def list_audiobooks():
+    try:
+        audiobooks = find_audiobooks()
 
         # Print the list of audiobooks
         for audiobook in audiobooks:
             print(audiobook)
-
-        # Unmount the SMB share
-        subprocess.run(['sudo', 'umount', mount_point], check=True, capture_output=True, text=True)
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
 
-def get_audiobook(file_name):
+def iter_byte_range(file_path, start_byte=0, end_byte=None, chunk_size=CHUNK_SIZE):
+    """Yields the bytes from start_byte up to and including end_byte in bounded chunks."""
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        end = size - 1 if end_byte is None else min(end_byte, size - 1)
+        file.seek(start_byte)
+        remaining = end - start_byte + 1
+        while remaining > 0:
+            block = file.read(min(chunk_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+def iter_ffmpeg_output(args, chunk_size=CHUNK_SIZE, nice=0):
+    """Runs ffmpeg writing to stdout and yields its output as soon as it is produced."""
+    cmd = encoderProfiles.nice_command(['ffmpeg'] + args, nice)
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # Drain stderr on a thread so a chatty ffmpeg cannot block on a full pipe
+    stderr_chunks = []
+    stderr_thread = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+    stderr_thread.start()
     try:
-        mount_point = '/mnt/windows_share'
-        smb_share = '//10.0.0.55/Audiobooks'
-        username = 'sean'
-        password = ''
+        # read1 returns whatever is buffered instead of waiting for a full chunk
+        for block in iter(lambda: process.stdout.read1(chunk_size), b""):
+            yield block
+        process.wait()
+        stderr_thread.join()
+        if process.returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {b''.join(stderr_chunks).decode(errors='replace')}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
 
-        # Ensure the mount point directory exists
-        if not os.path.exists(mount_point):
-            os.makedirs(mount_point)
+def iter_time_range(file_path, start_time=0, duration=None, chunk_size=CHUNK_SIZE):
+    """Yields a playable stream-copied slice of a book without re-encoding it."""
+    args = ['-v', 'error', '-ss', str(start_time), '-i', file_path]
+    if duration is not None:
+        args += ['-t', str(duration)]
+    # A fragmented MP4 can be written to a pipe because it needs no trailing moov atom
+    args += ['-map', '0:a:0', '-c', 'copy', '-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov', 'pipe:1']
+    return iter_ffmpeg_output(args, chunk_size)
 
-        # Unmount if already mounted
-        subprocess.run(['sudo', 'umount', mount_point], check=False)
+def iter_mp3_stream(file_path, start_time=0, duration=None, chunk_size=STREAM_CHUNK_SIZE, profile=None):
+    """Yields audio transcoded on the fly, starting at start_time, with nothing written to disk.
 
-        # Mount the SMB share
-        subprocess.run(['sudo', 'mount', '-t', 'cifs', smb_share, mount_point, '-o', f'username={username},password={password},vers=3.0'], check=True, capture_output=True, text=True)
+    The audio is MP3 unless the playback profile (or profile) says otherwise.
+    """
+    profile = profile or playback_profile
+    # Seeking before -i jumps straight to start_time instead of decoding everything before it
+    args = ['-v', 'error', '-ss', str(start_time), '-i', file_path]
+    if duration is not None:
+        args += ['-t', str(duration)]
+    args += ['-map', '0:a:0'] + encoderProfiles.encode_args(profile) + ['-flush_packets', '1']
+    args += encoderProfiles.output_args(profile, pipe=True) + ['pipe:1']
+    return iter_ffmpeg_output(args, chunk_size, profile["nice"])
 
-        # Read the file content
-        file_path = os.path.join(mount_point, file_name)
-        with open(file_path, 'rb') as file:
-            content = file.read()
-            sys.stdout.buffer.write(content)
+def write_all(out_fd, data):
+    """Writes all of data to a raw file descriptor."""
+    view = memoryview(data)
+    while view:
+        written = os.write(out_fd, view)
+        view = view[written:]
+
+def copy_byte_range(file_path, out_fd, start_byte=0, end_byte=None):
+    """Copies a byte range to out_fd with sendfile, falling back to bounded reads. Returns the bytes copied."""
+    with open(file_path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        end = size - 1 if end_byte is None else min(end_byte, size - 1)
+        offset = start_byte
+        try:
+            while offset <= end:
+                sent = os.sendfile(out_fd, file.fileno(), offset, min(CHUNK_SIZE * 8, end - offset + 1))
+                if sent == 0:
+                    break
+                offset += sent
+            return offset - start_byte
+        except (AttributeError, OSError):
+            # sendfile is missing or refuses this pair of descriptors; copy the rest by hand
+            pass
+    for block in iter_byte_range(file_path, offset, end):
+        write_all(out_fd, block)
+        offset += len(block)
+    return offset - start_byte
+
+def get_audiobook(file_name, start_byte=0, end_byte=None, start_time=None, duration=None):
+    """Streams a book, a byte range of it or a time range of it to stdout with flat memory use."""
+    try:
+        with mount_manager.use() as mount_point, pipelineMetrics.stage("read", book=file_name) as span:
+            file_path = os.path.join(mount_point, file_name)
+            sys.stdout.flush()
+            out_fd = sys.stdout.buffer.fileno()
+            if start_time is not None:
+                span.media_seconds = duration or 0
+                for block in iter_time_range(file_path, start_time, duration):
+                    write_all(out_fd, block)
+                    span.bytes_out += len(block)
+            else:
+                span.bytes_out = copy_byte_range(file_path, out_fd, start_byte, end_byte)
+            span.bytes_in = span.bytes_out
+    except BrokenPipeError:
+        # The reader only wanted the beginning of the stream
+        pass
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
 
-        # Unmount the SMB share
-        subprocess.run(['sudo', 'umount', mount_point], check=True, capture_output=True, text=True)
+def stream_audiobook(file_name, start_time=0, duration=None, chapter=None):
+    """Transcodes a book to MP3 straight to stdout, from start_time or from the start of a chapter."""
+    try:
+        with mount_manager.use() as mount_point:
+            file_path = os.path.join(mount_point, file_name)
+            if chapter is not None:
+                chapter_start, chapter_end = get_chapter_times(file_path, chapter)
+                if chapter_start is None:
+                    raise ValueError(f"Chapter {chapter} not found in {file_name}")
+                start_time = chapter_start + start_time
+                if duration is None:
+                    duration = chapter_end - start_time
+            sys.stdout.flush()
+            out_fd = sys.stdout.buffer.fileno()
+            with pipelineMetrics.stage("stream", book=file_name) as span:
+                span.media_seconds = duration or 0
+                for block in iter_mp3_stream(file_path, start_time, duration):
+                    write_all(out_fd, block)
+                    span.bytes_out += len(block)
+    except BrokenPipeError:
+        # The player stopped reading, e.g. after a skip
+        pass
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
 
 def get_chapter_times(file_path, chapter_number):
-    result = subprocess.run(['ffmpeg', '-i', file_path, '-f', 'ffmetadata', '-'], capture_output=True, text=True)
-    if result.returncode != 0:
-        print(f"Error getting chapter times: {result.stderr}", file=sys.stderr)
+    try:
+        chapters = chapterIndex.get_chapters(file_path)
+    except (OSError, RuntimeError, ValueError) as e:
+        print(f"Error getting chapter times: {e}", file=sys.stderr)
         return None, None
 
-    lines = result.stdout.splitlines()
-    start_time = None
-    end_time = None
-    chapter_index = -1
-    timebase = 1.0
-
-    for line in lines:
-        if line.startswith('[CHAPTER]'):
-            chapter_index += 1
-        if chapter_index == chapter_number:
-            if line.startswith('TIMEBASE='):
-                timebase_str = line.split('=')[1]
-                num, denom = timebase_str.split('/')
-                timebase = float(num) / float(denom)
-            if line.startswith('START='):
-                start_time = float(line.split('=')[1]) * timebase
-            if line.startswith('END='):
-                end_time = float(line.split('=')[1]) * timebase
-                break
+    if chapter_number < 0 or chapter_number >= len(chapters):
+        return None, None
 
-    return start_time, end_time
+    chapter = chapters[chapter_number]
+    return chapter["start"], chapter["end"]
 
-def convert_to_mp3(file_name, output_dir, start_time=0, duration=MAX_FILE_SIZE):
-    mount_point = '/mnt/windows_share'
-    smb_share = '//10.0.0.55/Audiobooks'
-    username = 'sean'
-    password = ''
-    output_paths = []
-    segment_index = 0
+def run_ffmpeg(args, progress=None, cancel=None, nice=0):
+    """Runs ffmpeg, reporting the encoded position in seconds to progress() if given.
 
-    try:
-        # Ensure the mount point directory exists
-        if not os.path.exists(mount_point):
-            os.makedirs(mount_point)
+    If cancel (a threading.Event) gets set, ffmpeg is killed at its next progress update.
+    A nice increment runs ffmpeg at lower priority.
+    """
+    if progress is None and cancel is None:
+        return subprocess.run(encoderProfiles.nice_command(['ffmpeg'] + args, nice), capture_output=True, text=True)
+
+    process = subprocess.Popen(
+        encoderProfiles.nice_command(['ffmpeg', '-nostats', '-progress', 'pipe:1'] + args, nice),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    # Drain stderr on a thread so a chatty ffmpeg cannot block on a full pipe
+    stderr_lines = []
+    stderr_thread = threading.Thread(target=lambda: stderr_lines.extend(process.stderr), daemon=True)
+    stderr_thread.start()
+    for line in process.stdout:
+        if cancel is not None and cancel.is_set():
+            process.kill()
+            break
+        if progress is not None and line.startswith('out_time_us=') and line.strip() != 'out_time_us=N/A':
+            progress(int(line.split('=')[1]) / 1_000_000)
+    process.wait()
+    stderr_thread.join()
+    return subprocess.CompletedProcess(process.args, process.returncode, '', ''.join(stderr_lines))
 
-        # Unmount if already mounted
-        subprocess.run(['sudo', 'umount', mount_point], check=False, capture_output=True, text=True)
+def transcode_to_mp3(file_name, output_dir, start_time=0, duration=None, progress=None, cancel=None, profile=None):
+    """Converts start_time..start_time+duration of a book (or to its end) into parts and returns their paths.
+
+    The parts are MP3 unless the playback profile (or profile) says otherwise.
+    They are planned before anything is encoded, each short enough for the
+    profile's bitrate to stay under MAX_FILE_SIZE without a second encode.
+    Parts come from the transcode cache when the same span has been encoded before.
+    With output_dir=None the parts are only put in the cache and the cache paths
+    are returned. Setting cancel stops the work before or during the next part.
+    """
+    output_paths = []
+    profile = profile or playback_profile
 
-        # Mount the SMB share with read and write permissions
-        mount_command = ['sudo', 'mount', '-t', 'cifs', smb_share, mount_point, '-o', f'username={username},password={password},rw,vers=3.0']
-        result = subprocess.run(mount_command, capture_output=True, text=True)
-        if result.returncode != 0:
-            print(f"Error mounting SMB share: {result.stderr}", file=sys.stderr)
-            return  # Exit the function if mounting fails
+    cache = get_transcode_cache()
 
-        # Convert the .m4b file to .mp3 in 50 MB chunks
+    with mount_manager.use() as mount_point:
         file_path = os.path.join(mount_point, file_name)
+        book = chapterIndex.get_book(file_path)
+        if duration is None:
+            duration = book["duration"] - start_time
+        end_time = start_time + duration
+        source_id = [file_name, *chapterIndex.file_identity(file_path)]
 
-        while True:
-            output_path = os.path.join(output_dir, f'{os.path.splitext(file_name)[0]}_part{segment_index}.mp3')
-            result = subprocess.run(['ffmpeg', '-y', '-i', file_path, '-ss', str(start_time), '-t', str(duration), '-c:a', 'libmp3lame', '-q:a', '2', output_path], capture_output=True, text=True)
-            if result.returncode != 0:
-                print(f"Error converting audiobook: {result.stderr}", file=sys.stderr)
+        # Plan every part up front, cutting at chapter edges where one is close
+        source_bitrate = book["size"] * 8 / book["duration"] if book["duration"] else None
+        max_seconds = encoderProfiles.part_seconds(profile, MAX_FILE_SIZE, source_bitrate)
+        chapter_edges = [chapter["start"] for chapter in book["chapters"]]
+        parts = splitPlanner.plan_span(start_time, end_time, max_seconds, preferred=chapter_edges)
+
+        for segment_index, (part_start, part_end) in enumerate(parts):
+            if cancel is not None and cancel.is_set():
                 break
+            part_duration = part_end - part_start
+            output_path = None
+            if output_dir is not None:
+                output_path = os.path.join(output_dir, f'{os.path.splitext(file_name)[0]}_part{segment_index}{profile["extension"]}')
+            part_progress = None
+            if progress is not None:
+                part_progress = lambda seconds, part=segment_index: progress(part, seconds)
+
+            def encode(temp_path, part_start=part_start, part_duration=part_duration, part_progress=part_progress):
+                with pipelineMetrics.stage("transcode", book=file_name, part=segment_index) as span:
+                    span.media_seconds = part_duration
+                    args = ['-y', '-ss', str(part_start), '-i', file_path, '-t', str(part_duration), '-map', '0:a:0']
+                    args += encoderProfiles.encode_args(profile) + encoderProfiles.output_args(profile) + [temp_path]
+                    result = run_ffmpeg(args, part_progress, cancel, profile["nice"])
+                    span.bytes_out = os.path.getsize(temp_path)
+                if result.returncode != 0 and not (cancel is not None and cancel.is_set()):
+                    print(f"Error converting audiobook: {result.stderr}", file=sys.stderr)
+                return result.returncode == 0
 
-            if os.path.getsize(output_path) < MAX_FILE_SIZE:
-                output_paths.append(output_path)
+            key = cache.make_key(source_id, part_start, part_duration, profile["args"])
+            cached_path = cache.get_or_create(key, encode, output_path, profile["extension"])
+            if cached_path is None:
                 break
 
+            output_path = output_path or cached_path
             output_paths.append(output_path)
-            segment_index += 1
-            start_time += duration
 
+    for path in splitPlanner.oversized(output_paths, MAX_FILE_SIZE):
+        print(f"Warning: {path} is over the {MAX_FILE_SIZE} byte upload limit", file=sys.stderr)
+
+    return output_paths
+
+def convert_to_mp3(file_name, output_dir, start_time=0, duration=None):
+    output_paths = []
+
+    try:
+        output_paths = transcode_to_mp3(file_name, output_dir, start_time, duration)
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
 
     finally:
-        # Unmount the SMB share
-        subprocess.run(['sudo', 'umount', mount_point], check=False, capture_output=True, text=True)
-
         # Return the paths to the generated MP3 files
         for path in output_paths:
             print(path, flush=True)
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: smb_access.py <list|get|convert|title> [file_name] [start_time] [duration]", file=sys.stderr)
+        print("Usage: smb_access.py <list|get|get-time|convert|stream|stream-chapter|serve|cache-stats|unmount> [file_name] [start_byte end_byte | start_time duration | chapter offset]", file=sys.stderr)
         sys.exit(1)
 
     command = sys.argv[1]
     if command == "list":
         list_audiobooks()
-    elif command == "get" and len(sys.argv) == 3:
-        get_audiobook(sys.argv[2])
+    elif command == "get" and 3 <= len(sys.argv) <= 5:
+        start_byte = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+        end_byte = int(sys.argv[4]) if len(sys.argv) > 4 else None
+        get_audiobook(sys.argv[2], start_byte, end_byte)
+    elif command == "get-time" and 4 <= len(sys.argv) <= 5:
+        duration = float(sys.argv[4]) if len(sys.argv) > 4 else None
+        get_audiobook(sys.argv[2], start_time=float(sys.argv[3]), duration=duration)
     elif command == "convert" and len(sys.argv) >= 3:
         file_name = sys.argv[2]
         start_time = int(sys.argv[3]) if len(sys.argv) > 3 else 0
-        duration = int(sys.argv[4]) if len(sys.argv) > 4 else MAX_FILE_SIZE
+        duration = int(sys.argv[4]) if len(sys.argv) > 4 else None
         convert_to_mp3(file_name, '/tmp/mp3s', start_time, duration)
+    elif command == "stream" and 3 <= len(sys.argv) <= 5:
+        start_time = float(sys.argv[3]) if len(sys.argv) > 3 else 0
+        duration = float(sys.argv[4]) if len(sys.argv) > 4 else None
+        stream_audiobook(sys.argv[2], start_time, duration)
+    elif command == "stream-chapter" and 4 <= len(sys.argv) <= 5:
+        offset = float(sys.argv[4]) if len(sys.argv) > 4 else 0
+        stream_audiobook(sys.argv[2], offset, chapter=int(sys.argv[3]))
+    elif command == "serve":
+        import smbDaemon
+        smbDaemon.main(sys.argv[2:])
+    elif command == "cache-stats":
+        print(json.dumps(get_transcode_cache().stats(), indent=2))
+    elif command == "unmount":
+        if not mount_manager.unmount():
+            print("SMB share is still in use, not unmounting", file=sys.stderr)
     else:
         print("Invalid command or missing file_name for 'convert'", file=sys.stderr)
         sys.exit(1)
\ No newline at end of file
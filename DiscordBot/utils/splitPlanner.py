@@ -0,0 +1,72 @@
+import os
+import re
+import math
+import subprocess
+
+DISCORD_UPLOAD_LIMIT = 50 * 1024 * 1024  # 50 MB
+SIZE_MARGIN = 0.97  # Leaves room for MP3 frame padding and the Xing header
+SILENCE_WINDOW = 30  # Seconds either side of an ideal cut searched for a pause
+SILENCE_NOISE = "-35dB"
+SILENCE_MIN_DURATION = 0.4
+
+def max_segment_seconds(bitrate, max_bytes=DISCORD_UPLOAD_LIMIT):
+    """Returns the longest stretch of audio that fits in max_bytes at bitrate (bits per second)."""
+    return max_bytes * SIZE_MARGIN * 8 / bitrate
+
+def predicted_size(seconds, bitrate):
+    return seconds * bitrate / 8
+
+def find_silences(file_path, start, end, run=subprocess.run):
+    """Returns the midpoints of pauses between start and end (absolute seconds) using silencedetect."""
+    cmd = [
+        "ffmpeg", "-v", "info", "-nostats", "-ss", str(start), "-t", str(end - start), "-i", file_path,
+        "-map", "0:a:0", "-af", f"silencedetect=n={SILENCE_NOISE}:d={SILENCE_MIN_DURATION}", "-f", "null", "-"
+    ]
+    result = run(cmd, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True, encoding="utf-8")
+    if result.returncode != 0:
+        return []
+    starts = [float(value) for value in re.findall(r"silence_start: (-?[\d.]+)", result.stderr)]
+    ends = [float(value) for value in re.findall(r"silence_end: (-?[\d.]+)", result.stderr)]
+    return [start + (silence_start + silence_end) / 2 for silence_start, silence_end in zip(starts, ends)]
+
+def plan_span(start, end, max_seconds, preferred=(), silence_finder=None):
+    """Splits start..end into the fewest parts no longer than max_seconds.
+
+    The parts are made about equal in length. Each cut then moves to the
+    nearest preferred point (chapter edges) or, failing that, the nearest pause
+    that silence_finder(window_start, window_end) reports within SILENCE_WINDOW,
+    as long as no part grows past max_seconds. Returns [(start, end)].
+    """
+    duration = end - start
+    if duration <= max_seconds:
+        return [(start, end)]
+
+    count = math.ceil(duration / max_seconds)
+    cuts = []
+    previous = start
+    for i in range(1, count):
+        ideal = start + duration * i / count
+        # The cut must leave this part and the remaining parts short enough
+        low = max(end - (count - i) * max_seconds, previous + 1)
+        high = previous + max_seconds
+        window = (max(low, ideal - SILENCE_WINDOW), min(high, ideal + SILENCE_WINDOW))
+
+        candidates = [point for point in preferred if window[0] <= point <= window[1]]
+        if not candidates and silence_finder is not None and window[0] < window[1]:
+            candidates = [point for point in silence_finder(*window) if window[0] <= point <= window[1]]
+        cut = min(candidates, key=lambda point: abs(point - ideal)) if candidates else min(max(ideal, low), high)
+        cuts.append(cut)
+        previous = cut
+
+    bounds = [start] + cuts + [end]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def plan_chapters(chapters, bitrate, max_bytes=DISCORD_UPLOAD_LIMIT, silence_finder=None):
+    """Returns, for each chapter, the list of (start, end) parts its MP3 must be split into."""
+    max_seconds = max_segment_seconds(bitrate, max_bytes)
+    return [plan_span(chapter["start"], chapter["end"], max_seconds, silence_finder=silence_finder)
+            for chapter in chapters]
+
+def oversized(paths, max_bytes=DISCORD_UPLOAD_LIMIT):
+    """Returns the paths that are too big to upload to Discord."""
+    return [path for path in paths if os.path.exists(path) and os.path.getsize(path) > max_bytes]
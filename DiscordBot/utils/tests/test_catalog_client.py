@@ -0,0 +1,166 @@
+"""Tests for the catalog crawler against the local stub API (audibleStubServer)."""
+import time
+import asyncio
+import functools
+
+import pytest
+
+import audibleStubServer
+import getAudiblePlusLibrary as library
+
+DETAIL_PARAMS = {"response_groups": "product_desc,product_attrs,product_plans,media"}
+
+@pytest.fixture
+def stub():
+    server, catalog, base_url = audibleStubServer.start_server(product_count=120, latency=0.0)
+    yield catalog, base_url
+    server.shutdown()
+    server.server_close()
+
+def make_client(base_url, **kwargs):
+    # Keep backoff short so retry tests run quickly
+    options = {"concurrency": 4, "rate": 1000, "backoff_base": 0.01, "backoff_cap": 0.05}
+    options.update(kwargs)
+    return library.CatalogClient(base_url, **options)
+
+def get_product(client, asin):
+    async def run():
+        try:
+            return await client.get_json(library.product_path(asin), DETAIL_PARAMS)
+        finally:
+            client.close()
+    return asyncio.run(run())
+
+class FakeResponse:
+    def __init__(self, retry_after=None):
+        self.headers = {} if retry_after is None else {"Retry-After": retry_after}
+
+def test_retries_429_and_503_until_success(stub):
+    catalog, base_url = stub
+    catalog.fail_next(429, count=2)
+    catalog.fail_next(503)
+    client = make_client(base_url)
+
+    data = get_product(client, "B000000005")
+
+    assert data["product"]["asin"] == "B000000005"
+    assert catalog.counts["failed"] == 3
+    assert catalog.counts["detail"] == 1
+    assert client.requests_sent == 4
+
+def test_gives_up_after_max_retries(stub):
+    catalog, base_url = stub
+    catalog.fail_next(503, count=10)
+    client = make_client(base_url, max_retries=2)
+
+    assert get_product(client, "B000000005") is None
+    assert client.requests_sent == 3
+    assert catalog.counts["failed"] == 3
+    assert client.rejected == {}
+
+def test_permanent_4xx_is_not_retried(stub):
+    catalog, base_url = stub
+    client = make_client(base_url)
+
+    assert get_product(client, "B999999999") is None
+    assert client.requests_sent == 1
+    assert client.rejected == {library.product_path("B999999999"): 404}
+
+def test_honours_retry_after(stub):
+    catalog, base_url = stub
+    catalog.fail_next(429, retry_after=1)
+    client = make_client(base_url)
+
+    start = time.monotonic()
+    data = get_product(client, "B000000001")
+
+    assert data["product"]["asin"] == "B000000001"
+    assert time.monotonic() - start >= 1.0
+    assert catalog.request_times[1] - catalog.request_times[0] >= 1.0
+
+def test_backoff_is_capped():
+    client = library.CatalogClient("http://unused", backoff_base=1, backoff_cap=4)
+    try:
+        delays = [client.backoff_delay(attempt) for attempt in range(12)]
+        assert max(delays) <= 4
+        assert 0.5 <= delays[0] <= 1.5
+        # Retry-After wins over a shorter backoff, even above the cap
+        assert client.backoff_delay(0, FakeResponse("7")) >= 7
+        assert client.backoff_delay(0, FakeResponse("soon")) <= 1.5
+    finally:
+        client.close()
+
+def test_token_bucket_rate():
+    bucket = library.TokenBucket(rate=50, capacity=10)
+
+    async def take(count):
+        start = time.monotonic()
+        for _ in range(count):
+            await bucket.acquire()
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(take(40))
+    # The first 10 tokens are a burst; the other 30 come at 50 per second
+    assert elapsed >= 30 / 50 * 0.9
+    assert elapsed < 30 / 50 * 3
+
+def test_observed_request_rate(stub):
+    catalog, base_url = stub
+    client = make_client(base_url, concurrency=8, rate=20)
+
+    async def run():
+        try:
+            return await asyncio.gather(*(
+                client.get_json(library.product_path(f"B{i:09d}"), DETAIL_PARAMS) for i in range(50)
+            ))
+        finally:
+            client.close()
+
+    results = asyncio.run(run())
+
+    assert all(result and result["product"]["asin"] == f"B{i:09d}" for i, result in enumerate(results))
+    times = sorted(catalog.request_times)
+    assert len(times) == 50
+    # A burst of 20 (the bucket capacity), then the remaining 30 at 20 per second
+    span = times[-1] - times[0]
+    assert span >= 30 / 20 * 0.9
+    assert span < 30 / 20 * 3
+
+def test_crawl_survives_injected_failures(stub):
+    catalog, base_url = stub
+    catalog.fail_next(429, count=3)
+    catalog.fail_next(503, count=2)
+
+    books, requests_sent = asyncio.run(library.crawl(base_url, concurrency=4, rate=1000))
+
+    assert sorted(book["title"] for book in books) == sorted(f"Stub Book {i}" for i in range(120))
+    assert catalog.counts["failed"] == 5
+    assert requests_sent == sum(catalog.counts.values()) - catalog.counts["throttled"]
+
+def test_failed_listing_page_is_not_the_end(stub):
+    catalog, base_url = stub
+    catalog.fail_next(503, count=6, page=2)
+    client = make_client(base_url, max_retries=5)
+    checkpoints = []
+
+    async def run():
+        try:
+            return await library.crawl_listing(client, on_batch=lambda products, page, finished: checkpoints.append(
+                (len(products), page, finished)))
+        finally:
+            client.close()
+
+    products, complete = asyncio.run(run())
+
+    assert not complete
+    assert len(products) == 50  # Page 1 only; pages after the failed one are fetched again on resume
+    assert checkpoints == [(50, 2, False)]
+
+def test_crawl_raises_on_failed_listing_page(stub, monkeypatch):
+    catalog, base_url = stub
+    catalog.fail_next(503, count=6, page=2)
+    monkeypatch.setattr(library, "CatalogClient",
+                        functools.partial(library.CatalogClient, backoff_base=0.01, backoff_cap=0.05))
+
+    with pytest.raises(library.ListingIncomplete):
+        asyncio.run(library.crawl(base_url, concurrency=4, rate=1000))
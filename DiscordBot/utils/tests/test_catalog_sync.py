@@ -0,0 +1,60 @@
+"""Tests for syncing the catalog into a CatalogStore against the local stub API."""
+import asyncio
+import functools
+
+import pytest
+
+import catalogStore
+import audibleStubServer
+import getAudiblePlusLibrary as library
+
+@pytest.fixture
+def stub(monkeypatch):
+    server, catalog, base_url = audibleStubServer.start_server(product_count=500, latency=0.0)
+    # Keep backoff short so retry tests run quickly
+    monkeypatch.setattr(library, "CatalogClient",
+                        functools.partial(library.CatalogClient, backoff_base=0.01, backoff_cap=0.05))
+    yield catalog, base_url
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture
+def store(tmp_path):
+    store = catalogStore.CatalogStore(str(tmp_path / "catalog.db"))
+    yield store
+    store.close()
+
+def export(store, tmp_path):
+    return library.export_books(store, str(tmp_path / "books.json"))
+
+def test_sync_skips_refused_asins(stub, store, tmp_path):
+    catalog, base_url = stub
+    del catalog.by_asin["B000000007"]
+
+    for _ in range(2):
+        asyncio.run(library.sync(store, base_url))
+        assert len(export(store, tmp_path)) == 499
+        assert store.get_state("completed_sync") == store.get_state("current_sync")
+
+def test_failed_listing_page_does_not_finish_sync(stub, store, tmp_path):
+    catalog, base_url = stub
+    asyncio.run(library.sync(store, base_url))
+    assert store.get_state("completed_sync") == 1
+    assert len(export(store, tmp_path)) == 500
+
+    catalog.fail_next(503, count=6, page=3)
+    asyncio.run(library.sync(store, base_url))
+
+    assert store.get_state("completed_sync") == 1
+    assert store.get_state("current_sync") == 2
+    assert store.get_state("next_page") == 3
+    assert not store.listing_done()
+    assert len(export(store, tmp_path)) == 500
+
+    catalog.counts["listing"] = 0
+    asyncio.run(library.sync(store, base_url, concurrency=2))
+
+    assert store.get_state("completed_sync") == 2
+    assert len(export(store, tmp_path)) == 500
+    # The resumed listing fetches pages 3-12 in pairs (11 and 12 are empty), not pages 1-2 again
+    assert catalog.counts["listing"] == 10
@@ -0,0 +1,103 @@
+"""Tests for the shared on-disk chapter index, with ffprobe replaced by a counter."""
+import os
+import json
+
+import pytest
+
+import chapterIndex
+from chapterIndex import ChapterIndex
+
+@pytest.fixture
+def probes(monkeypatch):
+    probed = []
+
+    def probe_book(path):
+        probed.append(os.path.basename(path))
+        return {"duration": 30.0, "tags": {"title": os.path.basename(path)},
+                "chapters": [{"title": "Chapter_1", "start": 0.0, "end": 30.0}]}
+
+    monkeypatch.setattr(chapterIndex, "probe_book", probe_book)
+    return probed
+
+def add_book(folder, name, data=b"book"):
+    path = folder / name
+    path.write_bytes(data)
+    return str(path)
+
+def read_index(folder):
+    with open(folder / chapterIndex.INDEX_FILENAME, encoding="utf-8") as f:
+        return json.load(f)
+
+def test_get_probes_once(tmp_path, probes):
+    path = add_book(tmp_path, "a.m4b")
+    index = ChapterIndex(str(tmp_path))
+
+    assert index.get(path)["duration"] == 30.0
+    assert index.get(path)["chapters"][0]["title"] == "Chapter_1"
+    assert probes == ["a.m4b"]
+    # A fresh index (another process) reads the saved entry instead of probing
+    assert ChapterIndex(str(tmp_path)).get(path)["duration"] == 30.0
+    assert probes == ["a.m4b"]
+
+def test_changed_size_or_mtime_invalidates(tmp_path, probes):
+    path = add_book(tmp_path, "a.m4b")
+    index = ChapterIndex(str(tmp_path))
+    index.get(path)
+
+    add_book(tmp_path, "a.m4b", b"longer book")
+    assert index.lookup(path) is None
+    index.get(path)
+    assert probes == ["a.m4b", "a.m4b"]
+
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 5 * 10**9))
+    assert index.lookup(path) is None
+    index.get(path)
+    assert probes == ["a.m4b"] * 3
+
+def test_removed_book_is_not_looked_up(tmp_path, probes):
+    path = add_book(tmp_path, "a.m4b")
+    index = ChapterIndex(str(tmp_path))
+    index.get(path)
+    os.remove(path)
+
+    assert index.lookup(path) is None
+
+def test_save_merges_with_other_writers(tmp_path, probes):
+    a = add_book(tmp_path, "a.m4b")
+    b = add_book(tmp_path, "b.m4b")
+    first = ChapterIndex(str(tmp_path))
+    second = ChapterIndex(str(tmp_path))
+
+    first.get(a)
+    second.get(b)  # Saved after first; must not drop a.m4b
+
+    assert sorted(read_index(tmp_path)) == ["a.m4b", "b.m4b"]
+    assert first.lookup(b) is not None
+    assert probes == ["a.m4b", "b.m4b"]
+
+def test_build_drops_removed_books(tmp_path, probes):
+    add_book(tmp_path, "a.m4b")
+    b = add_book(tmp_path, "b.m4b")
+    add_book(tmp_path, "notes.txt")
+    index = ChapterIndex(str(tmp_path))
+
+    assert index.build() == 2
+    assert index.build() == 0
+
+    os.remove(b)
+    other = ChapterIndex(str(tmp_path))
+    assert other.build() == 0
+    assert sorted(read_index(tmp_path)) == ["a.m4b"]
+    # The removal survives a later save from an index that still had the entry
+    index.get(str(tmp_path / "a.m4b"))
+    index.save()
+    assert sorted(read_index(tmp_path)) == ["a.m4b"]
+
+def test_unreadable_index_is_ignored(tmp_path, probes):
+    path = add_book(tmp_path, "a.m4b")
+    (tmp_path / chapterIndex.INDEX_FILENAME).write_text("{not json")
+
+    index = ChapterIndex(str(tmp_path))
+    assert index.get(path)["duration"] == 30.0
+    assert "a.m4b" in read_index(tmp_path)
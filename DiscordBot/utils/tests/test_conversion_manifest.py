@@ -0,0 +1,131 @@
+"""Tests for the conversion manifest (source identities and verified outputs)."""
+import os
+
+import pytest
+
+import conversionManifest
+from conversionManifest import ConversionManifest
+
+@pytest.fixture
+def manifest(tmp_path):
+    manifest = ConversionManifest(str(tmp_path / "manifest.db"))
+    yield manifest
+    manifest.close()
+
+def write(path, data):
+    path.write_bytes(data)
+    return str(path)
+
+def bump_mtime(path, seconds=10):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + seconds * 10**9))
+
+def test_output_tiers(manifest, tmp_path):
+    path = write(tmp_path / "01.mp3", b"a" * 1000)
+
+    manifest.record_output(path, True, tier="quick")
+    assert manifest.is_verified(path, "quick")
+    assert not manifest.is_verified(path, "full")
+
+    manifest.record_output(path, True, tier="full")
+    assert manifest.is_verified(path, "full")
+    # A later quick pass keeps the full decode while the content is unchanged
+    manifest.record_output(path, True, tier="quick")
+    assert manifest.is_verified(path, "full")
+
+def test_full_verification_expires(manifest, tmp_path, monkeypatch):
+    path = write(tmp_path / "01.mp3", b"a" * 1000)
+    manifest.record_output(path, True, tier="full")
+
+    now = conversionManifest.time.time()
+    monkeypatch.setattr(conversionManifest.time, "time", lambda: now + 3600)
+
+    assert manifest.is_verified(path, "full", max_age=7200)
+    assert not manifest.is_verified(path, "full", max_age=60)
+    assert manifest.is_verified(path, "quick", max_age=60)
+
+def test_failed_check_is_not_verified(manifest, tmp_path):
+    path = write(tmp_path / "01.mp3", b"a" * 1000)
+    manifest.record_output(path, False)
+
+    assert not manifest.is_verified(path, "quick")
+
+def test_touched_output_is_trusted_only_if_unchanged(manifest, tmp_path):
+    path = write(tmp_path / "01.mp3", b"a" * 1000)
+    manifest.record_output(path, True)
+
+    bump_mtime(path)
+    assert manifest.is_verified(path)
+
+    # Same size, different content
+    write(tmp_path / "01.mp3", b"b" * 1000)
+    bump_mtime(path, 20)
+    assert not manifest.is_verified(path)
+
+def test_resized_or_forgotten_output(manifest, tmp_path):
+    path = write(tmp_path / "01.mp3", b"a" * 1000)
+    manifest.record_output(path, True)
+
+    write(tmp_path / "01.mp3", b"a" * 999)
+    assert not manifest.is_verified(path, "quick")
+
+    manifest.record_output(path, True)
+    manifest.forget_output(path)
+    assert not manifest.is_verified(path, "quick")
+
+def test_record_output_reuses_hash_for_unchanged_file(manifest, tmp_path, monkeypatch):
+    path = write(tmp_path / "01.mp3", b"a" * 1000)
+    manifest.record_output(path, True, tier="quick")
+
+    hashed = []
+    original = conversionManifest.file_sha256
+    monkeypatch.setattr(conversionManifest, "file_sha256", lambda p: hashed.append(p) or original(p))
+
+    manifest.record_output(path, True, tier="full")
+    assert hashed == []
+
+    bump_mtime(path)
+    manifest.record_output(path, True, tier="full")
+    assert hashed == [os.path.abspath(path)]
+
+def test_source_status(manifest, tmp_path):
+    size = conversionManifest.SAMPLE_SIZE * 3
+    path = write(tmp_path / "book.m4b", b"x" * size)
+    assert manifest.source_status(path) is None
+
+    manifest.record_source(path, "complete")
+    assert manifest.source_status(path) == "complete"
+
+    # A copy with a new mtime but the same content keeps its status
+    bump_mtime(path)
+    assert manifest.source_status(path) == "complete"
+
+    # A change in the sampled head is a new book
+    write(tmp_path / "book.m4b", b"y" + b"x" * (size - 1))
+    bump_mtime(path, 20)
+    assert manifest.source_status(path) is None
+
+def test_import_processed_log(manifest, tmp_path):
+    write(tmp_path / "a.m4b", b"a" * 100)
+    write(tmp_path / "b.m4b", b"b" * 100)
+    log_file = tmp_path / "processed_files.log"
+    log_file.write_text("a.m4b\nmissing.m4b\n\nb.m4b\n")
+
+    assert manifest.import_processed_log(str(log_file), str(tmp_path)) == 2
+    assert manifest.source_status(str(tmp_path / "a.m4b")) == "complete"
+    # Entries already in the manifest are not imported twice
+    assert manifest.import_processed_log(str(log_file), str(tmp_path)) == 0
+    assert manifest.import_processed_log(str(tmp_path / "none.log"), str(tmp_path)) == 0
+
+def test_manifest_persists(tmp_path):
+    path = write(tmp_path / "01.mp3", b"a" * 1000)
+    db_path = str(tmp_path / "manifest.db")
+    manifest = ConversionManifest(db_path)
+    manifest.record_output(path, True)
+    manifest.close()
+
+    reopened = ConversionManifest(db_path)
+    try:
+        assert reopened.is_verified(path)
+    finally:
+        reopened.close()
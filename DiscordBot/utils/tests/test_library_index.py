@@ -0,0 +1,123 @@
+"""Tests for the library index: rescans, word/prefix/fuzzy search and facets."""
+import os
+import json
+import shutil
+import subprocess
+
+import pytest
+
+import libraryIndex
+from libraryIndex import LibraryIndex
+
+BOOKS = {
+    "dune.m4b": {"title": "Dune", "author": "Frank Herbert", "genre": "Science Fiction"},
+    "messiah.m4b": {"title": "Dune Messiah", "author": "Frank Herbert", "genre": "Science Fiction"},
+    "hobbit.m4b": {"title": "The Hobbit", "author": "J. R. R. Tolkien", "genre": "Fantasy"},
+    "silmarillion.m4b": {"title": "The Silmarillion", "author": "J. R. R. Tolkien", "genre": "Fantasy"},
+    "foundation.m4b": {"title": "Foundation", "author": "Isaac Asimov", "genre": "Science Fiction"},
+}
+
+@pytest.fixture
+def reads(monkeypatch):
+    # Each fake book holds its tags as JSON, so no audio files are needed
+    read = []
+
+    def read_tags(file_path, covers_dir=None):
+        read.append(os.path.basename(file_path))
+        with open(file_path, encoding="utf-8") as f:
+            tags = json.load(f)
+        return {"duration": 60.0, "cover_path": None, **tags}, 100
+
+    monkeypatch.setattr(libraryIndex, "read_tags", read_tags)
+    return read
+
+@pytest.fixture
+def library(tmp_path, reads):
+    folder = tmp_path / "books"
+    folder.mkdir()
+    for name, tags in BOOKS.items():
+        (folder / name).write_text(json.dumps(tags), encoding="utf-8")
+    index = LibraryIndex(str(tmp_path / "index.db"), str(tmp_path / "covers"))
+    index.rescan(str(folder), workers=2)
+    yield index, folder
+    index.close()
+
+def titles(books):
+    return [book["title"] for book in books]
+
+def test_rescan_reads_only_changed_books(library, reads):
+    index, folder = library
+    assert sorted(reads) == sorted(BOOKS)
+    assert index.last_scan["files"] == len(BOOKS)
+
+    reads.clear()
+    assert index.rescan(str(folder)) == (0, 0)
+    assert reads == []
+
+    (folder / "dune.m4b").write_text(json.dumps({**BOOKS["dune.m4b"], "title": "Dune (Unabridged)"}))
+    os.remove(folder / "hobbit.m4b")
+    (folder / "notes.txt").write_text("not a book")
+
+    assert index.rescan(str(folder)) == (1, 1)
+    assert reads == ["dune.m4b"]
+    assert titles(index.search("dune")) == ["Dune (Unabridged)", "Dune Messiah"]
+    assert index.search("hobbit") == []
+
+def test_search_whole_words_rank_above_prefixes(library):
+    index, _ = library
+    assert titles(index.search("dune")) == ["Dune", "Dune Messiah"]
+    assert titles(index.search("found")) == ["Foundation"]
+    # Every word has to match when some book matches them all
+    assert titles(index.search("herbert messiah")) == ["Dune Messiah"]
+    assert titles(index.search("tolkien", limit=1)) == ["The Hobbit"]
+    assert index.search("  !! ") == []
+
+def test_search_tolerates_misspellings(library):
+    index, _ = library
+    assert titles(index.search("silmarilion")) == ["The Silmarillion"]
+    assert titles(index.search("asimof foundation")) == ["Foundation"]
+    assert index.search("zzzzzz") == []
+
+def test_search_within_facet(library):
+    index, _ = library
+    assert titles(index.search("the", genre="Fantasy")) == ["The Hobbit", "The Silmarillion"]
+    assert titles(index.search("dune", author="Isaac Asimov")) == []
+    assert titles(index.browse(author="Frank Herbert")) == ["Dune", "Dune Messiah"]
+
+def test_facets(library):
+    index, folder = library
+    assert index.facets() == {
+        "genres": [("Science Fiction", 3), ("Fantasy", 2)],
+        "authors": [("Frank Herbert", 2), ("J. R. R. Tolkien", 2), ("Isaac Asimov", 1)],
+    }
+
+    os.remove(folder / "foundation.m4b")
+    index.rescan(str(folder))
+    assert index.facets()["authors"] == [("Frank Herbert", 2), ("J. R. R. Tolkien", 2)]
+
+def test_index_persists(library, tmp_path, reads):
+    index, folder = library
+    reopened = LibraryIndex(str(tmp_path / "index.db"), str(tmp_path / "covers"))
+    try:
+        assert titles(reopened.search("hobbit")) == ["The Hobbit"]
+        reads.clear()
+        assert reopened.rescan(str(folder)) == (0, 0)
+        assert reads == []
+    finally:
+        reopened.close()
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_read_tags_from_m4b(tmp_path):
+    path = str(tmp_path / "book.m4b")
+    subprocess.run([
+        "ffmpeg", "-v", "error", "-f", "lavfi", "-i", "anullsrc=r=22050:cl=mono", "-t", "2",
+        "-c:a", "aac", "-metadata", "title=Tagged Book", "-metadata", "artist=Tag Author",
+        "-metadata", "genre=Drama", "-f", "mp4", path,
+    ], check=True)
+
+    record, bytes_read = libraryIndex.read_tags(path, str(tmp_path / "covers"))
+
+    assert (record["title"], record["author"], record["genre"]) == ("Tagged Book", "Tag Author", "Drama")
+    assert record["duration"] == pytest.approx(2.0, abs=0.1)
+    assert record["cover_path"] is None
+    assert 0 < bytes_read < os.path.getsize(path)
@@ -0,0 +1,112 @@
+"""Tests for the frame-header MP3 check, on frames built by hand."""
+import shutil
+import subprocess
+
+import pytest
+
+import mp3Check
+
+SAMPLES = 1152  # Per MPEG-1 layer III frame
+BITRATE_INDEX = {32: 1, 64: 5, 128: 9, 320: 14}
+
+def header(kbps=128, padding=0, rate_index=0):
+    """An MPEG-1 layer III mono header without CRC."""
+    return (0xFFE00000 | 3 << 19 | 1 << 17 | 1 << 16 | BITRATE_INDEX[kbps] << 12
+            | rate_index << 10 | padding << 9 | 3 << 6)
+
+def frame(kbps=128, padding=0, rate_index=0, info=False):
+    value = header(kbps, padding, rate_index)
+    length = mp3Check.parse_header(value)[0]
+    payload = bytearray(length - 4)
+    if info:
+        payload[17:21] = b"Xing"  # After the mono MPEG-1 side info
+    return value.to_bytes(4, "big") + bytes(payload)
+
+def write(tmp_path, data, name="chapter.mp3"):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+def test_parse_header():
+    assert mp3Check.parse_header(header(128))[:3] == (417, SAMPLES, 44100)
+    assert mp3Check.parse_header(header(128, padding=1))[0] == 418
+    assert mp3Check.parse_header(header(320, rate_index=1))[0] == 960
+    assert mp3Check.parse_header(0x12345678) is None
+    assert mp3Check.parse_header(header(128) | 15 << 12) is None  # Invalid bitrate
+    assert mp3Check.parse_header(header(128) | 3 << 10) is None  # Reserved sample rate
+
+def test_cbr_file(tmp_path):
+    path = write(tmp_path, frame() * 100)
+
+    scan = mp3Check.scan_frames(path)
+    assert (scan.frames, scan.junk_bytes, scan.error) == (100, 0, None)
+    assert scan.duration == pytest.approx(100 * SAMPLES / 44100)
+    assert mp3Check.check(path, expected_seconds=100 * SAMPLES / 44100) is None
+    assert "expected 10.00s" in mp3Check.check(path, expected_seconds=10)
+
+def test_vbr_file_with_info_frame(tmp_path):
+    frames = [frame(info=True)] + [frame(kbps, i % 2) for i, kbps in enumerate([32, 320, 64, 128] * 25)]
+    path = write(tmp_path, b"".join(frames))
+
+    scan = mp3Check.scan_frames(path)
+    # The Xing/Info frame holds no audio and is not counted
+    assert (scan.frames, scan.error) == (100, None)
+    assert mp3Check.check(path, expected_seconds=100 * SAMPLES / 44100, tolerance=0.01) is None
+
+def test_id3_tags_are_skipped(tmp_path):
+    id3v2 = b"ID3\x04\x00\x00\x00\x00\x01\x00" + b"\x00" * 128
+    id3v1 = b"TAG" + b"\x00" * (mp3Check.ID3V1_SIZE - 3)
+    path = write(tmp_path, id3v2 + frame() * 10 + id3v1)
+
+    scan = mp3Check.scan_frames(path)
+    assert (scan.frames, scan.junk_bytes, scan.error) == (10, 0, None)
+
+def test_truncated_final_frame(tmp_path):
+    path = write(tmp_path, (frame() * 10)[:-100])
+
+    assert mp3Check.check(path) == "final frame truncated (317 of 417 bytes)"
+
+def test_junk_between_frames(tmp_path):
+    junk = b"overwritten by something else" * 3
+    path = write(tmp_path, frame() * 5 + junk + frame() * 5)
+
+    scan = mp3Check.scan_frames(path)
+    # The walk resyncs on the next frame, but the file is still reported
+    assert scan.frames == 10
+    assert scan.junk_bytes == len(junk)
+    assert mp3Check.check(path) == f"{len(junk)} bytes outside MP3 frames"
+
+def test_junk_starting_with_a_header_is_reported(tmp_path):
+    # Looks like a frame header, but its frame would run into the next real one
+    fake = header(64).to_bytes(4, "big") + b"\x01" * 20
+    path = write(tmp_path, frame() * 3 + fake + frame() * 3)
+
+    scan = mp3Check.scan_frames(path)
+    assert scan.junk_bytes > 0
+    assert mp3Check.check(path).endswith("bytes outside MP3 frames")
+
+def test_stream_change_is_an_error(tmp_path):
+    path = write(tmp_path, frame() * 5 + frame(rate_index=1) * 5)
+
+    assert mp3Check.check(path) is not None
+
+def test_empty_and_frameless_files(tmp_path):
+    assert mp3Check.check(write(tmp_path, b"", "empty.mp3")) == "empty file"
+    assert mp3Check.check(write(tmp_path, b"\x00" * 2048, "zeros.mp3")) == "no MP3 frames"
+    assert mp3Check.check(str(tmp_path / "missing.mp3")).startswith("unreadable")
+
+@pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="ffmpeg is not installed")
+def test_lame_vbr_file(tmp_path):
+    path = str(tmp_path / "vbr.mp3")
+    result = subprocess.run([
+        "ffmpeg", "-v", "error", "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100", "-t", "5",
+        "-c:a", "libmp3lame", "-q:a", "4", path,
+    ])
+    if result.returncode != 0:
+        pytest.skip("ffmpeg has no libmp3lame")
+
+    assert mp3Check.check(path, expected_seconds=5) is None
+
+    with open(path, "rb") as f:
+        data = f.read()
+    assert mp3Check.check(write(tmp_path, data[:-200], "cut.mp3")) is not None
@@ -0,0 +1,86 @@
+"""Tests for planning where oversized chapters are cut."""
+import subprocess
+
+import pytest
+
+import splitPlanner
+from splitPlanner import plan_span, plan_chapters, SILENCE_WINDOW
+
+def lengths(parts):
+    return [end - start for start, end in parts]
+
+def assert_covers(parts, start, end, max_seconds):
+    assert parts[0][0] == start and parts[-1][1] == end
+    assert all(a[1] == b[0] for a, b in zip(parts, parts[1:]))
+    assert all(0 < length <= max_seconds + 1e-9 for length in lengths(parts))
+
+def test_short_span_is_one_part():
+    assert plan_span(10, 100, 90) == [(10, 100)]
+
+def test_fewest_equal_parts():
+    parts = plan_span(0, 1000, 300)
+
+    assert len(parts) == 4
+    assert lengths(parts) == [250] * 4
+
+def test_cut_moves_to_preferred_point():
+    parts = plan_span(0, 1000, 600, preferred=[480, 700])
+
+    assert parts == [(0, 480), (480, 1000)]
+
+def test_preferred_point_outside_window_is_ignored():
+    far = 500 + SILENCE_WINDOW + 10
+    parts = plan_span(0, 1000, 600, preferred=[far])
+
+    assert parts == [(0, 500), (500, 1000)]
+
+def test_cut_moves_to_nearest_silence():
+    windows = []
+
+    def silence_finder(window_start, window_end):
+        windows.append((window_start, window_end))
+        return [470, 490, 545, 900]
+
+    parts = plan_span(0, 1000, 600, silence_finder=silence_finder)
+
+    assert parts == [(0, 490), (490, 1000)]
+    assert windows == [(500 - SILENCE_WINDOW, 500 + SILENCE_WINDOW)]
+
+def test_preferred_points_win_over_silence():
+    parts = plan_span(0, 1000, 600, preferred=[520], silence_finder=lambda a, b: [499])
+
+    assert parts == [(0, 520), (520, 1000)]
+
+def test_cut_never_makes_a_part_too_long():
+    # The only pauses would leave the last part 40 s too long
+    parts = plan_span(0, 1190, 600, silence_finder=lambda a, b: [a, 580])
+
+    assert_covers(parts, 0, 1190, 600)
+    assert parts[0][1] >= 590
+
+@pytest.mark.parametrize("start,end,max_seconds", [(0, 3601, 1200), (17.5, 9000.25, 777), (0, 100.5, 100)])
+def test_parts_cover_span(start, end, max_seconds):
+    parts = plan_span(start, end, max_seconds, silence_finder=lambda a, b: [a + 3, b - 1])
+
+    assert_covers(parts, start, end, max_seconds)
+
+def test_plan_chapters_uses_bitrate():
+    max_seconds = splitPlanner.max_segment_seconds(64000, max_bytes=8_000_000)
+    chapters = [{"start": 0, "end": 600}, {"start": 600, "end": 600 + max_seconds * 2.5}]
+
+    plans = plan_chapters(chapters, 64000, max_bytes=8_000_000)
+
+    assert plans[0] == [(0, 600)]
+    assert len(plans[1]) == 3
+    assert all(splitPlanner.predicted_size(length, 64000) <= 8_000_000 for length in lengths(plans[1]))
+
+def test_find_silences_parses_silencedetect():
+    stderr = ("[silencedetect @ 0x1] silence_start: 4.5\n[silencedetect @ 0x1] silence_end: 5.5 | silence_duration: 1\n"
+              "[silencedetect @ 0x1] silence_start: 20\n[silencedetect @ 0x1] silence_end: 21 | silence_duration: 1\n")
+
+    def run(cmd, **kwargs):
+        return subprocess.CompletedProcess(cmd, 0, stderr=stderr)
+
+    assert splitPlanner.find_silences("book.m4b", 100, 160, run=run) == [105.0, 120.5]
+    assert splitPlanner.find_silences("book.m4b", 100, 160,
+                                      run=lambda cmd, **kwargs: subprocess.CompletedProcess(cmd, 1, stderr="")) == []
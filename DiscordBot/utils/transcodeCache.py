@@ -0,0 +1,174 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import tempfile
+from contextlib import contextmanager
+
+LOCK_STRIPES = 64  # Lock files that segment keys are spread over
+
+class TranscodeCache:
+    """Content-addressed on-disk cache of transcoded segments with an LRU byte budget.
+
+    Entries are plain files named after the hash of their key. A hit bumps the
+    file's mtime, and eviction removes the oldest files until the cache fits in
+    max_bytes. An flock makes concurrent requests for the same segment, from
+    any thread or process, wait for a single transcode. Keys are hashed onto
+    LOCK_STRIPES lock files, so the lock files do not grow with the cache.
+    """
+
+    def __init__(self, cache_dir, max_bytes, suffix=".mp3"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.stats_path = os.path.join(cache_dir, "stats.json")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(source_id, start_time, duration, settings):
+        """Hashes everything that determines the content of a segment."""
+        raw = json.dumps([source_id, round(float(start_time), 3), round(float(duration), 3), settings])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def entry_path(self, key, suffix=None):
+        return os.path.join(self.cache_dir, key + (suffix or self.suffix))
+
+    @contextmanager
+    def locked(self, name):
+        with open(os.path.join(self.cache_dir, name + ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def stripe(key):
+        """The lock file name a segment key is guarded by."""
+        return f"segment{int(key[:8], 16) % LOCK_STRIPES:02d}"
+
+    def get_or_create(self, key, create, dest=None, suffix=None):
+        """Returns the cached path for key, calling create(temp_path) to fill it on a miss.
+
+        create must write the segment to temp_path and return True on success.
+        If dest is given the segment is also linked there before anything can
+        be evicted. suffix overrides the file extension for segments in
+        another format. Returns None if create fails.
+        """
+        suffix = suffix or self.suffix
+        path = self.entry_path(key, suffix)
+        if self.touch(path) and self.expose(path, dest):
+            self.count("hits")
+            return path
+
+        with self.locked(self.stripe(key)):
+            # Someone else may have produced it while we waited
+            if self.touch(path) and self.expose(path, dest):
+                self.count("hits")
+                return path
+
+            self.count("misses")
+            fd, temp_path = tempfile.mkstemp(prefix=".tmp_", suffix=suffix, dir=self.cache_dir)
+            os.close(fd)
+            try:
+                if not create(temp_path):
+                    return None
+                os.replace(temp_path, path)  # Readers never see a half-written segment
+                if dest is not None:
+                    link_or_copy(path, dest)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+        self.evict(keep=path)
+        return path
+
+    def expose(self, path, dest):
+        """Links a cached segment to dest, if given. Returns False if it was evicted in the meantime."""
+        if dest is None:
+            return True
+        try:
+            link_or_copy(path, dest)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def touch(self, path):
+        """Marks an entry as recently used. Returns False if it is not cached."""
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def entries(self):
+        """Returns (mtime, size, path) for every cached segment."""
+        result = []
+        for entry in os.scandir(self.cache_dir):
+            # Segments of every format count against the budget
+            if entry.name.startswith(".tmp_") or entry.name.endswith(".lock") or entry.name == "stats.json":
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            result.append((stat.st_mtime, stat.st_size, entry.path))
+        return result
+
+    def evict(self, keep=None):
+        """Removes least recently used segments until the cache fits in max_bytes."""
+        with self.locked("evict"):
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+                evicted += 1
+        if evicted:
+            self.count("evictions", evicted)
+
+    def count(self, name, amount=1):
+        with self.locked("stats"):
+            stats = self.read_stats()
+            stats[name] = stats.get(name, 0) + amount
+            with open(self.stats_path, "w") as f:
+                json.dump(stats, f)
+
+    def read_stats(self):
+        try:
+            with open(self.stats_path, "r") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def stats(self):
+        """Returns hit/miss/eviction counters plus the current size of the cache."""
+        stats = self.read_stats()
+        entries = self.entries()
+        lookups = stats.get("hits", 0) + stats.get("misses", 0)
+        return {
+            "hits": stats.get("hits", 0),
+            "misses": stats.get("misses", 0),
+            "evictions": stats.get("evictions", 0),
+            "hit_rate": stats.get("hits", 0) / lookups if lookups else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+            "max_bytes": self.max_bytes,
+        }
+
+def link_or_copy(src, dst):
+    """Exposes a cached segment at dst without duplicating it when possible."""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)